@@ -1,16 +1,45 @@
 # app.py
 from __future__ import annotations
 
+import abc
+import argparse
+import asyncio
+import bisect
+import bz2
+import cProfile
+import codecs
+import contextlib
+import contextvars
 import csv
+import functools
+import gc
+import gzip
+import hashlib
+import hmac
+import itertools
 import io
 import json
 import os
 import re
-from typing import List, Dict, Tuple
-from urllib.parse import quote
+import shutil
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Dict, Tuple
+from urllib.parse import parse_qs, quote
+from urllib.request import pathname2url
 
 import requests
-from flask import Flask, Response, make_response, render_template_string, request
+from flask import Flask, Response, make_response, redirect, render_template_string, request, send_file
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
 
 app = Flask(__name__)
 
@@ -31,6 +60,297 @@ def _abs_norm(path: str) -> str:
     return os.path.normpath(os.path.abspath(path))
 
 
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, "") or default)
+    except ValueError:
+        return default
+
+
+# 索引・キャッシュなど、生成物の置き場所
+_DATA_DIR = os.path.join(_APP_DIR, "data")
+
+
+def _metric_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    ]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metrics:
+    """
+    Prometheus のテキスト形式で出すカウンタとヒストグラム。
+    記録は (名前, ラベル) ごとの数を足すだけで、ロックを持つのはその加算の間だけ（バケットの位置はロックの外で探す）。
+    state_dir を指定すると flush() で自分の値を <pid>.json に書き出し、render() は他のプロセスの分も足し合わせる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._counters: Dict[tuple, float] = {}
+        # ヒストグラムは [各バケット（累積でない）..., +Inf, 合計, 件数]
+        self._hists: Dict[tuple, List[float]] = {}
+        self.state_dir = ""
+
+    def counter(self, name: str, help_: str) -> None:
+        self._meta[name] = ("counter", help_)
+
+    def histogram(self, name: str, help_: str, buckets: Iterable[float]) -> None:
+        self._meta[name] = ("histogram", help_)
+        self._buckets[name] = tuple(sorted(buckets))
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = self._buckets[name]
+        i = bisect.bisect_left(buckets, value)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0.0] * (len(buckets) + 3)
+            h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def _snapshot(self) -> Tuple[Dict[tuple, float], Dict[tuple, List[float]]]:
+        with self._lock:
+            return (dict(self._counters), {k: list(v) for k, v in self._hists.items()})
+
+    def flush(self) -> None:
+        if not self.state_dir:
+            return
+        counters, hists = self._snapshot()
+        state = {
+            "counters": [[k[0], list(k[1]), v] for k, v in counters.items()],
+            "hists": [[k[0], list(k[1]), v] for k, v in hists.items()],
+        }
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".metrics-", dir=self.state_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(state, fh)
+            os.replace(tmp, os.path.join(self.state_dir, "%d.json" % os.getpid()))
+        except OSError:
+            pass
+
+    def reset(self) -> None:
+        """このプロセスの値を 0 に戻す（fork 直後のワーカーが親の値を引き継がないように）。"""
+        with self._lock:
+            self._counters.clear()
+            self._hists.clear()
+
+    def forget(self, pid: int) -> None:
+        """終了したプロセスの <pid>.json を消す（同じ pid が再利用されても古い値が混ざらないように）。"""
+        if not self.state_dir:
+            return
+        try:
+            os.remove(os.path.join(self.state_dir, "%d.json" % pid))
+        except OSError:
+            pass
+
+    def _merged(self) -> Tuple[Dict[tuple, float], Dict[tuple, List[float]]]:
+        counters, hists = self._snapshot()
+        if not self.state_dir or not os.path.isdir(self.state_dir):
+            return (counters, hists)
+        own = "%d.json" % os.getpid()
+        for fn in os.listdir(self.state_dir):
+            if fn == own or not fn.endswith(".json") or fn.startswith("."):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, fn), encoding="utf-8") as fh:
+                    state = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for name, labels, v in state.get("counters", []):
+                key = (name, tuple(tuple(kv) for kv in labels))
+                counters[key] = counters.get(key, 0.0) + v
+            for name, labels, v in state.get("hists", []):
+                key = (name, tuple(tuple(kv) for kv in labels))
+                h = hists.get(key)
+                if h is None:
+                    hists[key] = list(v)
+                elif len(h) == len(v):
+                    hists[key] = [a + b for a, b in zip(h, v)]
+        return (counters, hists)
+
+    def render(self, gauges: Iterable[Tuple[str, str, Dict[str, str], float]] = ()) -> str:
+        """gauges は (名前, 説明, ラベル, 値) の並び。スクレイプの時点の値をそのまま出す。"""
+        counters, hists = self._merged()
+        out: List[str] = []
+        for name, (kind, help_) in sorted(self._meta.items()):
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), v in sorted(counters.items()):
+                    if n == name:
+                        out.append(f"{name}{_metric_labels(labels)} {v:g}")
+                continue
+            buckets = self._buckets[name]
+            for (n, labels), h in sorted(hists.items()):
+                if n != name:
+                    continue
+                acc = 0.0
+                for b, c in zip(buckets + (float("inf"),), h):
+                    acc += c
+                    le = 'le="%s"' % ("+Inf" if b == float("inf") else f"{b:g}")
+                    out.append(f"{name}_bucket{_metric_labels(labels, le)} {acc:g}")
+                out.append(f"{name}_sum{_metric_labels(labels)} {h[-2]:.6f}")
+                out.append(f"{name}_count{_metric_labels(labels)} {h[-1]:g}")
+        seen = set()
+        for name, help_, labels, v in gauges:
+            if name not in seen:
+                seen.add(name)
+                out.append(f"# HELP {name} {help_}")
+                out.append(f"# TYPE {name} gauge")
+            out.append(f"{name}{_metric_labels(tuple(sorted(labels.items())))} {v:g}")
+        return "\n".join(out) + "\n"
+
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_METRICS = _Metrics()
+_METRICS.counter("wordbook_http_requests_total", "HTTP requests by route, method and status.")
+_METRICS.histogram("wordbook_http_request_duration_seconds", "Time to serve a request, including streaming the body.",
+                   _LATENCY_BUCKETS)
+_METRICS.counter("wordbook_http_response_bytes_total", "Response body bytes sent, by route.")
+_METRICS.counter("wordbook_upstream_requests_total", "Wiktionary fetches by HTTP status (or error).")
+_METRICS.histogram("wordbook_upstream_request_duration_seconds", "Wiktionary fetch latency (after rate limiting).",
+                   _LATENCY_BUCKETS)
+_METRICS.histogram("wordbook_lookup_variants_tried", "Spelling variants fetched per network lookup.", (1, 2, 3, 4, 5))
+_METRICS.counter("wordbook_pdf_pages_rendered_total", "PDF pages drawn.")
+_METRICS.counter("wordbook_pdf_cache_hits_total", "PDF cache hits served from memory.")
+_METRICS.counter("wordbook_pdf_cache_disk_hits_total", "PDF cache hits served from disk.")
+_METRICS.counter("wordbook_pdf_cache_misses_total", "PDF cache misses.")
+_METRICS.counter("wordbook_pdf_layout_memo_hits_total", "Meaning-cell layouts reused from the memo.")
+_METRICS.counter("wordbook_pdf_layout_memo_misses_total", "Meaning-cell layouts computed.")
+_METRICS.counter("wordbook_upstream_limiter_granted_total", "Upstream rate limiter tokens granted.")
+_METRICS.counter("wordbook_upstream_limiter_rejected_total", "Upstream requests rejected because the wait queue was full.")
+_METRICS.counter("wordbook_upstream_limiter_timeouts_total", "Upstream requests that gave up waiting for a token.")
+_METRICS.counter("wordbook_upstream_limiter_wait_seconds_total", "Time spent waiting for upstream tokens.")
+_METRICS.counter("wordbook_lookup_backend_calls_total", "Lookups tried per backend.")
+_METRICS.counter("wordbook_lookup_backend_hits_total", "Lookups that found a meaning, per backend.")
+
+
+def _record_http(route: str, method: str, status: int, size: int, seconds: float) -> None:
+    _METRICS.observe("wordbook_http_request_duration_seconds", seconds, route=route)
+    _METRICS.inc("wordbook_http_requests_total", route=route, method=method, status=str(status))
+    if size:
+        _METRICS.inc("wordbook_http_response_bytes_total", size, route=route)
+
+
+def _record_upstream(status: str, seconds: float) -> None:
+    _METRICS.observe("wordbook_upstream_request_duration_seconds", seconds)
+    _METRICS.inc("wordbook_upstream_requests_total", status=status)
+
+
+# WORDBOOK_SLOW_REQUEST_MS を超えたリクエストの span の木を JSONL に追記する（0 以下なら記録しない）
+_SLOW_REQUEST_MS = _env_float("WORDBOOK_SLOW_REQUEST_MS", 0.0)
+_SLOW_LOG_PATH = os.environ.get("WORDBOOK_SLOW_LOG") or os.path.join(_DATA_DIR, "slow-requests.jsonl")
+_SLOW_LOG_LOCK = threading.Lock()
+_TRACE_SPAN: "contextvars.ContextVar[_Span | None]" = contextvars.ContextVar("wordbook_span", default=None)
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: Dict[str, object]):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = 0.0
+        self.children: List[_Span] = []
+
+    def set(self, **attrs: object) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self, t0: float) -> Dict[str, object]:
+        d: Dict[str, object] = {
+            "name": self.name,
+            "start_ms": round((self.start - t0) * 1000, 3),
+            "ms": round(((self.end or time.perf_counter()) - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            d["attrs"] = self.attrs
+        if self.children:
+            d["children"] = [c.to_dict(t0) for c in self.children]
+        return d
+
+
+class _NullSpan:
+    def set(self, **attrs: object) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextlib.contextmanager
+def _span(name: str, **attrs: object):
+    """いま計測中のリクエストがあれば、その下に子の span を作る。なければ何もしない。"""
+    parent = _TRACE_SPAN.get()
+    if parent is None:
+        yield _NULL_SPAN
+        return
+    sp = _Span(name, attrs)
+    parent.children.append(sp)
+    token = _TRACE_SPAN.set(sp)
+    try:
+        yield sp
+    finally:
+        sp.end = time.perf_counter()
+        _TRACE_SPAN.reset(token)
+
+
+def _trace_start(name: str, **attrs: object) -> "Tuple[_Span, contextvars.Token] | None":
+    if _SLOW_REQUEST_MS <= 0:
+        return None
+    root = _Span(name, attrs)
+    return (root, _TRACE_SPAN.set(root))
+
+
+def _trace_finish(handle: "Tuple[_Span, contextvars.Token] | None", **attrs: object) -> None:
+    if handle is None:
+        return
+    root, token = handle
+    root.end = time.perf_counter()
+    root.attrs.update(attrs)
+    try:
+        _TRACE_SPAN.reset(token)
+    except ValueError:
+        # 別のコンテキストで作った token は戻せない。ここで None を入れると無関係なコンテキストを書き換えるので触らない
+        pass
+    ms = (root.end - root.start) * 1000
+    if ms < _SLOW_REQUEST_MS:
+        return
+    line = json.dumps(
+        {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "pid": os.getpid(), "ms": round(ms, 3),
+         "trace": root.to_dict(root.start)},
+        ensure_ascii=False,
+    )
+    try:
+        with _SLOW_LOG_LOCK:
+            os.makedirs(os.path.dirname(_SLOW_LOG_PATH) or ".", exist_ok=True)
+            with open(_SLOW_LOG_PATH, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+    except OSError as e:
+        print(f"slow request log failed: {e!r}", file=sys.stderr)
+
+
 # 後方互換・参照用（実際の走査は都度 _pick_wordbook_preset_base() を使う）
 _DEFAULT_PRESET_DIR = _abs_norm(os.path.join(_APP_DIR, "..", "既存のwordbook"))
 WORDBOOK_PRESET_DIR = os.environ.get("WORDBOOK_PRESET_DIR", _DEFAULT_PRESET_DIR)
@@ -41,13 +361,15 @@ def _iter_preset_csv_rel_paths(base: str) -> List[str]:
         return []
     base_real = os.path.realpath(base)
     out: List[str] = []
-    for root, _dirs, filenames in os.walk(base_real):
-        for fn in filenames:
-            if not fn.lower().endswith(".csv"):
-                continue
-            full = os.path.join(root, fn)
-            rel = os.path.relpath(full, base_real).replace("\\", "/")
-            out.append(rel)
+    with _span("preset.scan", base=base_real) as sp:
+        for root, _dirs, filenames in os.walk(base_real):
+            for fn in filenames:
+                if not fn.lower().endswith(".csv"):
+                    continue
+                full = os.path.join(root, fn)
+                rel = os.path.relpath(full, base_real).replace("\\", "/")
+                out.append(rel)
+        sp.set(files=len(out))
     return sorted(out)
 
 
@@ -187,6 +509,8 @@ HTML = r"""
       opacity:.65;cursor:not-allowed;background:#f1f5f9;
     }
     .quiz-book-hint{margin:0;font-size:12px;line-height:1.5;color:#475569;text-align:left;}
+    .quiz-book-actions{display:flex;gap:8px;}
+    .quiz-book-actions .rbtn{font-size:13px;padding:8px 12px;}
     .mode-tabs{display:flex;background:#e2e8f0;border-radius:10px;padding:3px;gap:2px;}
     .mode-tab{
       padding:8px 18px;border-radius:8px;font-size:13px;font-weight:600;
@@ -436,6 +760,7 @@ HTML = r"""
           </div>
         </div>
         <div class="quiz-book-hint" id="quizBookHint"></div>
+        <div class="quiz-book-actions"><a class="rbtn" id="quizBookPdf" href="#" style="display:none">このCSVをPDFで出力</a></div>
       </div>
     </div>
     <div class="quiz-container">
@@ -487,7 +812,7 @@ HTML = r"""
           <div class="voicehint" id="voiceHint"></div>
         </div>
         <div class="hint" id="hint"></div>
-        <div class="muted" id="storageNote">データはこのブラウザ内に保存されます。</div>
+        <div class="muted" id="storageNote">データはこのブラウザ内に保存されます。{% if sync_enabled %}<span id="syncOff"><a href="#" id="syncEnable">サーバーにも同期する</a></span><span id="syncOn" hidden>サーバーにも同期されます。同期キー: <code id="syncUser"></code> <a href="#" id="syncUserChange">別の端末のキーを使う</a> <a href="#" id="syncDisable">同期をやめる</a></span> <span id="syncError"></span>{% endif %}</div>
       </div>
       <div class="card">
         <table>
@@ -506,9 +831,14 @@ HTML = r"""
   const LKEY = "wordbook_quiz_lang_v1";
   const QBOOK_KEY = "wordbook_quiz_book_v1";
   const QBOOK_KEY_LEGACY = "wordbook_active_book_v1";
+  const SYNC_KEY = "wordbook_sync_v1";
+  const SYNC_USER_KEY = "wordbook_sync_user_v1";
+  const SYNC_ON_KEY = "wordbook_sync_on_v1";
+  const SYNC_AVAILABLE = {{ "true" if sync_enabled else "false" }};
 
   const $ = id => document.getElementById(id);
   const quizBookCategory=$("quizBookCategory"),quizBookFile=$("quizBookFile"),quizBookHint=$("quizBookHint"),storageNote=$("storageNote");
+  const quizBookPdf=$("quizBookPdf");
   let presetItems=[];
   let presetCsvCount=null;
   let presetFoldersData=null;
@@ -593,11 +923,228 @@ HTML = r"""
   }
 
   /* ── Shared helpers ── */
-  function loadItems(){
-    try{const r=localStorage.getItem(KEY);if(!r)return[];const v=JSON.parse(r);
-    if(!Array.isArray(v))return[];return v.filter(x=>x&&typeof x.word==="string"&&typeof x.meaning==="string");}catch{return[];}
+  /* ── Personal wordbook store ──
+     メモリ上の book が正。編集は put / del / clear の変更として book に当て、同じ変更を pending に積んで
+     /api/sync へ差分だけ送る。サーバーから返った差分も同じ形で book に当てる。
+     同期はサーバーが許可していて（WORDBOOK_SYNC=1）、利用者が有効にした端末だけ。それ以外は pending も積まない。
+     端末側は IndexedDB に1語1レコード（items、word に索引）で置き、変わったレコードだけを書く。
+     未送信の変更は pending ストア、同期済みの version は meta ストア。IndexedDB が使えないときだけ
+     従来どおり localStorage に全体を書く。 */
+  const IDB_NAME="wordbook",IDB_VERSION=1;
+  let book=null,bookIds=new Map(),syncState=null,idb=null,nextSeq=1,bookReady=null;
+  let persistTimer=null,syncTimer=null,syncBusy=false;
+  const SYNC_BATCH=2000;
+
+  function newId(){
+    if(window.crypto&&crypto.randomUUID)return crypto.randomUUID().replaceAll("-","");
+    return Date.now().toString(36)+Math.random().toString(36).slice(2)+Math.random().toString(36).slice(2);
+  }
+  function syncUser(){
+    let u="";try{u=localStorage.getItem(SYNC_USER_KEY)||"";}catch{}
+    if(!/^[A-Za-z0-9_-]{8,64}$/.test(u)){u=newId();try{localStorage.setItem(SYNC_USER_KEY,u);}catch{}}
+    return u;
+  }
+  function syncOn(){
+    if(!SYNC_AVAILABLE)return false;
+    try{return localStorage.getItem(SYNC_ON_KEY)==="1";}catch{return false;}
+  }
+  function putOp(it){return {op:"put",id:it.id,word:it.word,meaning:it.meaning};}
+
+  function idbReq(r){return new Promise((res,rej)=>{r.onsuccess=()=>res(r.result);r.onerror=()=>rej(r.error);});}
+  function idbDone(tx){return new Promise((res,rej)=>{tx.oncomplete=()=>res();tx.onerror=tx.onabort=()=>rej(tx.error);});}
+  function openIdb(){
+    return new Promise(res=>{
+      if(!window.indexedDB){res(null);return;}
+      let r;
+      try{r=indexedDB.open(IDB_NAME,IDB_VERSION);}catch{res(null);return;}
+      r.onupgradeneeded=()=>{
+        const db=r.result;
+        db.createObjectStore("items",{keyPath:"id"}).createIndex("word","word");
+        db.createObjectStore("pending",{autoIncrement:true});
+        db.createObjectStore("meta");
+      };
+      r.onsuccess=()=>res(r.result);
+      r.onerror=r.onblocked=()=>res(null);
+    });
+  }
+  function idbTx(){return idb.transaction(["items","pending","meta"],"readwrite");}
+  function setBook(items,state){
+    book=items;bookIds=new Map();
+    book.forEach(it=>{if(!(it.seq>0))it.seq=nextSeq;nextSeq=Math.max(nextSeq,it.seq+1);bookIds.set(it.id,it);});
+    syncState=state;
+  }
+  function loadBlob(){
+    let items=[],state=null;
+    try{const v=JSON.parse(localStorage.getItem(KEY)||"[]");
+      if(Array.isArray(v))items=v.filter(x=>x&&typeof x.word==="string"&&typeof x.meaning==="string")
+        .map(x=>({id:typeof x.id==="string"&&x.id?x.id:newId(),word:x.word,meaning:x.meaning}));}catch{}
+    try{const s=JSON.parse(localStorage.getItem(SYNC_KEY)||"null");
+      if(s&&Number.isInteger(s.version)&&Array.isArray(s.pending))state=s;}catch{}
+    // 同期を始める前から記録してある単語は、最初の同期でまとめてサーバーへ送る
+    setBook(items,state||{version:0,pending:syncOn()?items.map(putOp):[]});
+    return !state;
+  }
+  async function migrateBlob(){
+    // localStorage の1つの JSON に入っていた単語帳を IndexedDB へ移し、移し終えたら消す
+    loadBlob();
+    const tx=idbTx(),items=tx.objectStore("items"),pending=tx.objectStore("pending"),meta=tx.objectStore("meta");
+    book.forEach(it=>items.put(it));
+    syncState.pending.forEach(ch=>pending.add(ch));
+    meta.put(syncState.version,"version");
+    meta.put(true,"migrated");
+    await idbDone(tx);
+    try{localStorage.removeItem(KEY);localStorage.removeItem(SYNC_KEY);}catch{}
+  }
+  async function openBook(){
+    idb=await openIdb();
+    if(idb){
+      try{
+        const tx=idb.transaction(["items","pending","meta"],"readonly");
+        const [items,pending,version,migrated]=await Promise.all([
+          idbReq(tx.objectStore("items").getAll()),idbReq(tx.objectStore("pending").getAll()),
+          idbReq(tx.objectStore("meta").get("version")),idbReq(tx.objectStore("meta").get("migrated"))]);
+        if(!migrated){await migrateBlob();return;}
+        setBook(items.sort((a,b)=>a.seq-b.seq),{version:version||0,pending});
+        return;
+      }catch{idb=null;}
+    }
+    if(loadBlob())persistBook();
+  }
+  function loadItems(){return book||[];}
+
+  function flushBook(){
+    if(persistTimer){clearTimeout(persistTimer);persistTimer=null;}
+    try{localStorage.setItem(KEY,JSON.stringify(book));localStorage.setItem(SYNC_KEY,JSON.stringify(syncState));}catch{}
+  }
+  function persistBook(){if(!persistTimer)persistTimer=setTimeout(flushBook,300);}
+  window.addEventListener("pagehide",()=>{if(persistTimer)flushBook();});
+
+  /* ids の単語の今の状態（無ければ削除）と、同期の状態を書く。wipe なら items を空にしてから全件を書く。
+     acked は送信が済んで pending の先頭から消す件数、rewrite なら pending を syncState.pending で置き換える。 */
+  function storeState(ids,{wipe=false,acked=0,rewrite=false,added=[]}={}){
+    if(!idb){persistBook();return;}
+    try{
+      const tx=idbTx(),items=tx.objectStore("items"),pending=tx.objectStore("pending");
+      if(wipe){items.clear();book.forEach(it=>items.put(it));}
+      else ids.forEach(id=>{const it=bookIds.get(id);if(it)items.put(it);else items.delete(id);});
+      if(rewrite){pending.clear();syncState.pending.forEach(ch=>pending.add(ch));}
+      else{
+        if(acked>0){
+          let n=0;
+          pending.openCursor().onsuccess=e=>{const c=e.target.result;if(!c||n>=acked)return;c.delete();n++;c.continue();};
+        }
+        added.forEach(ch=>{if(ch.op==="clear")pending.clear();pending.add(ch);});
+      }
+      tx.objectStore("meta").put(syncState.version,"version");
+    }catch{}
+  }
+
+  function applyChange(ch){
+    if(ch.op==="clear"){book.length=0;bookIds.clear();return;}
+    const cur=bookIds.get(ch.id);
+    if(ch.op==="del"){if(cur){book.splice(book.indexOf(cur),1);bookIds.delete(ch.id);}return;}
+    if(cur){cur.word=ch.word;cur.meaning=ch.meaning;return;}
+    const it={id:ch.id,word:ch.word,meaning:ch.meaning,seq:nextSeq++};book.push(it);bookIds.set(it.id,it);
+  }
+  function commitChanges(changes){
+    if(!book){void bookReady.then(()=>commitChanges(changes));return;}
+    const ids=new Set(),queue=syncOn();let wipe=false;
+    changes.forEach(ch=>{
+      applyChange(ch);
+      if(ch.op==="clear"){
+        // 全消去より前の未送信の変更は送る必要がない
+        syncState.pending=[];wipe=true;ids.clear();
+      }else ids.add(ch.id);
+      if(queue)syncState.pending.push(ch);
+    });
+    storeState(ids,{wipe,added:queue?changes:[]});scheduleSync();
+  }
+  function addItems(list){commitChanges(list.map(x=>putOp({id:newId(),word:x.word,meaning:x.meaning})));}
+  function deleteItem(id){commitChanges([{op:"del",id}]);}
+  function replaceItems(list){commitChanges([{op:"clear"}].concat(list.map(x=>putOp({id:newId(),word:x.word,meaning:x.meaning}))));}
+
+  function scheduleSync(delay){
+    if(syncTimer)clearTimeout(syncTimer);
+    if(!syncOn())return;
+    syncTimer=setTimeout(()=>{syncTimer=null;void syncNow();},delay==null?500:delay);
+  }
+  async function syncNow(){
+    await bookReady;
+    if(!syncOn())return;
+    if(syncBusy){scheduleSync(1000);return;}
+    syncBusy=true;
+    const user=syncUser(),queued=syncState.pending,sent=queued.slice(0,SYNC_BATCH);
+    let d=null,status=0;
+    try{
+      const r=await fetch("/api/sync",{method:"POST",headers:{"Content-Type":"application/json"},
+        body:JSON.stringify({user,since:syncState.version,changes:sent})});
+      status=r.status;d=await r.json();
+    }catch{d=null;}
+    syncBusy=false;
+    if(user!==syncUser()||!syncOn())return;
+    if(d&&!d.ok&&[404,413,507].includes(status)){
+      // 無効・上限はすぐには直らないので自動では送り直さない（次の編集や表示のときにまた試す）
+      showSyncError(d.error);return;
+    }
+    if(!d||!d.ok){scheduleSync(15000);return;}
+    showSyncError("");
+    // 送信中に全消去されていれば、送った分は pending から既に外れている
+    const acked=syncState.pending===queued?sent.length:0;
+    syncState.pending.splice(0,acked);
+    const rest=syncState.pending;
+    let rewrite=false,wipe=rest.some(ch=>ch.op==="clear");
+    if(d.reset==="purged"){
+      // サーバーが削除の記録を捨てたので、他の端末での削除を知るには全件で置き換えるしかない
+      // （未送信の変更は下で当て直し、pending もそのまま残す）
+      applyChange({op:"clear"});wipe=true;
+    }else if(d.reset){
+      // サーバーのデータが失われたときだけ、サーバー側に無い単語を送り直す
+      const known=new Set(d.changes.map(c=>c.id));
+      syncState.pending=book.filter(it=>!known.has(it.id)).map(putOp).concat(rest);
+      rewrite=true;
+    }
+    const ids=new Set(d.changes.map(c=>c.id));
+    d.changes.forEach(c=>applyChange(c.deleted?{op:"del",id:c.id}:putOp(c)));
+    // 送信中に記録した変更は、サーバーの差分より後に起きたものとして当て直す
+    rest.forEach(applyChange);
+    syncState.version=d.version;
+    storeState(ids,{acked,rewrite,wipe});
+    if((d.changes.length||wipe)&&curMode==="record")renderTable();
+    if(syncState.pending.length)scheduleSync(0);
+  }
+  async function changeSyncUser(){
+    const u=(prompt("別の端末の同期キーを入力してください（この端末の単語もその単語帳へ送られます）",syncUser())||"").trim();
+    if(!u||u===syncUser())return;
+    if(!/^[A-Za-z0-9_-]{8,64}$/.test(u)){alert("同期キーの形式が正しくありません");return;}
+    await bookReady;
+    try{localStorage.setItem(SYNC_USER_KEY,u);}catch{}
+    syncState={version:0,pending:book.map(putOp)};
+    storeState([],{rewrite:true});showSyncUser();void syncNow();
   }
-  function saveItems(a){localStorage.setItem(KEY,JSON.stringify(a));}
+  async function setSyncOn(on){
+    if(on&&!confirm("この端末の単語をサーバーにも保存し、同期キーを使う他の端末と共有します。よろしいですか？"))return;
+    await bookReady;
+    try{if(on)localStorage.setItem(SYNC_ON_KEY,"1");else localStorage.removeItem(SYNC_ON_KEY);}catch{}
+    // 有効にしたら手元の全件を送ってサーバー側の単語と合わせる。やめたら未送信の変更も捨てる
+    syncState={version:0,pending:syncOn()?book.map(putOp):[]};
+    storeState([],{rewrite:true});showSyncUser();showSyncError("");
+    void syncNow();
+  }
+  function showSyncUser(){
+    const on=syncOn();
+    if($("syncOn"))$("syncOn").hidden=!on;
+    if($("syncOff"))$("syncOff").hidden=on;
+    if(on&&$("syncUser"))$("syncUser").textContent=syncUser();
+  }
+  function showSyncError(code){
+    const el=$("syncError");if(!el)return;
+    el.textContent=!code?"":
+      code==="user_full"?"（この同期キーの単語が上限に達したため同期できません）":
+      code==="sync_disabled"?"（サーバーで同期が無効になっています）":
+      "（サーバーの保存容量が上限に達したため同期できません）";
+  }
+  document.addEventListener("visibilitychange",()=>{if(document.visibilityState==="visible")scheduleSync(0);});
+
   function esc(s){return s.replaceAll("&","&amp;").replaceAll("<","&lt;").replaceAll(">","&gt;").replaceAll('"',"&quot;").replaceAll("'","&#39;");}
 
   /* ── Speech ── */
@@ -628,7 +1175,7 @@ HTML = r"""
     if(v)u.voice=v;else u.lang="en-US";u.rate=1;u.pitch=1;window.speechSynthesis.speak(u);
   }
   voiceSelect.addEventListener("change",()=>{saveVC(voiceSelect.value||"");const v=getSelVoice();voiceHint.textContent=v?("現在："+v.name+"（"+v.lang+"）"):"";});
-  if(canSpeak())window.speechSynthesis.onvoiceschanged=()=>{rebuildVoiceSelect();renderTable();};
+  if(canSpeak())window.speechSynthesis.onvoiceschanged=()=>{rebuildVoiceSelect();renderTable(true);};
   rebuildVoiceSelect();
 
   const quizArea=$("quizArea");
@@ -827,6 +1374,12 @@ HTML = r"""
   function setHint(s){hint.textContent=s||"";}
 
   function updateQuizBookHint(){
+    if(quizBookPdf){
+      /* プリセットはサーバー側で CSV から直接 PDF にする（単語の一覧を往復させない） */
+      const rel=isPresetQuizBook()?quizBookFile.value.slice(7):"";
+      quizBookPdf.style.display=rel?"":"none";
+      quizBookPdf.href=rel?"/api/preset-pdf?path="+encodeURIComponent(rel):"#";
+    }
     if(!quizBookHint)return;
     const noPreset=presetCsvCount===0;
     if(isPersonalQuizBook()){
@@ -847,16 +1400,86 @@ HTML = r"""
     if(storageNote)storageNote.style.display="";
   }
 
-  function renderTable(){
-    const items=loadItems();
-    if(!items.length){tbody.innerHTML='<tr><td colspan="3" style="color:#6b7280;padding:16px 8px">まだありません。</td></tr>';return;}
-    const ok=canSpeak()&&!voiceSelect.disabled;
-    tbody.innerHTML=items.map((it,i)=>'<tr><td><div class="wordcell">'
-      +'<button class="speak" type="button" data-speak="'+i+'"'+(ok?"":" disabled")+' title="'+(ok?"読み上げ":"英語音声なし")+'">🔊</button>'
+  /* ── Record table ──
+     見えている範囲（前後に OVERSCAN 行）の行だけを DOM に置き、上下は高さだけの行で埋める。
+     行は id ごとに使い回すので、追加・削除・スクロールで作り直すのは出入りした行だけ。 */
+  const TABLE_EMPTY='<tr><td colspan="3" style="color:#6b7280;padding:16px 8px">まだありません。</td></tr>';
+  const TABLE_OVERSCAN=10;
+  const rowEls=new Map(),rowHeights=new Map();
+  let rowAvg=44,rowMeasured=0,rowMeasuredSum=0,tableFrame=0;
+  function spacerRow(){
+    const tr=document.createElement("tr");tr.setAttribute("aria-hidden","true");
+    tr.innerHTML='<td colspan="3" style="padding:0;border:0;height:0"></td>';return tr;
+  }
+  const topSpacer=spacerRow(),bottomSpacer=spacerRow();
+
+  function rowHtml(it,ok){
+    return '<tr><td><div class="wordcell">'
+      +'<button class="speak" type="button" data-speak="'+esc(it.id)+'"'+(ok?"":" disabled")+' title="'+(ok?"読み上げ":"英語音声なし")+'">🔊</button>'
       +'<span class="wordtext">'+esc(it.word)+'</span></div></td>'
       +'<td>'+esc(it.meaning)+'</td>'
-      +'<td><button class="del" type="button" data-del="'+i+'">削除</button></td></tr>').join("");
+      +'<td><button class="del" type="button" data-del="'+esc(it.id)+'">削除</button></td></tr>';
+  }
+  function makeRow(it,ok){
+    const t=document.createElement("tbody");t.innerHTML=rowHtml(it,ok);
+    const tr=t.firstChild;tr._word=it.word;tr._meaning=it.meaning;return tr;
+  }
+  function rowHeight(it){return rowHeights.get(it.id)||rowAvg;}
+
+  function renderTable(rebuild){
+    // rebuild: 読み上げボタンの状態が変わったときなど、描いてある行も作り直す
+    if(rebuild){rowEls.forEach(tr=>tr.remove());rowEls.clear();}
+    if(!tableFrame)tableFrame=requestAnimationFrame(drawTable);
+  }
+  function drawTable(){
+    tableFrame=0;
+    if(curMode!=="record")return;
+    const items=loadItems(),n=items.length;
+    if(!n){rowEls.clear();tbody.innerHTML=TABLE_EMPTY;return;}
+    if(!topSpacer.isConnected){tbody.textContent="";tbody.append(topSpacer,bottomSpacer);}
+    if(rowHeights.size>2*n+256){
+      const live=new Set(items.map(it=>it.id));
+      rowHeights.forEach((_h,id)=>{if(!live.has(id))rowHeights.delete(id);});
+    }
+
+    // ページのスクロール位置から、tbody のうち画面に入っている範囲を求める
+    const top=-tbody.getBoundingClientRect().top,bottom=top+window.innerHeight;
+    let y=0,start=0;
+    while(start<n&&y+rowHeight(items[start])<top){y+=rowHeight(items[start]);start++;}
+    let end=start,yEnd=y;
+    while(end<n&&yEnd<bottom){yEnd+=rowHeight(items[end]);end++;}
+    for(let k=0;k<TABLE_OVERSCAN&&start>0;k++){start--;y-=rowHeight(items[start]);}
+    for(let k=0;k<TABLE_OVERSCAN&&end<n;k++){yEnd+=rowHeight(items[end]);end++;}
+    let total=yEnd;
+    for(let i=end;i<n;i++)total+=rowHeight(items[i]);
+
+    const ok=canSpeak()&&!voiceSelect.disabled,keep=new Set(),fresh=[];
+    let prev=topSpacer;
+    for(let i=start;i<end;i++){
+      const it=items[i];
+      let tr=rowEls.get(it.id);
+      if(tr&&(tr._word!==it.word||tr._meaning!==it.meaning)){tr.remove();tr=null;}
+      if(!tr){tr=makeRow(it,ok);rowEls.set(it.id,tr);fresh.push([it.id,tr]);}
+      if(prev.nextSibling!==tr)prev.after(tr);
+      prev=tr;keep.add(it.id);
+    }
+    rowEls.forEach((tr,id)=>{if(!keep.has(id)){tr.remove();rowEls.delete(id);}});
+    topSpacer.firstChild.style.height=Math.max(0,y)+"px";
+    bottomSpacer.firstChild.style.height=Math.max(0,total-yEnd)+"px";
+
+    // 初めて描いた行の実際の高さを覚え、まだ描いていない行の見積もり（平均）に使う
+    let changed=false;
+    fresh.forEach(([id,tr])=>{
+      const h=tr.offsetHeight;if(!h)return;
+      if(Math.abs(h-rowHeight({id}))>1)changed=true;
+      if(!rowHeights.has(id)){rowMeasured++;rowMeasuredSum+=h;}
+      rowHeights.set(id,h);
+    });
+    if(rowMeasured)rowAvg=rowMeasuredSum/rowMeasured;
+    if(changed)renderTable();
   }
+  window.addEventListener("scroll",()=>{if(curMode==="record")renderTable();},{passive:true});
+  window.addEventListener("resize",()=>{if(curMode==="record"){rowHeights.clear();rowMeasured=rowMeasuredSum=0;renderTable(true);}});
 
   function groupFilesForOptgroups(files){
     const m=new Map();
@@ -959,6 +1582,7 @@ HTML = r"""
     if(inflight)inflight.abort();inflight=new AbortController();setHint("検索中…");
     try{
       const r=await fetch("/lookup",{method:"POST",headers:{"Content-Type":"application/json"},body:JSON.stringify({word:w}),signal:inflight.signal});
+      if(r.status===429){setHint("混雑しています。少し待ってから再度お試しください");lastQ="";return;}
       if(!r.ok){setHint("失敗しました");return;}const d=await r.json();
       if(d&&d.meaning){meaningEl.value=d.meaning;setHint("");}else setHint("見つかりませんでした");
     }catch(e){if(e&&e.name==="AbortError")return;setHint("失敗しました");}
@@ -1036,20 +1660,19 @@ HTML = r"""
   form.addEventListener("submit",e=>{
     e.preventDefault();
     const w=wordEl.value.trim(),m=meaningEl.value.trim();if(!w||!m)return;
-    const items=loadItems();items.push({word:w,meaning:m});saveItems(items);
+    addItems([{word:w,meaning:m}]);
     wordEl.value="";meaningEl.value="";lastQ="";setHint("");wordEl.focus();renderTable();
   });
 
   tbody.addEventListener("click",e=>{
     const sb=e.target.closest("button[data-speak]");
-    if(sb){const i=Number(sb.getAttribute("data-speak"));const items=loadItems();if(Number.isInteger(i)&&i>=0&&i<items.length)speakWord(items[i].word);return;}
+    if(sb){const it=bookIds.get(sb.getAttribute("data-speak"));if(it)speakWord(it.word);return;}
     const db=e.target.closest("button[data-del]");if(!db)return;
-    const i=Number(db.getAttribute("data-del"));const items=loadItems();
-    if(Number.isInteger(i)&&i>=0&&i<items.length){items.splice(i,1);saveItems(items);renderTable();}
+    deleteItem(db.getAttribute("data-del"));renderTable();
   });
 
   btnClear.addEventListener("click",()=>{
-    if(!confirm("全ての単語を削除しますか？"))return;saveItems([]);renderTable();
+    if(!confirm("全ての単語を削除しますか？"))return;replaceItems([]);renderTable();
   });
 
   /* ── CSV Import ── */
@@ -1080,7 +1703,7 @@ HTML = r"""
       if(!rows.length){showToast("読み込める単語がありませんでした");return;}
       const existing=loadItems();
       if(existing.length===0){
-        saveItems(rows);
+        addItems(rows);
         renderTable();
         showToast(rows.length+"件をあなたの単語帳に追加しました");
         return;
@@ -1116,7 +1739,7 @@ HTML = r"""
       $("modalCancel").onclick=closeModal;
       $("modalBg").addEventListener("click",e=>{if(e.target.id==="modalBg")closeModal();});
       if($("modalAdd"))$("modalAdd").onclick=function(){
-        saveItems(existing.concat(fresh));
+        addItems(fresh);
         renderTable();
         closeModal();
         showToast(fresh.length+"件をあなたの単語帳に追加しました");
@@ -1139,7 +1762,7 @@ HTML = r"""
         $("modalCancel2").onclick=closeModal;
         $("modalBg2").addEventListener("click",e=>{if(e.target.id==="modalBg2")closeModal();});
         $("modalConfirm").onclick=function(){
-          saveItems(rows);
+          replaceItems(rows);
           renderTable();
           closeModal();
           showToast(rows.length+"件であなたの単語帳を上書きしました");
@@ -1206,17 +1829,181 @@ HTML = r"""
   });
 
   /* ── Boot ── */
-  initQuizBookSelect();
-  void switchMode("quiz");
+  if(SYNC_AVAILABLE){
+    $("syncUserChange").addEventListener("click",e=>{e.preventDefault();void changeSyncUser();});
+    $("syncEnable").addEventListener("click",e=>{e.preventDefault();void setSyncOn(true);});
+    $("syncDisable").addEventListener("click",e=>{e.preventDefault();void setSyncOn(false);});
+    showSyncUser();
+  }
+  bookReady=openBook();
+  void bookReady.then(()=>{
+    scheduleSync(0);
+    initQuizBookSelect();
+    void switchMode("quiz");
+  });
 })();
 </script>
 </body>
 </html>
 """
 
+_PRESET_ITEMS_CACHE_LOCK = threading.Lock()
+_PRESET_ITEMS_CACHE: "OrderedDict[str, Tuple[Tuple[int, int], List[Dict[str, str]]]]" = OrderedDict()
+_PRESET_ITEMS_CACHE_MAX = 256
+
+
+def _load_preset_items(rel: str) -> Tuple[List[Dict[str, str]], str]:
+    """
+    プリセット CSV（ルートからの相対パス）を読み込む。失敗時は ([], "not_found" / "read_error")。
+    解析結果はファイルの (mtime, size) が変わるまで使い回すので、返したリストは書き換えないこと。
+    """
+    base = os.path.realpath(_pick_wordbook_preset_base())
+    path = _safe_preset_csv_path(base, rel)
+    if not path:
+        return ([], "not_found")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ([], "read_error")
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _PRESET_ITEMS_CACHE_LOCK:
+        hit = _PRESET_ITEMS_CACHE.get(path)
+        if hit is not None and hit[0] == stamp:
+            _PRESET_ITEMS_CACHE.move_to_end(path)
+            return (hit[1], "")
+    try:
+        with open(path, "rb") as fh:
+            raw = fh.read()
+    except OSError:
+        return ([], "read_error")
+    with _span("preset.parse", rel=rel, bytes=len(raw)) as sp:
+        items = _parse_preset_csv_text(raw.decode("utf-8-sig", errors="replace"))
+        sp.set(rows=len(items))
+    with _PRESET_ITEMS_CACHE_LOCK:
+        _PRESET_ITEMS_CACHE[path] = (stamp, items)
+        _PRESET_ITEMS_CACHE.move_to_end(path)
+        while len(_PRESET_ITEMS_CACHE) > _PRESET_ITEMS_CACHE_MAX:
+            _PRESET_ITEMS_CACHE.popitem(last=False)
+    return (items, "")
+
+
+def _natural_key(s: str) -> List[object]:
+    """ex204 < ex1020 のように数字部分を数値として比べる並び順。"""
+    return [int(p) if p.isdigit() else p.lower() for p in re.split(r"(\d+)", s)]
+
+
+def _parse_row_range(v: object) -> Tuple[Tuple[int, int] | None, str]:
+    """
+    "10-50" / "10-" / "-50" / "7" / 7 / [10, 50] / {"start": 10, "end": 50} を 1 始まり両端含む (start, end) に。
+    end=0 は末尾まで。戻り値は (範囲, エラー)。指定なしは (None, "")、読めない・逆順の範囲は "bad_rows"。
+    """
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return (None, "")
+    try:
+        if isinstance(v, bool):
+            raise ValueError(v)
+        if isinstance(v, int):
+            start, end = v, v
+        elif isinstance(v, dict):
+            start, end = int(v.get("start") or 1), int(v.get("end") or 0)
+        elif isinstance(v, (list, tuple)) and 1 <= len(v) <= 2:
+            start, end = int(v[0] or 1), int(v[1] or 0) if len(v) > 1 else 0
+        elif isinstance(v, str):
+            a, sep, b = v.strip().partition("-")
+            start = int(a) if a.strip() else 1
+            end = (int(b) if b.strip() else 0) if sep else start
+        else:
+            raise ValueError(v)
+    except (TypeError, ValueError):
+        return (None, "bad_rows")
+    if start < 1 or end < 0 or (end and end < start):
+        return (None, "bad_rows")
+    return ((start, end), "")
+
+
+def _slice_rows(items: List[Dict[str, str]], rows: object) -> Tuple[List[Dict[str, str]], int, str]:
+    """
+    行範囲の指定 rows で切り出し、(切り出した行, 先頭行の番号, エラー) を返す。
+    範囲が読めない・逆順なら "bad_rows"、先頭が行数を超えていれば "rows_out_of_range"。
+    """
+    rng, error = _parse_row_range(rows)
+    if error:
+        return ([], 1, error)
+    if rng is None:
+        return (items, 1, "")
+    start, end = rng
+    if start > len(items):
+        return ([], 1, "rows_out_of_range")
+    return (items[start - 1:end if end else None], start, "")
+
+
+def _resolve_preset_export(spec: Dict[str, object]) -> Tuple[List[Dict[str, str]], int, str]:
+    """
+    PDF 出力の対象をサーバー側のプリセット CSV から組み立てる。
+      path:  "EX準一級/ex204.csv"（1冊）
+      paths: ["a.csv", {"path": "b.csv", "rows": "1-100"}, ...]（複数冊を順に連結、冊ごとの行範囲も可）
+      from / to: 同じフォルダ内で from〜to の CSV を番号順にすべて（複数冊の範囲）
+      rows:  連結した結果に対する行範囲（"51-100" など）。番号は元の行番号から振る。
+    番号は通し番号で、最初の冊に行範囲があればその先頭の行番号から始まる
+    （2冊目以降の冊ごとの行範囲は切り出しにだけ使い、番号は前の冊から続ける）。
+    戻り値は (行, 先頭の番号, エラー)。行範囲が読めない・逆順・行数の外なら 400 になるエラーを返す。
+    """
+    entries: List[Tuple[str, object]] = []
+    paths = spec.get("paths")
+    if isinstance(paths, str):
+        paths = [paths]
+    if isinstance(spec.get("path"), str) and spec.get("path"):
+        entries.append((str(spec["path"]), None))
+    if isinstance(paths, list):
+        for p in paths:
+            if isinstance(p, dict):
+                entries.append((str(p.get("path") or ""), p.get("rows")))
+            else:
+                entries.append((str(p or ""), None))
+
+    first, last = str(spec.get("from") or "").strip("/"), str(spec.get("to") or "").strip("/")
+    if first or last:
+        first, last = first or last, last or first
+        folder = first.rpartition("/")[0]
+        if last.rpartition("/")[0] != folder:
+            return ([], 1, "range_across_folders")
+        base = os.path.realpath(_pick_wordbook_preset_base())
+        books = sorted(
+            (r for r in _iter_preset_csv_rel_paths(base) if r.rpartition("/")[0] == folder),
+            key=_natural_key,
+        )
+        if first not in books or last not in books:
+            return ([], 1, "not_found")
+        i, j = sorted((books.index(first), books.index(last)))
+        entries.extend((r, None) for r in books[i:j + 1])
+
+    if not entries:
+        return ([], 1, "no_preset")
+
+    out: List[Dict[str, str]] = []
+    first_no = 1
+    for k, (rel, rows) in enumerate(entries):
+        items, error = _load_preset_items(rel.strip())
+        if error:
+            return ([], 1, error)
+        items, book_no, error = _slice_rows(items, rows)
+        if error:
+            return ([], 1, error)
+        if k == 0:
+            first_no = book_no
+        out.extend(items)
+    out, start, error = _slice_rows(out, spec.get("rows"))
+    if error:
+        return ([], 1, error)
+    return (out, first_no + start - 1, "")
+
+
+_PRESET_EXPORT_KEYS = ("path", "paths", "from", "to")
+
+
 @app.get("/")
 def index():
-    resp = make_response(render_template_string(HTML))
+    resp = make_response(render_template_string(HTML, sync_enabled=_SYNC_ENABLED))
     resp.headers["Cache-Control"] = "no-store, max-age=0"
     return resp
 
@@ -1235,237 +2022,678 @@ def preset_csv_list():
 @app.get("/api/preset-csv/file")
 def preset_csv_file():
     rel = (request.args.get("path") or request.args.get("f") or "").strip()
-    base = os.path.realpath(_pick_wordbook_preset_base())
-    path = _safe_preset_csv_path(base, rel)
-    if not path:
+    items, error = _load_preset_items(rel)
+    if error:
         return Response(
-            json.dumps({"ok": False, "error": "not_found"}, ensure_ascii=False),
-            status=404,
+            json.dumps({"ok": False, "error": error}, ensure_ascii=False),
+            status=404 if error == "not_found" else 500,
             mimetype="application/json",
         )
-    try:
-        with open(path, "rb") as fh:
-            raw = fh.read()
-    except OSError:
-        return Response(
-            json.dumps({"ok": False, "error": "read_error"}, ensure_ascii=False),
-            status=500,
-            mimetype="application/json",
-        )
-    text = raw.decode("utf-8-sig", errors="replace")
-    items = _parse_preset_csv_text(text)
     return Response(
         json.dumps({"ok": True, "rel": rel, "items": items}, ensure_ascii=False),
         mimetype="application/json",
     )
 
 
-def _draw_pdf_word_sheet(rows: List[Dict[str, str]]) -> bytes:
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import mm
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-    from reportlab.pdfgen import canvas
+def _clean_pdf_text(s: str) -> str:
+    return (s or "").replace("\r", " ").replace("\n", " ").strip()
 
-    jp_font = "HeiseiKakuGo-W5"
-    pdfmetrics.registerFont(UnicodeCIDFont(jp_font))
 
-    out = io.BytesIO()
-    c = canvas.Canvas(out, pagesize=A4)
-    width, height = A4
+def _clean_pdf_item(it: object) -> Dict[str, str] | None:
+    if not isinstance(it, dict):
+        return None
+    return {
+        "word": _clean_pdf_text(str(it.get("word", "")))[:80],
+        "meaning": _clean_pdf_text(str(it.get("meaning", "")))[:200],
+    }
 
-    margin_x = 12 * mm
-    margin_top = 12 * mm
-    margin_bottom = 12 * mm
 
-    table_top = height - margin_top
-    table_bottom = margin_bottom
+def _clean_pdf_items(rows: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    cleaned: List[Dict[str, str]] = []
+    for it in rows:
+        c = _clean_pdf_item(it)
+        if c is not None:
+            cleaned.append(c)
+    return cleaned
 
-    total_rows = 25
-    row_h = (table_top - table_bottom) / total_rows
 
-    gap = 8 * mm
-    half_w = (width - 2 * margin_x - gap) / 2
+# リクエスト本文の上限（バイト数と items の件数）。超えたら 413 を返す
+_MAX_JSON_BYTES = _env_int("WORDBOOK_MAX_JSON_BYTES", 8 * 1024 * 1024)
+_MAX_EXPORT_ITEMS = _env_int("WORDBOOK_MAX_EXPORT_ITEMS", 20000)
+_LOOKUP_MAX_JSON_BYTES = _env_int("WORDBOOK_LOOKUP_MAX_BYTES", 16 * 1024)
 
-    no_w = 10 * mm
-    text_w = (half_w - no_w) / 2
-    word_w = text_w
-    meaning_w = text_w
 
-    pad_x = 2 * mm
-    pad_y = 1.5 * mm
+class _PayloadTooLarge(Exception):
+    pass
 
-    def clean(s: str) -> str:
-        return (s or "").replace("\r", " ").replace("\n", " ").strip()
 
-    def text_width(font_name: str, size: float, s: str) -> float:
-        return pdfmetrics.stringWidth(s, font_name, size)
+class _JsonStreamReader:
+    """
+    ストリームから少しずつ読み、JSONDecoder.raw_decode で値を1つずつ取り出す。
+    値が途中で切れていれば読み足す（読み足す量は未消費分と同じだけ増やすので、長い値でも全体で線形）。
+    """
 
-    def truncate_to_fit(font_name: str, size: float, s: str, max_w: float) -> str:
-        s = clean(s)
-        if not s:
-            return ""
-        if text_width(font_name, size, s) <= max_w:
-            return s
-        ell = "…"
-        if text_width(font_name, size, ell) > max_w:
-            return ""
-        t = s
-        while t and text_width(font_name, size, t + ell) > max_w:
-            t = t[:-1]
-        return (t + ell) if t else ell
-
-    def draw_fit_text_single_line(font_name: str, base_size: float, min_size: float,
-                                 x: float, y: float, s: str, max_w: float):
-        s = clean(s)
-        if not s:
+    def __init__(self, stream, max_bytes: int, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.read_bytes = 0
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._json = json.JSONDecoder()
+
+    def _fill(self, want: int = 0) -> None:
+        if self.eof:
             return
-        w0 = text_width(font_name, base_size, s)
-        size = base_size
-        if w0 > max_w and w0 > 0:
-            size = base_size * (max_w / w0)
-            if size < min_size:
-                size = min_size
-        s2 = truncate_to_fit(font_name, size, s, max_w)
-        c.setFont(font_name, size)
-        c.drawString(x, y, s2)
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.stream.read(max(self.chunk_size, want))
+        if not chunk:
+            self.buf += self._text.decode(b"", final=True)
+            self.eof = True
+            return
+        self.read_bytes += len(chunk)
+        if self.read_bytes > self.max_bytes:
+            raise _PayloadTooLarge("too_large")
+        self.buf += self._text.decode(chunk)
+
+    def peek(self) -> str:
+        """空白を飛ばして次の1文字を返す（終端なら ""）。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def take(self, expected: str) -> str:
+        c = self.peek()
+        if not c or c not in expected:
+            raise ValueError(f"expected one of {expected!r} at byte ~{self.read_bytes}")
+        self.pos += 1
+        return c
+
+    def value(self) -> object:
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self.buf, self.pos)
+                # 数値は途中で切れていても（"1" や "1e" の "1" として）読めてしまうので、
+                # 後ろに数値の続きでない文字があるか終端のときだけ確定する
+                if self.eof or (end < len(self.buf) and self.buf[end] not in "0123456789+-.eE"):
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(len(self.buf) - self.pos)
+
+
+def _parse_json_stream(stream, max_bytes: int, items_key: str = "",
+                       item_fn: Callable[[object], object] | None = None, max_items: int = 0) -> Dict[str, object]:
+    """
+    トップレベルのオブジェクトを読む。items_key の配列だけは要素ごとに item_fn を通して溜めるので、
+    元の（長い）要素を全部抱えることはない。item_fn が None を返した要素は捨てる。
+    """
+    r = _JsonStreamReader(stream, max_bytes)
+    if r.peek() != "{":
+        r.value()
+        return {}
+    r.take("{")
+    out: Dict[str, object] = {}
+    if r.peek() == "}":
+        r.take("}")
+    else:
+        while True:
+            key = r.value()
+            if not isinstance(key, str):
+                raise ValueError("object key must be a string")
+            r.take(":")
+            if key == items_key and r.peek() == "[":
+                r.take("[")
+                items: List[object] = []
+                if r.peek() == "]":
+                    r.take("]")
+                else:
+                    while True:
+                        it = r.value()
+                        if item_fn is not None:
+                            it = item_fn(it)
+                        if it is not None or item_fn is None:
+                            if max_items and len(items) >= max_items:
+                                raise _PayloadTooLarge("too_many_items")
+                            items.append(it)
+                        if r.take(",]") == "]":
+                            break
+                out[key] = items
+            else:
+                out[key] = r.value()
+            if r.take(",}") == "}":
+                break
+    if r.peek():
+        raise ValueError("extra data after JSON object")
+    return out
+
 
-    def wrap_text(font_name: str, size: float, s: str, max_w: float) -> List[str]:
-        s = clean(s)
-        if not s:
-            return []
+def _read_json_payload(max_bytes: int, items_key: str = "",
+                       item_fn: Callable[[object], object] | None = None, max_items: int = 0) -> Dict[str, object]:
+    """リクエスト本文を上限つきで読む。上限超過は _PayloadTooLarge、壊れた JSON はこれまでどおり {}。"""
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise _PayloadTooLarge("too_large")
+    try:
+        with _span("body.parse") as sp:
+            payload = _parse_json_stream(request.stream, max_bytes, items_key, item_fn, max_items)
+            if items_key and isinstance(payload.get(items_key), list):
+                sp.set(items=len(payload[items_key]))
+            return payload
+    except (ValueError, RecursionError):
+        return {}
 
-        has_space = (" " in s)
-        tokens = s.split(" ") if has_space else list(s)
 
-        lines: List[str] = []
-        cur = ""
+_PDF_JP_FONT = "HeiseiKakuGo-W5"
+_PDF_FONTS_LOCK = threading.Lock()
+_PDF_FONTS_READY = False
 
-        def push_line(line: str):
-            if line != "":
-                lines.append(line)
 
-        for t in tokens:
-            piece = (t if not has_space else (t if cur == "" else " " + t))
-            trial = cur + piece
-            if text_width(font_name, size, trial) <= max_w:
-                cur = trial
-                continue
+def _ensure_pdf_fonts() -> None:
+    """日本語 CID フォントの登録はプロセスで1回だけ行う。"""
+    global _PDF_FONTS_READY
+    if _PDF_FONTS_READY:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+
+    with _PDF_FONTS_LOCK:
+        if not _PDF_FONTS_READY:
+            pdfmetrics.registerFont(UnicodeCIDFont(_PDF_JP_FONT))
+            _PDF_FONTS_READY = True
+
+
+class _FontWidthTable:
+    """
+    1フォント分の文字幅表（1000 単位、文字ごとに初回だけ pdfmetrics で測ってキャッシュ）。
+    幅は reportlab と同じ計算順で size を掛けるので、pdfmetrics.stringWidth と同じ値になる。
+    """
+
+    def __init__(self, font_name: str):
+        from reportlab.pdfbase import pdfmetrics
+
+        self.font_name = font_name
+        self._font = pdfmetrics.getFont(font_name)
+        # Type1（Helvetica 等）は sum*0.001*size、CID フォントは size*0.001*sum の順で計算している
+        self._t1 = not hasattr(self._font, "unicodeWidths")
+        self._units: Dict[str, float] = {}
+
+    def char_units(self, ch: str) -> float:
+        u = self._units.get(ch)
+        if u is None:
+            u = self._font.stringWidth(ch, 1000)
+            if abs(u - round(u)) < 1e-6:
+                u = round(u)
+            self._units[ch] = u
+        return u
+
+    def units(self, s: str) -> float:
+        get = self._units.get
+        total = 0
+        for ch in s:
+            u = get(ch)
+            total += u if u is not None else self.char_units(ch)
+        return total
+
+    def prefix_units(self, s: str) -> List[float]:
+        """out[i] == units(s[:i])"""
+        out = [0]
+        total = 0
+        for ch in s:
+            total += self.char_units(ch)
+            out.append(total)
+        return out
+
+    def scale(self, size: float, units: float) -> float:
+        return units * 0.001 * size if self._t1 else size * 0.001 * units
+
+    def width(self, size: float, s: str) -> float:
+        return self.scale(size, self.units(s))
+
+
+_PDF_WIDTH_TABLES: Dict[str, _FontWidthTable] = {}
+
+
+def _pdf_width_table(font_name: str) -> _FontWidthTable:
+    table = _PDF_WIDTH_TABLES.get(font_name)
+    if table is None:
+        _ensure_pdf_fonts()
+        table = _PDF_WIDTH_TABLES.setdefault(font_name, _FontWidthTable(font_name))
+    return table
+
+
+def _pdf_fit_prefix_len(table: _FontWidthTable, size: float, pre: List[float],
+                        extra_units: float, max_w: float) -> int:
+    """pre（prefix_units の結果）のうち、末尾に extra_units を足しても max_w に収まる最長の長さ（なければ 0）。"""
+    lo, hi = 0, len(pre) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if table.scale(size, pre[mid] + extra_units) <= max_w:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _pdf_truncate_to_fit(font_name: str, size: float, s: str, max_w: float) -> str:
+    s = _clean_pdf_text(s)
+    if not s:
+        return ""
+    table = _pdf_width_table(font_name)
+    pre = table.prefix_units(s)
+    if table.scale(size, pre[-1]) <= max_w:
+        return s
+    ell = "…"
+    ell_u = table.units(ell)
+    if table.scale(size, ell_u) > max_w:
+        return ""
+    n = _pdf_fit_prefix_len(table, size, pre, ell_u, max_w)
+    return (s[:n] + ell) if n else ell
+
+
+def _pdf_wrap_text(font_name: str, size: float, s: str, max_w: float) -> List[str]:
+    s = _clean_pdf_text(s)
+    if not s:
+        return []
 
-            if cur == "":
-                if has_space:
-                    w = t
-                    buf = ""
-                    for ch in w:
-                        if text_width(font_name, size, buf + ch) <= max_w:
-                            buf += ch
-                        else:
-                            push_line(buf)
-                            buf = ch
-                    if buf:
+    table = _pdf_width_table(font_name)
+    has_space = (" " in s)
+    tokens = s.split(" ") if has_space else list(s)
+    space_u = table.units(" ")
+
+    lines: List[str] = []
+    cur = ""
+    cur_u = 0
+
+    def push_line(line: str):
+        if line != "":
+            lines.append(line)
+
+    for t in tokens:
+        t_u = table.units(t)
+        piece = (t if not has_space else (t if cur == "" else " " + t))
+        piece_u = t_u if (not has_space or cur == "") else space_u + t_u
+        if table.scale(size, cur_u + piece_u) <= max_w:
+            cur = cur + piece
+            cur_u += piece_u
+            continue
+
+        if cur == "":
+            if has_space:
+                w = t
+                buf = ""
+                buf_u = 0
+                for ch in w:
+                    ch_u = table.char_units(ch)
+                    if table.scale(size, buf_u + ch_u) <= max_w:
+                        buf += ch
+                        buf_u += ch_u
+                    else:
                         push_line(buf)
-                else:
-                    if text_width(font_name, size, t) <= max_w:
-                        push_line(t)
-                cur = ""
+                        buf = ch
+                        buf_u = ch_u
+                if buf:
+                    push_line(buf)
             else:
-                push_line(cur)
-                cur = (t if not has_space else t)
-
-        if cur:
+                if table.scale(size, t_u) <= max_w:
+                    push_line(t)
+            cur = ""
+            cur_u = 0
+        else:
             push_line(cur)
+            cur = (t if not has_space else t)
+            cur_u = t_u
+
+    if cur:
+        push_line(cur)
+
+    return lines
 
-        return lines
 
-    def truncate_lines_with_ellipsis(font_name: str, size: float,
-                                    lines: List[str], max_lines: int, max_w: float) -> List[str]:
-        if len(lines) <= max_lines:
-            return lines
-        kept = lines[:max_lines]
-        last = kept[-1]
-        ell = "…"
-        if text_width(font_name, size, last + ell) <= max_w:
-            kept[-1] = last + ell
-            return kept
-        t = last
-        while t and text_width(font_name, size, t + ell) > max_w:
-            t = t[:-1]
-        kept[-1] = (t + ell) if t else ell
+def _pdf_truncate_lines_with_ellipsis(font_name: str, size: float,
+                                      lines: List[str], max_lines: int, max_w: float) -> List[str]:
+    if len(lines) <= max_lines:
+        return lines
+    kept = lines[:max_lines]
+    last = kept[-1]
+    ell = "…"
+    table = _pdf_width_table(font_name)
+    pre = table.prefix_units(last)
+    ell_u = table.units(ell)
+    if table.scale(size, pre[-1] + ell_u) <= max_w:
+        kept[-1] = last + ell
         return kept
+    n = _pdf_fit_prefix_len(table, size, pre, ell_u, max_w)
+    kept[-1] = (last[:n] + ell) if n else ell
+    return kept
 
-    def draw_wrapped_fit_text(font_name: str, base_size: float, min_size: float,
-                              x: float, y_top: float, cell_w: float, cell_h: float, s: str):
-        s = clean(s)
-        if not s:
-            return
 
-        max_w = max(1.0, cell_w - 2 * pad_x)
-        max_h = max(1.0, cell_h - 2 * pad_y)
+def _pdf_fit_wrapped(font_name: str, base_size: float, min_size: float,
+                     s: str, max_w: float, max_h: float) -> Tuple[float, List[str]]:
+    """
+    折り返した行がセルの高さに収まる最大のフォントサイズ（base_size から 0.5pt 刻み、下限 min_size）と行を返す。
+    下限でも収まらなければ下限サイズで末尾を … で切り詰める。
+    小さいサイズほど行数は減り許容行数は増えるので、収まるかどうかは単調とみなして二分探索する。
+    """
+    s = _clean_pdf_text(s)
+    if not s:
+        return (base_size, [])
 
-        size = base_size
-        best_lines: List[str] = []
-        best_size = size
+    sizes = [base_size]
+    while sizes[-1] > min_size:
+        sizes.append(max(min_size, sizes[-1] - 0.5))
 
-        while True:
-            lines = wrap_text(font_name, size, s, max_w)
-            if not lines:
-                return
+    layouts: Dict[int, Tuple[List[str], int]] = {}
 
+    def layout(i: int) -> Tuple[List[str], int]:
+        got = layouts.get(i)
+        if got is None:
+            size = sizes[i]
+            lines = _pdf_wrap_text(font_name, size, s, max_w)
             leading = size * 1.15
             max_lines = int(max_h // leading) if leading > 0 else 1
-            if max_lines < 1:
-                max_lines = 1
+            got = layouts[i] = (lines, max(1, max_lines))
+        return got
+
+    lines, max_lines = layout(0)
+    if not lines:
+        return (base_size, [])
+    if len(lines) <= max_lines:
+        return (base_size, lines)
+
+    # sizes[lo] は収まらない、sizes[hi] は収まる（または最後の候補）
+    lo, hi = 0, len(sizes) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        mid_lines, mid_max = layout(mid)
+        if mid_lines and len(mid_lines) <= mid_max:
+            hi = mid
+        else:
+            lo = mid
+    lines, max_lines = layout(hi)
+    if not lines:
+        return (sizes[hi], [])
+    if len(lines) <= max_lines:
+        return (sizes[hi], lines)
+    return (sizes[hi], _pdf_truncate_lines_with_ellipsis(font_name, sizes[hi], lines, max_lines, max_w))
 
-            fits = (len(lines) <= max_lines)
 
-            if fits:
-                best_lines = lines
-                best_size = size
-                break
+class _PdfLayoutMemo:
+    """
+    意味セルの折り返し結果（フォントサイズと行）を (文字列, フォント, サイズ範囲, セル寸法) ごとに覚える LRU。
+    プリセットの意味は本や出力をまたいで繰り返し現れるので、プロセス全体で共有する。
+    """
 
-            if size <= min_size:
-                best_lines = truncate_lines_with_ellipsis(font_name, size, lines, max_lines, max_w)
-                best_size = size
-                break
+    def __init__(self, max_items: int):
+        self.max_items = max(0, max_items)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[tuple, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fit_wrapped(self, font_name: str, base_size: float, min_size: float,
+                    s: str, max_w: float, max_h: float) -> Tuple[float, List[str]]:
+        key = (s, font_name, base_size, min_size, max_w, max_h)
+        with self._lock:
+            got = self._data.get(key)
+            if got is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                _METRICS.inc("wordbook_pdf_layout_memo_hits_total")
+                return (got[0], list(got[1]))
+            self.misses += 1
+        _METRICS.inc("wordbook_pdf_layout_memo_misses_total")
+        size, lines = _pdf_fit_wrapped(font_name, base_size, min_size, s, max_w, max_h)
+        if self.max_items:
+            with self._lock:
+                self._data[key] = (size, tuple(lines))
+                while len(self._data) > self.max_items:
+                    self._data.popitem(last=False)
+        return (size, lines)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_PDF_LAYOUT_MEMO = _PdfLayoutMemo(_env_int("WORDBOOK_PDF_LAYOUT_MEMO", 20000))
+
+
+_PDF_PAGE_ROWS = 50
+_PDF_WORD_FONT = "Helvetica"
+_PDF_NO_SIZE = 10
+_PDF_WORD_BASE = 16
+_PDF_MEANING_BASE = 8
+_PDF_MIN_SIZE = 6
+
+
+@functools.lru_cache(maxsize=1)
+def _pdf_sheet_geometry() -> Dict[str, float]:
+    """A4 1ページに 25 行 x 左右 2 段（番号・word・意味）の表を置くときの寸法。"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+
+    width, height = A4
+
+    margin_x = 12 * mm
+    margin_top = 12 * mm
+    margin_bottom = 12 * mm
+
+    table_top = height - margin_top
+    table_bottom = margin_bottom
+
+    total_rows = 25
+    row_h = (table_top - table_bottom) / total_rows
+
+    gap = 8 * mm
+    half_w = (width - 2 * margin_x - gap) / 2
+
+    no_w = 10 * mm
+    text_w = (half_w - no_w) / 2
+
+    return {
+        "width": width,
+        "height": height,
+        "margin_x": margin_x,
+        "table_top": table_top,
+        "table_bottom": table_bottom,
+        "total_rows": total_rows,
+        "row_h": row_h,
+        "gap": gap,
+        "half_w": half_w,
+        "no_w": no_w,
+        "word_w": text_w,
+        "meaning_w": text_w,
+        "pad_x": 2 * mm,
+        "pad_y": 1.5 * mm,
+    }
+
+
+def _pdf_fit_single_line(font_name: str, base_size: float, min_size: float,
+                         s: str, max_w: float) -> Tuple[float, str] | None:
+    """1行に収まるよう base_size から縮め（下限 min_size）、それでも溢れる分は … で切る。"""
+    s = _clean_pdf_text(s)
+    if not s:
+        return None
+    w0 = _pdf_width_table(font_name).width(base_size, s)
+    size = base_size
+    if w0 > max_w and w0 > 0:
+        size = base_size * (max_w / w0)
+        if size < min_size:
+            size = min_size
+    return (size, _pdf_truncate_to_fit(font_name, size, s, max_w))
+
+
+def _pdf_layout_rows(rows: List[Dict[str, str]]) -> List[Tuple[Tuple[float, str] | None, Tuple[float, List[str]]]]:
+    """各行の word（サイズ, 文字列）と意味（サイズ, 行）を決める。描画は伴わないので別プロセスでも実行できる。"""
+    g = _pdf_sheet_geometry()
+    word_max_w = g["word_w"] - 2 * g["pad_x"]
+    meaning_max_w = max(1.0, g["meaning_w"] - 2 * g["pad_x"])
+    meaning_max_h = max(1.0, g["row_h"] - 2 * g["pad_y"])
+    out = []
+    for r in rows:
+        word = str(r.get("word", ""))
+        meaning = str(r.get("meaning", ""))
+        out.append((
+            _pdf_fit_single_line(_PDF_WORD_FONT, _PDF_WORD_BASE, _PDF_MIN_SIZE, word, word_max_w),
+            _PDF_LAYOUT_MEMO.fit_wrapped(
+                _PDF_JP_FONT, _PDF_MEANING_BASE, _PDF_MIN_SIZE, meaning, meaning_max_w, meaning_max_h
+            ),
+        ))
+    return out
+
+
+# この行数以上の出力は、レイアウト計算をページ単位でプロセスプールに分散する（0 で無効）
+_PDF_PARALLEL_MIN_ROWS = _env_int("WORDBOOK_PDF_PARALLEL_MIN_ROWS", 1000)
+# プロセスあたりのプールの大きさ。serve では未指定ならワーカー数で割り、ホスト全体で CPU 数程度に収める
+_PDF_PROCESSES = _env_int("WORDBOOK_PDF_PROCESSES", os.cpu_count() or 1)
+_PDF_POOL_LOCK = threading.Lock()
+_PDF_POOL = None
+
+
+def _pdf_pool_child_init() -> None:
+    """プールの子プロセスでは、さらに入れ子のプールを作らない。"""
+    global _PDF_PROCESSES
+    _PDF_PROCESSES = 1
+
+
+def _spawn_process_pool(max_workers: int):
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    # Flask のワーカースレッドがいるプロセスから fork しないよう spawn を使う
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_pdf_pool_child_init,
+    )
+
+
+def _pdf_process_pool():
+    global _PDF_POOL
+    if _PDF_PROCESSES < 2:
+        return None
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is None:
+            _PDF_POOL = _spawn_process_pool(_PDF_PROCESSES)
+        return _PDF_POOL
+
+
+def _pdf_layout_all(cleaned: List[Dict[str, str]], on_chunk: "Callable[[], None] | None" = None
+                    ) -> List[Tuple[Tuple[float, str] | None, Tuple[float, List[str]]]]:
+    """全行のレイアウト。on_chunk があればページ（並列時はグループ）ごとに呼ぶ。"""
+    pool = None
+    if _PDF_PARALLEL_MIN_ROWS and len(cleaned) >= _PDF_PARALLEL_MIN_ROWS:
+        pool = _pdf_process_pool()
+    if pool is None:
+        if on_chunk is None:
+            return _pdf_layout_rows(cleaned)
+        rows_out = []
+        for p in range(0, len(cleaned), _PDF_PAGE_ROWS):
+            rows_out.extend(_pdf_layout_rows(cleaned[p:p + _PDF_PAGE_ROWS]))
+            on_chunk()
+        return rows_out
+    # ページ境界でまとめて、ワーカー数の数倍のグループに分ける（順序は map が保つ）
+    pages = (len(cleaned) + _PDF_PAGE_ROWS - 1) // _PDF_PAGE_ROWS
+    groups = min(pages, _PDF_PROCESSES * 4)
+    per_group = ((pages + groups - 1) // groups) * _PDF_PAGE_ROWS
+    chunks = [cleaned[i:i + per_group] for i in range(0, len(cleaned), per_group)]
+    out = []
+    for part in pool.map(_pdf_layout_rows, chunks):
+        out.extend(part)
+        if on_chunk is not None:
+            on_chunk()
+    return out
+
+
+def _pdf_page_count(n_rows: int) -> int:
+    return max(1, (n_rows + _PDF_PAGE_ROWS - 1) // _PDF_PAGE_ROWS)
+
+
+def _draw_pdf_word_sheet(rows: List[Dict[str, str]], start_no: int = 1) -> bytes:
+    out = io.BytesIO()
+    _write_pdf_word_sheet(rows, out, start_no=start_no)
+    return out.getvalue()
+
+
+def _write_pdf_word_sheet(rows: List[Dict[str, str]], out,
+                          progress: "Callable[[int, int], None] | None" = None, start_no: int = 1) -> None:
+    """
+    単語シートの PDF を書き込み可能なファイルオブジェクト out に書き出す。番号は start_no から振る。
+    progress があれば1ページ描くごとに progress(描いたページ数, 総ページ数) を呼ぶ（例外を投げれば中断できる）。
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
 
-            size -= 0.5
-            if size < min_size:
-                size = min_size
+    _ensure_pdf_fonts()
+    jp_font = _PDF_JP_FONT
 
-        c.setFont(font_name, best_size)
-        leading = best_size * 1.15
+    c = canvas.Canvas(out, pagesize=A4)
+
+    g = _pdf_sheet_geometry()
+    width, height = g["width"], g["height"]
+    table_top, table_bottom = g["table_top"], g["table_bottom"]
+    total_rows, row_h = g["total_rows"], g["row_h"]
+    half_w, gap, no_w, word_w = g["half_w"], g["gap"], g["no_w"], g["word_w"]
+    pad_x, pad_y = g["pad_x"], g["pad_y"]
+
+    def draw_wrapped_lines(font_name: str, size: float, lines: List[str],
+                           x: float, y_top: float, cell_h: float):
+        if not lines:
+            return
 
-        y = y_top - pad_y - best_size
+        c.setFont(font_name, size)
+        leading = size * 1.15
+
+        y = y_top - pad_y - size
         y_min = y_top - cell_h + pad_y
-        for line in best_lines:
+        for line in lines:
             if y < y_min:
                 break
             c.drawString(x + pad_x, y, line)
             y -= leading
 
-    def draw_page(page_rows: List[Dict[str, str]], start_no: int):
-        left_x0 = margin_x
-        left_x1 = left_x0 + half_w
-        right_x0 = left_x1 + gap
-        right_x1 = right_x0 + half_w
-
-        c.setLineWidth(0.6)
-
-        for x0, x1 in ((left_x0, left_x1), (right_x0, right_x1)):
-            c.line(x0, table_bottom, x0, table_top)
-            c.line(x1, table_bottom, x1, table_top)
-            c.line(x0 + no_w, table_bottom, x0 + no_w, table_top)
-            c.line(x0 + no_w + word_w, table_bottom, x0 + no_w + word_w, table_top)
-            for r in range(total_rows + 1):
-                y = table_top - r * row_h
-                c.line(x0, y, x1, y)
-
-        no_size = 10
-        word_base = 16
-        meaning_base = 8
-        min_size = 6
-
-        for i in range(min(50, len(page_rows))):
+    left_x0 = g["margin_x"]
+    left_x1 = left_x0 + half_w
+    right_x0 = left_x1 + gap
+    right_x1 = right_x0 + half_w
+
+    # 罫線は全ページ共通なので Form XObject として1回だけ書き出し、各ページからは参照だけする
+    grid_form = "wordsheet-grid"
+    c.beginForm(grid_form, 0, 0, width, height)
+    c.setLineWidth(0.6)
+    for x0, x1 in ((left_x0, left_x1), (right_x0, right_x1)):
+        c.line(x0, table_bottom, x0, table_top)
+        c.line(x1, table_bottom, x1, table_top)
+        c.line(x0 + no_w, table_bottom, x0 + no_w, table_top)
+        c.line(x0 + no_w + word_w, table_bottom, x0 + no_w + word_w, table_top)
+        for r in range(total_rows + 1):
+            y = table_top - r * row_h
+            c.line(x0, y, x1, y)
+    c.endForm()
+
+    def draw_page(page_layouts, start_no: int):
+        c.doForm(grid_form)
+
+        for i in range(min(_PDF_PAGE_ROWS, len(page_layouts))):
             n = start_no + i
             side = 0 if i < 25 else 1
             row = i if i < 25 else i - 25
@@ -1474,94 +2702,1111 @@ def _draw_pdf_word_sheet(rows: List[Dict[str, str]]) -> bytes:
             y_top = table_top - row * row_h
             y_text_single = y_top - 0.72 * row_h
 
-            word = str(page_rows[i].get("word", ""))
-            meaning = str(page_rows[i].get("meaning", ""))
+            word_fit, (meaning_size, meaning_lines) = page_layouts[i]
 
-            c.setFont(jp_font, no_size)
+            c.setFont(jp_font, _PDF_NO_SIZE)
             c.drawString(x0 + pad_x, y_text_single, str(n))
 
-            draw_fit_text_single_line(
-                "Helvetica",
-                word_base,
-                min_size,
-                x0 + no_w + pad_x,
-                y_text_single,
-                word,
-                word_w - 2 * pad_x,
-            )
+            if word_fit is not None:
+                c.setFont(_PDF_WORD_FONT, word_fit[0])
+                c.drawString(x0 + no_w + pad_x, y_text_single, word_fit[1])
 
-            cell_x = x0 + no_w + word_w
-            draw_wrapped_fit_text(
-                jp_font,
-                meaning_base,
-                min_size,
-                cell_x,
-                y_top,
-                meaning_w,
-                row_h,
-                meaning,
-            )
+            draw_wrapped_lines(jp_font, meaning_size, meaning_lines, x0 + no_w + word_w, y_top, row_h)
 
-    cleaned: List[Dict[str, str]] = []
-    for it in rows:
-        if isinstance(it, dict):
-            cleaned.append(
-                {
-                    "word": clean(str(it.get("word", "")))[:80],
-                    "meaning": clean(str(it.get("meaning", "")))[:200],
-                }
-            )
+    cleaned = _clean_pdf_items(rows)
+    pages_total = _pdf_page_count(len(cleaned))
+    # レイアウト計算中も progress(0, 総ページ数) を呼び、中断できるようにする
+    with _span("pdf.layout", rows=len(cleaned)):
+        layouts = _pdf_layout_all(cleaned, on_chunk=(lambda: progress(0, pages_total)) if progress else None)
 
-    page_size = 50
-    start_no = 1
-    for p in range(0, len(cleaned) if cleaned else 1, page_size):
-        chunk = cleaned[p:p + page_size] if cleaned else []
-        draw_page(chunk, start_no)
-        start_no += page_size
-        if p + page_size < len(cleaned):
-            c.showPage()
+    page_size = _PDF_PAGE_ROWS
+    with _span("pdf.draw", pages=pages_total):
+        for p in range(0, len(cleaned) if cleaned else 1, page_size):
+            chunk = layouts[p:p + page_size] if cleaned else []
+            draw_page(chunk, start_no)
+            _METRICS.inc("wordbook_pdf_pages_rendered_total")
+            start_no += page_size
+            if p + page_size < len(cleaned):
+                c.showPage()
+            if progress is not None:
+                progress(p // page_size + 1, pages_total)
 
-    c.save()
-    return out.getvalue()
+    with _span("pdf.save"):
+        c.save()
 
 
-@app.post("/export.pdf")
-def export_pdf():
-    data = request.get_data(cache=False, as_text=True) or "{}"
-    try:
-        payload = json.loads(data)
-    except Exception:
-        payload = {}
+# レイアウト（_draw_pdf_word_sheet の寸法・フォント・描画方法）を変えたら上げる。キャッシュキーに含まれる。
+_PDF_LAYOUT_VERSION = "wordsheet-2"
 
-    items = payload.get("items")
-    if not isinstance(items, list):
-        items = []
 
-    pdf = _draw_pdf_word_sheet(items)
+def _pdf_cache_key(cleaned: List[Dict[str, str]], start_no: int = 1) -> str:
+    """整形済みの項目・先頭の番号・レイアウト版から PDF キャッシュのキー（兼 ETag）を作る。"""
+    h = hashlib.sha256(_PDF_LAYOUT_VERSION.encode("utf-8"))
+    if start_no != 1:
+        h.update(b"start_no=%d;" % start_no)
+    h.update(json.dumps(cleaned, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()[:40]
+
+
+class _PdfCache:
+    """
+    PDF バイト列のキャッシュ。メモリ上の LRU（max_mem_bytes まで）と、
+    ディスク上の <key>.pdf（max_disk_bytes まで、参照の古いものから削除）の2段。
+    ディスクの合計は書き込みごとに見込みで数え、上限を超えそうなときか disk_rescan 秒ごとにだけ
+    ディレクトリを数え直す（serve では他のワーカーも同じディレクトリに書くため）。
+    """
+
+    disk_rescan = 30.0
+    disk_low_water = 0.9
+
+    def __init__(self, max_mem_bytes: int, disk_dir: str, max_disk_bytes: int):
+        self.max_mem_bytes = max(0, max_mem_bytes)
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max(0, max_disk_bytes)
+        self._lock = threading.Lock()
+        # 整理の削除と、put_file の「移して開く」を分ける（Windows では開く前に消されうるため）
+        self._disk_lock = threading.Lock()
+        self._mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_bytes: int | None = None
+        self._disk_scanned = 0.0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".pdf")
+
+    def _remember_locked(self, key: str, pdf: bytes) -> None:
+        if len(pdf) > self.max_mem_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old)
+        self._mem[key] = pdf
+        self._mem_bytes += len(pdf)
+        while self._mem_bytes > self.max_mem_bytes:
+            _k, v = self._mem.popitem(last=False)
+            self._mem_bytes -= len(v)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            pdf = self._mem.get(key)
+            if pdf is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+        if pdf is not None:
+            _METRICS.inc("wordbook_pdf_cache_hits_total")
+        return pdf
+
+    def open_file(self, key: str) -> BinaryIO | None:
+        """
+        ディスク上にあれば読み出し用に開いて返す（参照されたので mtime を更新し、削除順を後ろにする）。
+        パスではなく開いたファイルを返すので、返したあとに整理で消されても読める。
+        """
+        fh = None
+        if self.disk_dir and self.max_disk_bytes:
+            path = self._disk_path(key)
+            try:
+                fh = open(path, "rb")
+                os.utime(path)
+            except OSError:
+                pass
+        with self._lock:
+            if fh is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        _METRICS.inc("wordbook_pdf_cache_misses_total" if fh is None else "wordbook_pdf_cache_disk_hits_total")
+        return fh
+
+    def put_file(self, key: str, tmp_path: str) -> BinaryIO | None:
+        """
+        書き出し済みの一時ファイルをそのままディスクキャッシュに移し、読み出し用に開いて返す。
+        キャッシュしない場合は None（一時ファイルはそのまま残る）。
+        """
+        if not self.disk_dir or not self.max_disk_bytes or os.path.getsize(tmp_path) > self.max_disk_bytes:
+            return None
+        fh = None
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            path = self._disk_path(key)
+            size = os.path.getsize(tmp_path)
+            with self._disk_lock:
+                if os.name == "nt":
+                    # 開いたままのファイルは移せない。同じプロセスの整理とはロックで分ける
+                    os.replace(tmp_path, path)
+                    fh = open(path, "rb")
+                else:
+                    # 先に開いておけば、移した直後に他のワーカーの整理で消されても読める
+                    fh = open(tmp_path, "rb")
+                    os.replace(tmp_path, path)
+        except OSError:
+            if fh is not None:
+                fh.close()
+            return None
+        self._after_disk_write(size)
+        return fh
+
+    def put(self, key: str, pdf: bytes) -> None:
+        with self._lock:
+            self._remember_locked(key, pdf)
+        if not self.disk_dir or not self.max_disk_bytes or len(pdf) > self.max_disk_bytes:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".pdf-", dir=self.disk_dir)
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(pdf)
+            os.replace(tmp, self._disk_path(key))
+            self._after_disk_write(len(pdf))
+        except OSError:
+            pass
+
+    def _after_disk_write(self, size: int) -> None:
+        with self._lock:
+            known = self._disk_bytes
+            fresh = time.monotonic() - self._disk_scanned < self.disk_rescan
+            if known is not None and fresh and known + size <= self.max_disk_bytes:
+                self._disk_bytes = known + size
+                return
+        total = self._trim_disk()
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_scanned = time.monotonic()
+
+    def _trim_disk(self) -> int:
+        """
+        上限を超えていたら参照の古い順に消し、残った合計バイト数を返す。
+        上限ちょうどではなく disk_low_water の割合まで減らし、次に数え直すまでの余裕を作る。
+        """
+        entries = []
+        total = 0
+        for fn in os.listdir(self.disk_dir):
+            # "." で始まるのは書き込み中の一時ファイル
+            if not fn.endswith(".pdf") or fn.startswith("."):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, fn))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+            total += st.st_size
+        entries.sort()
+        target = self.max_disk_bytes if total <= self.max_disk_bytes else int(self.max_disk_bytes * self.disk_low_water)
+        with self._disk_lock:
+            for _mtime, size, fn in entries:
+                if total <= target:
+                    break
+                try:
+                    # Windows では送信中（開いたまま）のファイルは消せず、ここで飛ばされる
+                    os.remove(os.path.join(self.disk_dir, fn))
+                    total -= size
+                except OSError:
+                    pass
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "mem_items": len(self._mem),
+                "mem_bytes": self._mem_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+_PDF_CACHE = _PdfCache(
+    max_mem_bytes=_env_int("WORDBOOK_PDF_CACHE_MEM", 32 * 1024 * 1024),
+    disk_dir=os.environ.get("WORDBOOK_PDF_CACHE_DIR", os.path.join(_DATA_DIR, "pdf-cache")),
+    max_disk_bytes=_env_int("WORDBOOK_PDF_CACHE_DISK", 256 * 1024 * 1024),
+)
+
+
+# この行数以上の PDF は一時ファイルに書き出してから送り、出来上がった本文の bytes をメモリに持たない。
+# reportlab は save() まで文書全体をメモリに組み立てるので、描画中のピークメモリと最初の1バイトまでの時間は変わらない
+_PDF_STREAM_MIN_ROWS = _env_int("WORDBOOK_PDF_STREAM_MIN_ROWS", 500)
+
+
+def _open_temporary(path: str) -> BinaryIO:
+    """書き出し済みの一時ファイルを、閉じたら消える読み出し用ファイルとして開く。"""
+    if os.name == "nt":
+        # 開いたままでは消せないので、最後のハンドルを閉じたときに OS に消させる
+        return os.fdopen(os.open(path, os.O_RDONLY | os.O_BINARY | os.O_TEMPORARY), "rb")
+    fh = open(path, "rb")
+    os.remove(path)
+    return fh
+
+
+def _pdf_file_response(fh: BinaryIO, headers: Dict[str, str], chunk_size: int = 64 * 1024) -> Response:
+    """開いたファイルを少しずつ送り、送り終えたら閉じる。"""
+    size = os.fstat(fh.fileno()).st_size
+    fh.seek(0)
+
+    def generate():
+        with fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
     return Response(
-        pdf,
+        generate(),
         mimetype="application/pdf",
-        headers={"Content-Disposition": 'attachment; filename="wordbook.pdf"'},
+        headers=dict(headers, **{"Content-Length": str(size)}),
+        direct_passthrough=True,
     )
 
 
-def _fetch_wiktionary_raw(title: str) -> str:
+def _json_response(payload: Dict[str, object], status: int = 200) -> Response:
+    return Response(json.dumps(payload, ensure_ascii=False), status=status, mimetype="application/json")
+
+
+def _preset_error_status(error: str) -> int:
+    if error == "not_found":
+        return 404
+    if error == "read_error":
+        return 500
+    return 400
+
+
+def _read_export_payload() -> Dict[str, object]:
+    # items は届いた順に掃除・切り詰めしてから溜める（メモリは受け付けた行数に比例）
+    return _read_json_payload(_MAX_JSON_BYTES, "items", _clean_pdf_item, _MAX_EXPORT_ITEMS)
+
+
+def _export_items(payload: Dict[str, object]) -> Tuple[List[Dict[str, str]], int, str]:
+    """本文（またはクエリ）から (掃除済みの行, 開始番号, エラー) を取り出す。"""
+    if any(payload.get(k) for k in _PRESET_EXPORT_KEYS):
+        items, start_no, error = _resolve_preset_export(payload)
+        if error:
+            return ([], 1, error)
+        return (_clean_pdf_items(items), start_no, "")
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return ([], 1, "")
+    return ([it for it in items if isinstance(it, dict)], 1, "")
+
+
+def _pdf_download_name(payload: Dict[str, object]) -> str:
+    rel = payload.get("path") or payload.get("from")
+    if isinstance(rel, str) and rel:
+        return os.path.splitext(rel.rpartition("/")[2])[0] + ".pdf"
+    return "wordbook.pdf"
+
+
+@app.route("/export.pdf", methods=["GET", "POST"])
+def export_pdf():
+    if request.method == "GET":
+        # 印刷用のリンク: /export.pdf?path=EX準一級/ex204.csv&rows=1-100（path は複数指定可、from/to で冊の範囲）
+        paths = request.args.getlist("path")
+        payload = {k: request.args.get(k) for k in ("from", "to", "rows") if request.args.get(k)}
+        if len(paths) == 1:
+            payload["path"] = paths[0]
+        elif paths:
+            payload["paths"] = paths
+        if not any(payload.get(k) for k in _PRESET_EXPORT_KEYS):
+            # 出どころの無い GET は空の PDF ではなく 400 にする（行の本文は POST でしか送れない）
+            return _json_response({"ok": False, "error": "bad_request"}, 400)
+    else:
+        try:
+            payload = _read_export_payload()
+        except _PayloadTooLarge as e:
+            return _json_response({"ok": False, "error": str(e)}, 413)
+
+    cleaned, start_no, error = _export_items(payload)
+    if error:
+        return _json_response({"ok": False, "error": error}, _preset_error_status(error))
+    key = _pdf_cache_key(cleaned, start_no)
+    name = _pdf_download_name(payload)
+    headers = {
+        "Content-Disposition": 'attachment; filename="wordbook.pdf"; filename*=UTF-8\'\'' + quote(name),
+        "ETag": '"' + key + '"',
+    }
+    if request.if_none_match.contains(key):
+        # RFC 9110 13.1.2: GET/HEAD 以外で If-None-Match が一致したら 304 ではなく 412
+        if request.method in ("GET", "HEAD"):
+            return Response(status=304, headers=headers)
+        return _json_response({"ok": False, "error": "precondition_failed"}, 412)
+    pdf = _PDF_CACHE.get(key)
+    if pdf is not None:
+        return Response(pdf, mimetype="application/pdf", headers=headers)
+    fh = _PDF_CACHE.open_file(key)
+    if fh is not None:
+        return _pdf_file_response(fh, headers)
+    if len(cleaned) < _PDF_STREAM_MIN_ROWS:
+        pdf = _draw_pdf_word_sheet(cleaned, start_no)
+        _PDF_CACHE.put(key, pdf)
+        return Response(pdf, mimetype="application/pdf", headers=headers)
+
+    # 大きい出力は完成した PDF の bytes コピーを作らず、一時ファイルに書き出してから少しずつ送る。
+    # 描画そのものは save() まで文書全体をメモリに持つので、送り始めは描き終わってから
+    spool_dir = _PDF_CACHE.disk_dir if _PDF_CACHE.disk_dir and _PDF_CACHE.max_disk_bytes else None
+    if not spool_dir:
+        # キャッシュに残さないなら、閉じたら消える一時ファイルに書いてそのまま送る
+        fh = tempfile.TemporaryFile(suffix=".pdf")
+        try:
+            _write_pdf_word_sheet(cleaned, fh, start_no=start_no)
+        except BaseException:
+            fh.close()
+            raise
+        return _pdf_file_response(fh, headers)
+    os.makedirs(spool_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".render-", suffix=".pdf", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            _write_pdf_word_sheet(cleaned, out, start_no=start_no)
+        fh = _PDF_CACHE.put_file(key, tmp)
+        if fh is None:
+            fh = _open_temporary(tmp)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return _pdf_file_response(fh, headers)
+
+
+@app.get("/api/pdf/stats")
+def pdf_stats():
+    return Response(
+        json.dumps({"ok": True, "cache": _PDF_CACHE.stats(), "layout_memo": _PDF_LAYOUT_MEMO.stats()}, ensure_ascii=False),
+        mimetype="application/json",
+    )
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+class _ExportJob:
+    """
+    出力ジョブ1件の状態。実行スレッドとリクエストのスレッドから同時に触るので、
+    状態の読み書きは update() / snapshot() / to_dict() を通して lock の中で行う。
+    """
+
+    def __init__(self, job_id: str, items: List[Dict[str, str]], start_no: int = 1):
+        self.id = job_id
+        self.items = items
+        self.start_no = start_no
+        self.item_count = len(items)
+        self.status = "queued"
+        self.pages_done = 0
+        self.pages_total = _pdf_page_count(len(items))
+        self.error = ""
+        self.path = ""
+        self.created = time.time()
+        self.finished = 0.0
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.lock = threading.Lock()
+
+    def update(self, **fields) -> None:
+        with self.lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def snapshot(self) -> Dict[str, object]:
+        """to_dict() に結果のパスと終了時刻を足したもの（状態ファイルとダウンロード用）。"""
+        with self.lock:
+            return dict(self._to_dict_locked(), path=self.path, finished=self.finished)
+
+    def to_dict(self) -> Dict[str, object]:
+        with self.lock:
+            return self._to_dict_locked()
+
+    def _to_dict_locked(self) -> Dict[str, object]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "items": self.item_count,
+            "error": self.error,
+        }
+
+
+class _ExportJobQueue:
+    """
+    PDF 出力をバックグラウンドのスレッドプールで実行する。
+    待ち＋実行中の件数は max_pending まで。終わったジョブは ttl 秒後に結果ごと捨てる。
+    結果の PDF は PDF キャッシュ（容量で消される）ではなく <id>.pdf としてジョブ用のフォルダに置き、ttl まで残す。
+    state_dir を指定すると状態を <id>.json に書き出し、別プロセス（serve の他のワーカー）からも
+    状態の確認・取り消し（<id>.cancel を置く）・ダウンロードができる。
+    """
+
+    def __init__(self, workers: int, max_pending: int, ttl: float, state_dir: str = ""):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.ttl = ttl
+        self.state_dir = state_dir
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, _ExportJob] = {}
+        self._pool = None
+
+    def _state_path(self, job_id: str, ext: str = ".json") -> str:
+        return os.path.join(self.state_dir, job_id + ext)
+
+    def _output_dir(self) -> str:
+        return self.state_dir or os.path.join(_DATA_DIR, "export-jobs")
+
+    def _publish(self, job: _ExportJob) -> None:
+        if not self.state_dir:
+            return
+        state = job.snapshot()
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".job-", dir=self.state_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(state, fh)
+            os.replace(tmp, self._state_path(job.id))
+        except OSError:
+            pass
+
+    def _load_remote(self, job_id: str) -> _ExportJob | None:
+        if not self.state_dir or not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), encoding="utf-8") as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        job = _ExportJob(job_id, [])
+        job.status = state.get("status", "")
+        job.pages_done = state.get("pages_done", 0)
+        job.pages_total = state.get("pages_total", 0)
+        job.item_count = state.get("items", 0)
+        job.error = state.get("error", "")
+        job.path = state.get("path", "")
+        job.finished = state.get("finished", 0.0)
+        return job
+
+    def _forget(self, job: _ExportJob) -> None:
+        state = job.snapshot()
+        if state["path"]:
+            try:
+                os.remove(state["path"])
+            except OSError:
+                pass
+        if self.state_dir:
+            for ext in (".json", ".cancel"):
+                try:
+                    os.remove(self._state_path(job.id, ext))
+                except OSError:
+                    pass
+
+    def _sweep_outputs(self) -> None:
+        """前回の起動から残った、ttl を過ぎた結果を消す（終了時刻より mtime は新しくならない）。"""
+        out_dir = self._output_dir()
+        try:
+            names = os.listdir(out_dir)
+        except OSError:
+            return
+        limit = time.time() - self.ttl
+        for fn in names:
+            # "." で始まるのは書き込み中の一時ファイル
+            if not fn.endswith(".pdf") or fn.startswith("."):
+                continue
+            path = os.path.join(out_dir, fn)
+            try:
+                if os.stat(path).st_mtime < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _executor(self):
+        if self._pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._sweep_outputs()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export-job")
+        return self._pool
+
+    def _prune_locked(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            finished = job.snapshot()["finished"]
+            if finished and now - finished > self.ttl:
+                del self._jobs[job_id]
+                self._forget(job)
+
+    def submit(self, items: List[Dict[str, str]], start_no: int = 1) -> _ExportJob | None:
+        with self._lock:
+            self._prune_locked()
+            pending = sum(1 for j in self._jobs.values() if j.to_dict()["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                return None
+            job = _ExportJob(uuid.uuid4().hex, items, start_no)
+            self._jobs[job.id] = job
+            self._publish(job)
+            job.future = self._executor().submit(self._run, job)
+            return job
+
+    def get(self, job_id: str) -> _ExportJob | None:
+        with self._lock:
+            self._prune_locked()
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load_remote(job_id)
+
+    def cancel(self, job_id: str) -> _ExportJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.cancel_event.set()
+                if job.to_dict()["status"] == "queued" and job.future is not None and job.future.cancel():
+                    job.update(status="cancelled", finished=time.time(), items=[])
+                    self._publish(job)
+                return job
+        job = self._load_remote(job_id)
+        if job is not None and job.status in ("queued", "running"):
+            # 持ち主のワーカーがページごとに見に来る
+            try:
+                open(self._state_path(job_id, ".cancel"), "wb").close()
+            except OSError:
+                pass
+        return job
+
+    def _cancel_requested(self, job: _ExportJob) -> bool:
+        if job.cancel_event.is_set():
+            return True
+        if self.state_dir and os.path.exists(self._state_path(job.id, ".cancel")):
+            job.cancel_event.set()
+            return True
+        return False
+
+    def _render(self, job: _ExportJob, items: List[Dict[str, str]], progress) -> str:
+        """結果を <出力フォルダ>/<id>.pdf に書き、そのパスを返す。キャッシュにあればそれを写す。"""
+        out_dir = self._output_dir()
+        os.makedirs(out_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".job-", suffix=".pdf", dir=out_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                cached = _PDF_CACHE.open_file(_pdf_cache_key(items, job.start_no))
+                if cached is not None:
+                    with cached:
+                        shutil.copyfileobj(cached, out)
+                else:
+                    _write_pdf_word_sheet(items, out, progress=progress, start_no=job.start_no)
+            path = os.path.join(out_dir, job.id + ".pdf")
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return path
+
+    def _run(self, job: _ExportJob) -> None:
+        if self._cancel_requested(job):
+            job.update(status="cancelled", finished=time.time(), items=[])
+            self._publish(job)
+            return
+        with job.lock:
+            job.status = "running"
+            items = job.items
+        self._publish(job)
+
+        def progress(done: int, total: int) -> None:
+            job.update(pages_done=done)
+            self._publish(job)
+            if self._cancel_requested(job):
+                raise _ExportCancelled()
+
+        result: Dict[str, object] = {}
+        try:
+            path = self._render(job, items, progress)
+            result = {"path": path, "pages_done": job.to_dict()["pages_total"], "status": "done"}
+        except _ExportCancelled:
+            result = {"status": "cancelled"}
+        except Exception as e:
+            result = {"status": "failed", "error": type(e).__name__}
+        finally:
+            job.update(items=[], finished=time.time(), **result)
+            self._publish(job)
+
+
+_EXPORT_JOBS = _ExportJobQueue(
+    workers=_env_int("WORDBOOK_EXPORT_WORKERS", 2),
+    max_pending=_env_int("WORDBOOK_EXPORT_QUEUE", 16),
+    ttl=_env_float("WORDBOOK_EXPORT_JOB_TTL", 600.0),
+    state_dir=os.environ.get("WORDBOOK_EXPORT_JOB_DIR", ""),
+)
+
+
+@app.post("/api/export-jobs")
+def export_job_submit():
+    try:
+        payload = _read_export_payload()
+    except _PayloadTooLarge as e:
+        return _json_response({"ok": False, "error": str(e)}, 413)
+
+    items, start_no, error = _export_items(payload)
+    if error:
+        return _json_response({"ok": False, "error": error}, _preset_error_status(error))
+
+    job = _EXPORT_JOBS.submit(items, start_no)
+    if job is None:
+        return _json_response({"ok": False, "error": "queue_full"}, 429)
+    return _json_response(dict(job.to_dict(), ok=True), 202)
+
+
+@app.get("/api/export-jobs/<job_id>")
+def export_job_status(job_id: str):
+    job = _EXPORT_JOBS.get(job_id)
+    if job is None:
+        return _json_response({"ok": False, "error": "not_found"}, 404)
+    return _json_response(dict(job.to_dict(), ok=True))
+
+
+@app.delete("/api/export-jobs/<job_id>")
+def export_job_cancel(job_id: str):
+    job = _EXPORT_JOBS.cancel(job_id)
+    if job is None:
+        return _json_response({"ok": False, "error": "not_found"}, 404)
+    return _json_response(dict(job.to_dict(), ok=True))
+
+
+@app.get("/api/export-jobs/<job_id>/pdf")
+def export_job_download(job_id: str):
+    job = _EXPORT_JOBS.get(job_id)
+    if job is None:
+        return _json_response({"ok": False, "error": "not_found"}, 404)
+    state = job.snapshot()
+    if state["status"] != "done":
+        return _json_response(dict(job.to_dict(), ok=False, error="not_ready"), 409)
+    headers = {"Content-Disposition": 'attachment; filename="wordbook.pdf"'}
+    try:
+        return _pdf_file_response(open(state["path"], "rb"), headers)
+    except OSError:
+        return _json_response({"ok": False, "error": "expired"}, 410)
+
+
+# プリセット CSV ごとに事前生成した PDF と manifest.json の置き場所
+PRESET_PDF_DIR = os.environ.get("WORDBOOK_PRESET_PDF_DIR", os.path.join(_DATA_DIR, "preset-pdf"))
+_PRESET_PDF_MANIFEST = "manifest.json"
+
+
+def _preset_catalog_signature(base: str) -> str:
+    """プリセットの置き場所、CSV の一覧と各ファイルの (mtime, size) から作る指紋。変われば再生成の合図。"""
+    h = hashlib.sha256(_PDF_LAYOUT_VERSION.encode("utf-8"))
+    base_real = os.path.realpath(base) if base else ""
+    # 置き場所の絶対パスは manifest に書かず、指紋にだけ混ぜる
+    h.update(base_real.encode("utf-8", errors="surrogateescape") + b"\0")
+    for rel in _iter_preset_csv_rel_paths(base_real):
+        try:
+            st = os.stat(os.path.join(base_real, *rel.split("/")))
+        except OSError:
+            continue
+        h.update(("%s\0%d\0%d\n" % (rel, st.st_mtime_ns, st.st_size)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _read_preset_pdf_manifest(out_dir: str) -> Dict[str, object]:
+    try:
+        with open(os.path.join(out_dir, _PRESET_PDF_MANIFEST), encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _prebuild_preset_pdf_one(base: str, rel: str, out_dir: str) -> Tuple[str, Dict[str, object]]:
+    """1冊分を描いて <キャッシュキー>.pdf として保存する（プロセスプールから呼ばれる）。"""
+    path = _safe_preset_csv_path(base, rel)
+    if not path:
+        return (rel, {})
+    with open(path, "rb") as fh:
+        raw = fh.read()
+    cleaned = _clean_pdf_items(_parse_preset_csv_text(raw.decode("utf-8-sig", errors="replace")))
+    key = _pdf_cache_key(cleaned)
+    pdf_name = key + ".pdf"
+    pdf_path = os.path.join(out_dir, pdf_name)
+    if not os.path.isfile(pdf_path):
+        pdf = _draw_pdf_word_sheet(cleaned)
+        fd, tmp = tempfile.mkstemp(prefix=".prebuild-", dir=out_dir)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pdf)
+        os.replace(tmp, pdf_path)
+    return (rel, {
+        "csv_sha256": hashlib.sha256(raw).hexdigest(),
+        "pdf": pdf_name,
+        "etag": key,
+        "bytes": os.path.getsize(pdf_path),
+        "rows": len(cleaned),
+        "pages": _pdf_page_count(len(cleaned)),
+    })
+
+
+def _prebuild_preset_pdfs(base: str | None = None, out_dir: str | None = None,
+                          processes: int | None = None, force: bool = False) -> Dict[str, int]:
+    """
+    すべてのプリセット CSV の PDF を生成し、manifest.json（CSV と PDF のハッシュ）を書き換える。
+    CSV の内容もレイアウト版も変わっていない冊は作り直さない。複数冊はプロセスプールで並列に描く。
+    """
+    base = os.path.realpath(base or _pick_wordbook_preset_base())
+    out_dir = out_dir or PRESET_PDF_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    signature = _preset_catalog_signature(base)
+    old = _read_preset_pdf_manifest(out_dir)
+    old_books = old.get("books") if isinstance(old.get("books"), dict) and old.get("layout") == _PDF_LAYOUT_VERSION else {}
+
+    books: Dict[str, Dict[str, object]] = {}
+    todo: List[str] = []
+    for rel in _iter_preset_csv_rel_paths(base):
+        prev = old_books.get(rel) if not force else None
+        path = _safe_preset_csv_path(base, rel)
+        if prev and path and os.path.isfile(os.path.join(out_dir, str(prev.get("pdf")))):
+            with open(path, "rb") as fh:
+                if hashlib.sha256(fh.read()).hexdigest() == prev.get("csv_sha256"):
+                    books[rel] = prev
+                    continue
+        todo.append(rel)
+
+    processes = processes if processes is not None else _PDF_PROCESSES
+    if todo and processes > 1 and len(todo) > 1:
+        with _spawn_process_pool(min(processes, len(todo))) as pool:
+            results = list(pool.map(_prebuild_preset_pdf_one, [base] * len(todo), todo, [out_dir] * len(todo)))
+    else:
+        results = [_prebuild_preset_pdf_one(base, rel, out_dir) for rel in todo]
+    for rel, entry in results:
+        if entry:
+            books[rel] = entry
+
+    manifest = {
+        "layout": _PDF_LAYOUT_VERSION,
+        "signature": signature,
+        "built_at": int(time.time()),
+        "books": dict(sorted(books.items())),
+    }
+    fd, tmp = tempfile.mkstemp(prefix=".manifest-", dir=out_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(out_dir, _PRESET_PDF_MANIFEST))
+
+    # どの冊からも参照されなくなった PDF を片付ける。差し替える前の manifest を読んだばかりの
+    # /api/preset-pdf がまだ開いていないかもしれないので、1つ前の世代の PDF は次の作り直しまで残す
+    keep = {str(e.get("pdf")) for e in books.values()}
+    prev_books = old.get("books") if isinstance(old.get("books"), dict) else {}
+    keep.update(str(e.get("pdf")) for e in prev_books.values() if isinstance(e, dict))
+    for fn in os.listdir(out_dir):
+        if fn.endswith(".pdf") and not fn.startswith(".") and fn not in keep:
+            try:
+                os.remove(os.path.join(out_dir, fn))
+            except OSError:
+                pass
+    return {"books": len(books), "rendered": len(todo)}
+
+
+def _start_preset_pdf_prebuilder(interval: float) -> threading.Thread | None:
+    """interval 秒ごとにプリセットの一覧を調べ、変わっていれば PDF を作り直すバックグラウンドスレッド。"""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                base = os.path.realpath(_pick_wordbook_preset_base())
+                manifest = _read_preset_pdf_manifest(PRESET_PDF_DIR)
+                if manifest.get("signature") != _preset_catalog_signature(base):
+                    _prebuild_preset_pdfs(base)
+            except Exception as e:
+                print(f"preset PDF prebuild failed: {e!r}", file=sys.stderr)
+            time.sleep(interval)
+
+    t = threading.Thread(target=loop, name="preset-pdf-prebuild", daemon=True)
+    t.start()
+    return t
+
+
+_PRESET_PDF_MANIFEST_CACHE: Dict[str, object] = {"mtime": None, "data": {}}
+
+
+def _preset_pdf_manifest() -> Dict[str, object]:
+    path = os.path.join(PRESET_PDF_DIR, _PRESET_PDF_MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _PRESET_PDF_MANIFEST_CACHE["mtime"] != mtime:
+        _PRESET_PDF_MANIFEST_CACHE["data"] = _read_preset_pdf_manifest(PRESET_PDF_DIR)
+        _PRESET_PDF_MANIFEST_CACHE["mtime"] = mtime
+    return _PRESET_PDF_MANIFEST_CACHE["data"]  # type: ignore[return-value]
+
+
+@app.get("/api/preset-pdf")
+def preset_pdf():
+    """事前生成済みの PDF を返す（ETag 付き）。まだなければ /export.pdf でその場で作る。"""
+    rel = (request.args.get("path") or "").strip().strip("/")
+    books = _preset_pdf_manifest().get("books") or {}
+    entry = books.get(rel) if isinstance(books, dict) else None
+    if entry:
+        pdf_path = os.path.join(PRESET_PDF_DIR, str(entry.get("pdf")))
+        if os.path.isfile(pdf_path):
+            resp = send_file(
+                pdf_path,
+                mimetype="application/pdf",
+                as_attachment=True,
+                download_name=os.path.splitext(rel.rpartition("/")[2])[0] + ".pdf",
+                etag=str(entry.get("etag")),
+                conditional=True,
+                max_age=0,
+            )
+            resp.headers["Cache-Control"] = "no-cache"
+            return resp
+    return redirect("/export.pdf?path=" + quote(rel), code=302)
+
+
+# manifest のうち外に見せてよい項目（古い manifest に残るサーバー上のパスなどは返さない）
+_PRESET_PDF_PUBLIC_KEYS = ("layout", "signature", "built_at", "books")
+
+
+@app.get("/api/preset-pdf/manifest")
+def preset_pdf_manifest():
+    manifest = _preset_pdf_manifest()
+    public = {k: manifest[k] for k in _PRESET_PDF_PUBLIC_KEYS if k in manifest}
+    return Response(
+        json.dumps(dict(public, ok=True), ensure_ascii=False),
+        mimetype="application/json",
+    )
+
+
+class _UpstreamBusy(RuntimeError):
+    """
+    上流（Wiktionary）への問い合わせ待ち行列が満杯、または待ち時間切れ。上流自身が 429 / 503 を返したときも使う。
+    retry_after は上流が Retry-After で指定した秒数（指定がなければ 0）。
+    """
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _FairTokenBucket:
+    """
+    トークンバケット + クライアントごとの待ち行列（ラウンドロビン）。
+    トークンが尽きたら呼び出し元をキューで待たせ、空いたトークンはクライアント間で順番に配る。
+    キューが満杯、または max_wait 秒以内にトークンが得られなければ _UpstreamBusy を送出する。
+    """
+
+    def __init__(self, rate: float, burst: float, max_queue: int, max_wait: float):
+        self.rate = max(0.001, rate)
+        self.burst = max(1.0, burst)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max(0.0, max_wait)
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._waiting = 0
+        self._granted = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _refill_locked(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _dispatch_locked(self) -> None:
+        handed = False
+        while self._queues and self._tokens >= 1.0:
+            client, q = self._queues.popitem(last=False)
+            ticket = q.popleft()
+            ticket["granted"] = True
+            self._tokens -= 1.0
+            self._waiting -= 1
+            handed = True
+            if q:
+                self._queues[client] = q
+        if handed:
+            self._cond.notify_all()
+
+    def _enter_locked(self, client: str, now: float) -> Dict[str, bool] | None:
+        """すぐ取れればトークンを取って None、取れなければ待ち行列に並べた札を返す。"""
+        self._refill_locked(now)
+        if not self._queues and self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self._granted += 1
+            _METRICS.inc("wordbook_upstream_limiter_granted_total")
+            return None
+        if self._waiting >= self.max_queue:
+            self._rejected += 1
+            _METRICS.inc("wordbook_upstream_limiter_rejected_total")
+            raise _UpstreamBusy("queue_full")
+        ticket = {"granted": False}
+        self._queues.setdefault(client, deque()).append(ticket)
+        self._waiting += 1
+        return ticket
+
+    def _poll_locked(self, ticket: Dict[str, bool], client: str, deadline: float) -> float | None:
+        """札にトークンが回ってきたら None、まだなら次に確かめるまでの秒数を返す。期限切れは _UpstreamBusy。"""
+        now = time.monotonic()
+        self._refill_locked(now)
+        self._dispatch_locked()
+        if ticket["granted"]:
+            return None
+        remaining = deadline - now
+        if remaining <= 0:
+            self._leave_locked(ticket, client)
+            self._timeouts += 1
+            _METRICS.inc("wordbook_upstream_limiter_timeouts_total")
+            raise _UpstreamBusy("wait_timeout")
+        until_token = (1.0 - self._tokens) / self.rate
+        return min(remaining, max(0.001, until_token))
+
+    def _leave_locked(self, ticket: Dict[str, bool], client: str) -> None:
+        """待つのをやめた札を片付ける。入れ違いでトークンが回っていたら返して次の札に回す。"""
+        if ticket["granted"]:
+            self._tokens += 1.0
+            self._dispatch_locked()
+            return
+        q = self._queues.get(client)
+        if q is not None:
+            q.remove(ticket)
+            if not q:
+                del self._queues[client]
+        self._waiting -= 1
+
+    def _granted_locked(self, t0: float) -> float:
+        waited = time.monotonic() - t0
+        self._granted += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        _METRICS.inc("wordbook_upstream_limiter_granted_total")
+        _METRICS.inc("wordbook_upstream_limiter_wait_seconds_total", waited)
+        return waited
+
+    def acquire(self, client: str = "") -> float:
+        """トークンを1つ取得し、待った秒数を返す。"""
+        t0 = time.monotonic()
+        with self._cond:
+            ticket = self._enter_locked(client, t0)
+            if ticket is None:
+                return 0.0
+            while True:
+                delay = self._poll_locked(ticket, client, t0 + self.max_wait)
+                if delay is None:
+                    return self._granted_locked(t0)
+                self._cond.wait(delay)
+
+    async def acquire_async(self, client: str = "") -> float:
+        """acquire() の asyncio 版。同じバケットと待ち行列を使い、待つ間はスレッドを塞がない。"""
+        t0 = time.monotonic()
+        with self._cond:
+            ticket = self._enter_locked(client, t0)
+        if ticket is None:
+            return 0.0
+        while True:
+            with self._cond:
+                delay = self._poll_locked(ticket, client, t0 + self.max_wait)
+                if delay is None:
+                    return self._granted_locked(t0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # 切断などで取り消されたら札を残さない（残すと他の待ちの順番とトークンを塞ぐ）
+                with self._cond:
+                    self._leave_locked(ticket, client)
+                raise
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            self._refill_locked(time.monotonic())
+            return {
+                "queue_depth": self._waiting,
+                "queue_clients": len(self._queues),
+                "queue_limit": self.max_queue,
+                "tokens": round(self._tokens, 3),
+                "granted": self._granted,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+            }
+
+
+# Wiktionary への同時アクセスを抑える（1秒あたりのリクエスト数・バースト・待ち行列・最大待ち秒）
+_UPSTREAM_LIMITER = _FairTokenBucket(
+    rate=_env_float("WORDBOOK_UPSTREAM_RATE", 5.0),
+    burst=_env_float("WORDBOOK_UPSTREAM_BURST", 10.0),
+    max_queue=_env_int("WORDBOOK_UPSTREAM_QUEUE", 32),
+    max_wait=_env_float("WORDBOOK_UPSTREAM_MAX_WAIT", 5.0),
+)
+
+
+# 上流の記事 URL の前半（負荷試験などで手元のスタブに向けるときに差し替える）
+WIKTIONARY_BASE_URL = os.environ.get("WORDBOOK_WIKTIONARY_URL", "https://en.wiktionary.org/wiki/")
+_WIKTIONARY_HEADERS = {"User-Agent": "wordbook-app/1.0"}
+_WIKTIONARY_TIMEOUT = 6
+
+
+def _wiktionary_url(title: str) -> str:
+    return WIKTIONARY_BASE_URL + quote(title) + "?action=raw"
+
+
+def _wiktionary_get(title: str, client: str = "") -> requests.Response:
+    with _span("rate_limit"):
+        _UPSTREAM_LIMITER.acquire(client)
+    t0 = time.perf_counter()
+    status = "error"
+    with _span("upstream", title=title) as sp:
+        try:
+            r = requests.get(_wiktionary_url(title), timeout=_WIKTIONARY_TIMEOUT, headers=_WIKTIONARY_HEADERS)
+            status = str(r.status_code)
+            return r
+        finally:
+            sp.set(status=status)
+            _record_upstream(status, time.perf_counter() - t0)
+
+
+def _wiktionary_redirect_target(title: str, txt: str) -> str:
+    """本文が #REDIRECT [[...]] なら転送先（自分自身への転送は除く）、そうでなければ ""。"""
+    m = re.match(r"(?is)^\s*#redirect\s*\[\[(.+?)\]\]", txt)
+    if m:
+        target = m.group(1).strip()
+        if target and target.lower() != title.lower():
+            return target
+    return ""
+
+
+def _check_wiktionary_status(status: int, headers) -> bool:
+    """
+    本文を使える（200）なら True、記事が無い（404）なら False。
+    それ以外は一時的な失敗として送出し、「見つからなかった」とは扱わない:
+    429 / 503 は _UpstreamBusy（Retry-After 付き）、ほかは requests.HTTPError。
+    """
+    if status == 200:
+        return True
+    if status == 404:
+        return False
+    if status in (429, 503):
+        try:
+            retry_after = float(headers.get("Retry-After") or 0)
+        except ValueError:
+            retry_after = 0.0
+        raise _UpstreamBusy(f"upstream_{status}", retry_after=max(0.0, retry_after))
+    raise requests.HTTPError(f"upstream status {status}")
+
+
+def _fetch_wiktionary_raw(title: str, client: str = "") -> str:
     t = title.strip()
     if not t:
         return ""
-    url = "https://en.wiktionary.org/wiki/" + quote(t) + "?action=raw"
-    r = requests.get(url, timeout=6, headers={"User-Agent": "wordbook-app/1.0"})
-    if r.status_code != 200:
+    r = _wiktionary_get(t, client)
+    if not _check_wiktionary_status(r.status_code, r.headers):
         return ""
     txt = r.text or ""
-    m = re.match(r"(?is)^\s*#redirect\s*\[\[(.+?)\]\]", txt)
-    if m:
-        target = m.group(1).strip()
-        if target and target.lower() != t.lower():
-            url2 = "https://en.wiktionary.org/wiki/" + quote(target) + "?action=raw"
-            r2 = requests.get(url2, timeout=6, headers={"User-Agent": "wordbook-app/1.0"})
-            if r2.status_code == 200:
-                return r2.text or ""
+    target = _wiktionary_redirect_target(t, txt)
+    if target:
+        with _span("redirect", target=target):
+            r2 = _wiktionary_get(target, client)
+        if _check_wiktionary_status(r2.status_code, r2.headers):
+            return r2.text or ""
     return txt
 
 
@@ -1623,39 +3868,1660 @@ def _extract_ja_and_pos_nearby(wikitext: str, limit: int = 6) -> Tuple[str, List
     return (prefix, out)
 
 
-def _lookup_case_insensitive_with_pos(word: str) -> str:
+def _word_variants(word: str) -> List[str]:
     w = word.strip()
-    if not w:
-        return ""
-
-    variants = []
+    variants: List[str] = []
     for v in (w, w.lower(), w.capitalize(), w.title(), w.upper()):
         if v and v not in variants:
             variants.append(v)
+    return variants
 
-    for v in variants:
-        raw = _fetch_wiktionary_raw(v)
-        prefix, ja_list = _extract_ja_and_pos_nearby(raw, limit=6)
-        if ja_list:
-            body = "、".join(ja_list)
-            return (prefix + body) if prefix else body
 
-    return ""
+def _format_meaning(raw: str) -> str:
+    prefix, ja_list = _extract_ja_and_pos_nearby(raw, limit=6)
+    if not ja_list:
+        return ""
+    body = "、".join(ja_list)
+    return (prefix + body) if prefix else body
+
+
+def _lookup_case_insensitive_with_pos(word: str, client: str = "") -> str:
+    w = word.strip()
+    if not w:
+        return ""
+
+    meaning = ""
+    tried = 0
+    for v in _word_variants(w):
+        tried += 1
+        with _span("variant", title=v):
+            raw = _fetch_wiktionary_raw(v, client)
+            with _span("extract", chars=len(raw)):
+                meaning = _format_meaning(raw)
+        if meaning:
+            break
+
+    _METRICS.observe("wordbook_lookup_variants_tried", tried)
+    return meaning
+
+
+class _LookupBackend(abc.ABC):
+    """辞書バックエンドの共通部分。lookup() は見つからなければ "" を返し、所要時間と命中率を記録する。"""
+
+    name = ""
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def available(self) -> bool:
+        return True
+
+    @abc.abstractmethod
+    def _lookup(self, word: str, client: str) -> str:
+        """word の意味を引く。見つからなければ ""。"""
+
+    async def _lookup_async(self, word: str, client: str) -> str:
+        # 手元で済むバックエンドはそのまま同期で引く（ネットワークを使うものだけが上書きする）
+        return self._lookup(word, client)
+
+    def _record(self, dt: float, meaning: str) -> None:
+        with self._stats_lock:
+            self.calls += 1
+            self.seconds += dt
+            if meaning:
+                self.hits += 1
+        _METRICS.inc("wordbook_lookup_backend_calls_total", backend=self.name)
+        if meaning:
+            _METRICS.inc("wordbook_lookup_backend_hits_total", backend=self.name)
+
+    def lookup(self, word: str, client: str = "") -> str:
+        meaning = ""
+        t0 = time.perf_counter()
+        try:
+            meaning = self._lookup(word, client)
+        finally:
+            self._record(time.perf_counter() - t0, meaning)
+        return meaning
+
+    async def lookup_async(self, word: str, client: str = "") -> str:
+        meaning = ""
+        t0 = time.perf_counter()
+        try:
+            meaning = await self._lookup_async(word, client)
+        finally:
+            self._record(time.perf_counter() - t0, meaning)
+        return meaning
+
+    def _observed_cost(self) -> float | None:
+        with self._stats_lock:
+            calls, hits, seconds = self.calls, self.hits, self.seconds
+        if not calls:
+            return None
+        return (seconds / calls) / max(hits / calls, 0.01)
+
+    def cost(self) -> float:
+        """1件見つけるのに見込まれる秒数（平均所要時間 / 命中率）。小さいほど先に試す価値がある。"""
+        c = self._observed_cost()
+        return 0.0 if c is None else c
+
+    def stats(self) -> Dict[str, object]:
+        with self._stats_lock:
+            calls, hits, seconds = self.calls, self.hits, self.seconds
+        return {
+            "name": self.name,
+            "available": self.available(),
+            "calls": calls,
+            "hits": hits,
+            "hit_rate": round(hits / calls, 4) if calls else 0.0,
+            "avg_ms": round(seconds * 1000 / calls, 3) if calls else 0.0,
+        }
+
+
+class _MemoryCacheBackend(_LookupBackend):
+    """下流のバックエンドで見つかった意味を保持する LRU キャッシュ。"""
+
+    name = "cache"
+
+    def __init__(self, max_items: int):
+        super().__init__()
+        self.max_items = max(0, max_items)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+
+    def _lookup(self, word: str, client: str) -> str:
+        with self._lock:
+            meaning = self._data.get(word)
+            if meaning is not None:
+                self._data.move_to_end(word)
+            return meaning or ""
+
+    def put(self, word: str, meaning: str) -> None:
+        if not self.max_items or not meaning:
+            return
+        with self._lock:
+            self._data[word] = meaning
+            self._data.move_to_end(word)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+
+class _SqliteIndexBackend(_LookupBackend):
+    """
+    build-jmdict / build-wiktionary-index で作った entries(word, meaning) テーブルを引く。
+    索引ファイルの有無と mtime は stat_interval 秒ごとにだけ確かめ、再構築（os.replace）されていたら開き直す。
+    接続はスレッドに紐づけず、使い終わったら pool_size 本まで取っておいて次の呼び出しで使い回す
+    （開発サーバーはリクエストごとにスレッドが替わるため）。
+    """
+
+    stat_interval = 2.0
+    pool_size = 4
+
+    def __init__(self, name: str, path: str, case_variants: bool):
+        super().__init__()
+        self.name = name
+        self.path = path
+        self.case_variants = case_variants
+        self._pool_lock = threading.Lock()
+        self._idle: List[sqlite3.Connection] = []
+        self._mtime: int | None = None
+        self._checked = float("-inf")
+
+    def _refresh(self) -> int | None:
+        """索引の mtime（無ければ None）。前回から stat_interval 秒以内なら覚えている値を返す。"""
+        with self._pool_lock:
+            now = time.monotonic()
+            if now - self._checked < self.stat_interval:
+                return self._mtime
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns if self.path else None
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                # 古い索引への接続は捨てる（使用中のものは返ってきたときに閉じる）
+                for conn in self._idle:
+                    conn.close()
+                self._idle = []
+                self._mtime = mtime
+            return mtime
+
+    def available(self) -> bool:
+        return self._refresh() is not None
+
+    def _acquire(self) -> Tuple[sqlite3.Connection, int | None]:
+        with self._pool_lock:
+            mtime = self._mtime
+            if self._idle:
+                return (self._idle.pop(), mtime)
+        uri = "file:" + pathname2url(os.path.abspath(self.path)) + "?mode=ro"
+        return (sqlite3.connect(uri, uri=True, check_same_thread=False), mtime)
+
+    def _release(self, conn: sqlite3.Connection, mtime: int | None) -> None:
+        with self._pool_lock:
+            if mtime == self._mtime and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _lookup(self, word: str, client: str) -> str:
+        if not self.available():
+            return ""
+        keys = _word_variants(word) if self.case_variants else [word.strip().lower()]
+        conn, mtime = self._acquire()
+        try:
+            for k in keys:
+                row = conn.execute("SELECT meaning FROM entries WHERE word = ?", (k,)).fetchone()
+                if row and row[0]:
+                    return row[0]
+        finally:
+            self._release(conn, mtime)
+        return ""
+
+
+class _WiktionaryNetworkBackend(_LookupBackend):
+    name = "wiktionary"
+
+    def _lookup(self, word: str, client: str) -> str:
+        return _lookup_case_insensitive_with_pos(word, client)
+
+    async def _lookup_async(self, word: str, client: str) -> str:
+        return await _lookup_case_insensitive_with_pos_async(word, client)
+
+
+class _BackendChain:
+    """
+    先頭から順に問い合わせ、最初に見つかった意味を返す。cache は常に先頭で、見つかった結果を覚える。
+    adaptive のときは reorder_every 回ごとに、残りのバックエンドを観測コスト（cost()）の小さい順に並べ替える。
+    """
+
+    def __init__(self, backends: List[_LookupBackend], cache: _MemoryCacheBackend | None = None,
+                 adaptive: bool = False, reorder_every: int = 64):
+        self.cache = cache
+        self.adaptive = adaptive
+        self.reorder_every = max(1, reorder_every)
+        self._lock = threading.Lock()
+        self._order = list(backends)
+        self._since_reorder = 0
+
+    def order(self) -> List[_LookupBackend]:
+        with self._lock:
+            return list(self._order)
+
+    def _maybe_reorder(self) -> None:
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._since_reorder += 1
+            if self._since_reorder < self.reorder_every:
+                return
+            self._since_reorder = 0
+            # 一度も呼ばれていないバックエンドは現在位置のまま（cost()==0 で先頭に来ないよう元の順位を使う）
+            costs = [b._observed_cost() for b in self._order]
+            ranked = sorted(
+                range(len(self._order)),
+                key=lambda i: (float("inf") if costs[i] is None else costs[i], i),
+            )
+            self._order = [self._order[i] for i in ranked]
+
+    def lookup(self, word: str, client: str = "") -> str:
+        w = word.strip()
+        if not w:
+            return ""
+        if self.cache is not None:
+            with _span("cache") as sp:
+                hit = self.cache.lookup(w, client)
+                sp.set(hit=bool(hit))
+            if hit:
+                return hit
+        meaning = ""
+        try:
+            for b in self.order():
+                if not b.available():
+                    continue
+                with _span("backend", backend=b.name) as sp:
+                    meaning = b.lookup(w, client)
+                    sp.set(hit=bool(meaning))
+                if meaning:
+                    break
+        finally:
+            self._maybe_reorder()
+        if meaning and self.cache is not None:
+            self.cache.put(w, meaning)
+        return meaning
+
+    async def lookup_async(self, word: str, client: str = "") -> str:
+        """lookup() の asyncio 版。順序・キャッシュ・並べ替えは同じ。"""
+        w = word.strip()
+        if not w:
+            return ""
+        if self.cache is not None:
+            with _span("cache") as sp:
+                hit = self.cache.lookup(w, client)
+                sp.set(hit=bool(hit))
+            if hit:
+                return hit
+        meaning = ""
+        try:
+            for b in self.order():
+                if not b.available():
+                    continue
+                with _span("backend", backend=b.name) as sp:
+                    meaning = await b.lookup_async(w, client)
+                    sp.set(hit=bool(meaning))
+                if meaning:
+                    break
+        finally:
+            self._maybe_reorder()
+        if meaning and self.cache is not None:
+            self.cache.put(w, meaning)
+        return meaning
+
+    def stats(self) -> List[Dict[str, object]]:
+        head = [self.cache.stats()] if self.cache is not None else []
+        return head + [dict(b.stats(), cost_ms=round(b.cost() * 1000, 3)) for b in self.order()]
+
+
+JMDICT_URL = "http://ftp.edrdg.org/pub/Nihongo/JMdict_e.gz"
+JMDICT_INDEX_PATH = os.environ.get("WORDBOOK_JMDICT_INDEX", os.path.join(_DATA_DIR, "jmdict_en_ja.sqlite3"))
+WIKTIONARY_INDEX_PATH = os.environ.get(
+    "WORDBOOK_WIKTIONARY_INDEX", os.path.join(_DATA_DIR, "wiktionary_en_ja.sqlite3")
+)
+
+
+def _make_lookup_chain() -> _BackendChain:
+    """WORDBOOK_LOOKUP_CHAIN（カンマ区切り）の順でバックエンドを組み立てる。"""
+    names = [
+        n.strip().lower()
+        for n in (os.environ.get("WORDBOOK_LOOKUP_CHAIN") or "cache,jmdict,wiktionary-offline,wiktionary").split(",")
+        if n.strip()
+    ]
+    cache = None
+    backends: List[_LookupBackend] = []
+    for n in names:
+        if n == "cache":
+            cache = _MemoryCacheBackend(_env_int("WORDBOOK_LOOKUP_CACHE_SIZE", 4096))
+        elif n == "jmdict":
+            backends.append(_SqliteIndexBackend("jmdict", JMDICT_INDEX_PATH, case_variants=False))
+        elif n == "wiktionary-offline":
+            backends.append(_SqliteIndexBackend("wiktionary-offline", WIKTIONARY_INDEX_PATH, case_variants=True))
+        elif n == "wiktionary":
+            backends.append(_WiktionaryNetworkBackend())
+    return _BackendChain(
+        backends,
+        cache=cache,
+        adaptive=os.environ.get("WORDBOOK_LOOKUP_ADAPTIVE", "") == "1",
+        reorder_every=_env_int("WORDBOOK_LOOKUP_REORDER_EVERY", 64),
+    )
+
+
+_LOOKUP_CHAIN = _make_lookup_chain()
 
 
 @app.post("/lookup")
 def lookup():
-    data = request.get_data(cache=False, as_text=True) or "{}"
     try:
-        payload = json.loads(data)
-    except Exception:
-        payload = {}
+        payload = _read_json_payload(_LOOKUP_MAX_JSON_BYTES)
+    except _PayloadTooLarge as e:
+        return Response(
+            json.dumps({"meaning": "", "error": str(e)}, ensure_ascii=False),
+            status=413,
+            mimetype="application/json",
+        )
 
     word = str(payload.get("word", "")).strip()
-    meaning = _lookup_case_insensitive_with_pos(word)
+    try:
+        meaning = _LOOKUP_CHAIN.lookup(word, request.remote_addr or "")
+    except _UpstreamBusy as e:
+        return Response(
+            json.dumps({"meaning": "", "error": "busy", "reason": str(e)}, ensure_ascii=False),
+            status=429,
+            mimetype="application/json",
+            headers={"Retry-After": str(max(2, int(e.retry_after)))},
+        )
+    except requests.RequestException as e:
+        # 上流の 5xx や通信エラー。「見つからなかった」とは返さない
+        return Response(
+            json.dumps({"meaning": "", "error": "upstream_error", "reason": type(e).__name__}, ensure_ascii=False),
+            status=502,
+            mimetype="application/json",
+        )
     return Response(json.dumps({"meaning": meaning}, ensure_ascii=False), mimetype="application/json")
 
 
-if __name__ == "__main__":
+@app.get("/api/upstream/stats")
+def upstream_stats():
+    return Response(
+        json.dumps({"ok": True, "limiter": _UPSTREAM_LIMITER.stats()}, ensure_ascii=False),
+        mimetype="application/json",
+    )
+
+
+@app.get("/api/lookup/backends")
+def lookup_backends():
+    return Response(
+        json.dumps({"ok": True, "backends": _LOOKUP_CHAIN.stats()}, ensure_ascii=False),
+        mimetype="application/json",
+    )
+
+
+# サーバーへの同期は WORDBOOK_SYNC=1 のときだけ有効（無効なら /api/sync は 404、画面にも出さない）
+_SYNC_ENABLED = os.environ.get("WORDBOOK_SYNC", "") == "1"
+WORDBOOK_STORE_PATH = os.environ.get("WORDBOOK_STORE_PATH", os.path.join(_DATA_DIR, "wordbook.sqlite3"))
+# 1人あたりの行数（削除済みの記録も含む）・利用者の数・SQLite ファイルの大きさの上限
+_SYNC_MAX_ITEMS = _env_int("WORDBOOK_SYNC_MAX_ITEMS", 20000)
+_SYNC_MAX_USERS = _env_int("WORDBOOK_SYNC_MAX_USERS", 1000)
+_SYNC_MAX_STORE_BYTES = _env_int("WORDBOOK_SYNC_MAX_BYTES", 256 * 1024 * 1024)
+_SYNC_USER_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+_SYNC_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_SYNC_MAX_CHANGES = _env_int("WORDBOOK_SYNC_MAX_CHANGES", 20000)
+_SYNC_MAX_TEXT = 1000
+
+
+class _StoreFull(Exception):
+    pass
+
+
+class _WordbookStore:
+    """
+    あなたの単語帳をサーバー側の SQLite に置く。利用者（同期キー）ごとに version を持ち、
+    追加・更新・削除を1件受け付けるたびに1つ進めて、その行を最後に変えた version を行に記録する。
+    削除は deleted=1 の行として残すので、端末が知っている version（since）より後の行だけを返せば差分になる。
+    since=0（初回）のときは削除済みを除いた全件を作成順に返す。
+    変更を当てて1人の行数が max_items を超えたら削除済みの行を捨て、その時点の version を purged に記録する
+    （purged より前の since で来た端末は削除を知りようがないので reset="purged" として全件を返す）。
+    それでも超える変更・利用者が max_users に達したあとの新しい利用者・ファイルが max_bytes を超えたあとの変更は
+    まとめて取り消して _StoreFull を送出する。
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            purged INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            user TEXT NOT NULL,
+            id TEXT NOT NULL,
+            word TEXT NOT NULL,
+            meaning TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS items_user_version ON items (user, version);
+    """
+
+    def __init__(self, path: str, max_items: int, max_users: int, max_bytes: int):
+        self.path = path
+        self.max_items = max(1, max_items)
+        self.max_users = max(1, max_users)
+        self.max_bytes = max(0, max_bytes)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        # 接続はスレッドごと（serve の各ワーカーは fork 後に開く）。書き込みの排他は SQLite のロックに任せる
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # WAL はファイルに残る設定で、表も一度作れば足りる。プロセスで最初の接続のときだけ流す
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(self._SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _store_bytes(self, conn: sqlite3.Connection) -> int:
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return (pages - free) * size
+
+    def _check_room(self, conn: sqlite3.Connection, known: bool) -> None:
+        if self.max_bytes and self._store_bytes(conn) > self.max_bytes:
+            raise _StoreFull("store_full")
+        if not known and conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] >= self.max_users:
+            raise _StoreFull("too_many_users")
+
+    def _trim_user(self, conn: sqlite3.Connection, user: str, version: int, purged: int) -> int:
+        """変更を当てたあとの行数が max_items を超えていたら削除済みの行を捨てる。戻り値は新しい purged。"""
+        count = "SELECT COUNT(*) FROM items WHERE user = ?"
+        if conn.execute(count, (user,)).fetchone()[0] <= self.max_items:
+            return purged
+        conn.execute("DELETE FROM items WHERE user = ? AND deleted = 1", (user,))
+        if conn.execute(count, (user,)).fetchone()[0] > self.max_items:
+            raise _StoreFull("user_full")
+        return version
+
+    def sync(self, user: str, since: int, changes: List[Dict[str, str]]) -> Tuple[int, str, List[Dict[str, object]]]:
+        """
+        changes を届いた順に適用し、(新しい version, reset, since より後の変更) を返す。reset が空でなければ全件を返す。
+          "lost"    … since がサーバーの version より新しい（サーバー側のデータが失われた）。端末の単語を送り直してもらう
+          "purged"  … since より後の削除の記録を捨てた。端末はサーバーの全件で置き換え、未送信の変更だけ当て直す
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT version, purged FROM users WHERE user = ?", (user,)).fetchone()
+            version, purged = row if row else (0, 0)
+            reset = "lost" if since > version else ""
+            if changes:
+                self._check_room(conn, row is not None)
+            for ch in changes:
+                version += 1
+                if ch["op"] == "put":
+                    conn.execute(
+                        "INSERT INTO items (user, id, word, meaning, created, version, deleted)"
+                        " VALUES (?, ?, ?, ?, ?, ?, 0)"
+                        " ON CONFLICT (user, id) DO UPDATE SET"
+                        " word = excluded.word, meaning = excluded.meaning, version = excluded.version, deleted = 0",
+                        (user, ch["id"], ch["word"], ch["meaning"], version, version),
+                    )
+                elif ch["op"] == "del":
+                    conn.execute(
+                        "UPDATE items SET deleted = 1, version = ? WHERE user = ? AND id = ? AND deleted = 0",
+                        (version, user, ch["id"]),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE items SET deleted = 1, version = ? WHERE user = ? AND deleted = 0",
+                        (version, user),
+                    )
+            if changes:
+                purged = self._trim_user(conn, user, version, purged)
+                conn.execute(
+                    "INSERT INTO users (user, version, purged) VALUES (?, ?, ?)"
+                    " ON CONFLICT (user) DO UPDATE SET version = excluded.version, purged = excluded.purged",
+                    (user, version, purged),
+                )
+            if not reset and 0 < since < purged:
+                reset = "purged"
+            if since <= 0 or reset:
+                rows = conn.execute(
+                    "SELECT id, word, meaning, created, version FROM items"
+                    " WHERE user = ? AND deleted = 0 ORDER BY created",
+                    (user,),
+                ).fetchall()
+                out = [{"id": r[0], "word": r[1], "meaning": r[2], "created": r[3], "version": r[4]} for r in rows]
+            else:
+                rows = conn.execute(
+                    "SELECT id, word, meaning, created, version, deleted FROM items"
+                    " WHERE user = ? AND version > ? ORDER BY version",
+                    (user, since),
+                ).fetchall()
+                out = [
+                    {"id": r[0], "deleted": True, "version": r[4]} if r[5]
+                    else {"id": r[0], "word": r[1], "meaning": r[2], "created": r[3], "version": r[4]}
+                    for r in rows
+                ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return (version, reset, out)
+
+
+_WORDBOOK_STORE = _WordbookStore(WORDBOOK_STORE_PATH, _SYNC_MAX_ITEMS, _SYNC_MAX_USERS, _SYNC_MAX_STORE_BYTES)
+
+
+def _clean_sync_change(ch: object) -> Dict[str, str] | None:
+    """{"op": "put", "id", "word", "meaning"} / {"op": "del", "id"} / {"op": "clear"} 以外は捨てる。"""
+    if not isinstance(ch, dict):
+        return None
+    op = ch.get("op")
+    if op == "clear":
+        return {"op": "clear"}
+    cid = ch.get("id")
+    if op not in ("put", "del") or not isinstance(cid, str) or not _SYNC_ID_RE.match(cid):
+        return None
+    if op == "del":
+        return {"op": "del", "id": cid}
+    word, meaning = ch.get("word"), ch.get("meaning")
+    if not isinstance(word, str) or not isinstance(meaning, str):
+        return None
+    word, meaning = word.strip()[:_SYNC_MAX_TEXT], meaning.strip()[:_SYNC_MAX_TEXT]
+    if not word or not meaning:
+        return None
+    return {"op": "put", "id": cid, "word": word, "meaning": meaning}
+
+
+@app.post("/api/sync")
+def wordbook_sync():
+    """
+    あなたの単語帳の差分同期。本文は {"user": 同期キー, "since": 端末が持っている version, "changes": [...]}。
+    changes を適用したうえで {"version", "reset", "changes": since より後の変更} を返す。
+    reset は全件を返したときの理由（"lost" / "purged"、_WordbookStore.sync を参照）で、差分のときは false。
+    1人分の上限を超える変更は 413、利用者数やファイルの大きさが上限に達していれば 507 で、どちらも何も適用しない。
+    """
+    if not _SYNC_ENABLED:
+        return _json_response({"ok": False, "error": "sync_disabled"}, 404)
+    try:
+        payload = _read_json_payload(_MAX_JSON_BYTES, "changes", _clean_sync_change, _SYNC_MAX_CHANGES)
+    except _PayloadTooLarge as e:
+        return _json_response({"ok": False, "error": str(e)}, 413)
+
+    user = payload.get("user")
+    if not isinstance(user, str) or not _SYNC_USER_RE.match(user):
+        return _json_response({"ok": False, "error": "bad_user"}, 400)
+    since = payload.get("since", 0)
+    if isinstance(since, bool) or not isinstance(since, int) or since < 0:
+        return _json_response({"ok": False, "error": "bad_since"}, 400)
+    changes = payload.get("changes")
+    if not isinstance(changes, list):
+        changes = []
+
+    try:
+        with _span("store.sync", changes=len(changes)) as sp:
+            version, reset, out = _WORDBOOK_STORE.sync(user, since, changes)
+            sp.set(returned=len(out))
+    except _StoreFull as e:
+        return _json_response({"ok": False, "error": str(e)}, 413 if str(e) == "user_full" else 507)
+    except sqlite3.Error as e:
+        print(f"wordbook store error: {e!r}", file=sys.stderr)
+        return _json_response({"ok": False, "error": "store_error"}, 503)
+    return _json_response({"ok": True, "version": version, "reset": reset or False, "changes": out})
+
+
+@app.before_request
+def _request_start():
+    request.environ["wordbook.t0"] = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule is not None else "other"
+    request.environ["wordbook.trace"] = _trace_start(request.method + " " + route, path=request.path)
+
+
+@app.after_request
+def _request_finish(resp: Response) -> Response:
+    t0 = request.environ.get("wordbook.t0") or time.perf_counter()
+    trace = request.environ.get("wordbook.trace")
+    route = request.url_rule.rule if request.url_rule is not None else "other"
+    method, status, size = request.method, resp.status_code, resp.content_length or 0
+
+    # 本文を送り終えた（閉じられた）時点で記録するので、ストリーミングの送信時間も含まれる
+    def done():
+        _record_http(route, method, status, size, time.perf_counter() - t0)
+        _trace_finish(trace, status=status, bytes=size)
+
+    if resp.direct_passthrough:
+        # そのまま WSGI サーバーに渡される反復子には Response.close() が呼ばれないので、こちらで包む
+        resp.response = ClosingIterator(resp.response, done)
+    else:
+        resp.call_on_close(done)
+    return resp
+
+
+def _metrics_gauges() -> Iterator[Tuple[str, str, Dict[str, str], float]]:
+    # いまの値だけをこのプロセスの分として出す。増えるだけの件数はカウンタにして、ワーカー分を足し合わせる
+    cache = _PDF_CACHE.stats()
+    for k in ("mem_items", "mem_bytes"):
+        yield ("wordbook_pdf_cache_" + k, "PDF cache: " + k.replace("_", " ") + " in this process.", {}, cache[k])
+    memo = _PDF_LAYOUT_MEMO.stats()
+    for k in ("items", "max_items"):
+        yield ("wordbook_pdf_layout_memo_" + k, "Meaning-cell layout memo: " + k.replace("_", " ") + ".", {}, memo[k])
+    limiter = _UPSTREAM_LIMITER.stats()
+    for k in ("queue_depth", "queue_clients", "queue_limit", "tokens", "wait_seconds_max"):
+        yield ("wordbook_upstream_limiter_" + k, "Upstream rate limiter: " + k.replace("_", " ") + ".", {}, limiter[k])
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(_METRICS.render(_metrics_gauges()), mimetype="text/plain; version=0.0.4")
+
+
+class _ProfilingMiddleware:
+    """
+    指定したリクエストだけを cProfile で計測し、<時刻>-<パス>-<ミリ秒>ms-<pid>.prof として profile_dir に書き出す。
+      ・ヘッダー X-Wordbook-Profile またはクエリ _profile に WORDBOOK_PROFILE_TOKEN と同じ値を付けたリクエスト
+      ・WORDBOOK_PROFILE_SAMPLE=N なら N 件に1件
+    どちらも設定していなければ何もしない。本文を送る間（ストリーミング）も計測に含める。
+    書き出した .prof は python -m pstats や snakeviz で読める。古いものから消して keep 件までに保つ。
+    """
+
+    def __init__(self, wsgi_app, profile_dir: str, token: str, sample: int, keep: int):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.token = token
+        self.sample = max(0, sample)
+        self.keep = max(1, keep)
+        self._seq = itertools.count(1)
+
+    def _wanted(self, environ) -> bool:
+        if self.token:
+            given = environ.get("HTTP_X_WORDBOOK_PROFILE", "")
+            if not given and "_profile=" in environ.get("QUERY_STRING", ""):
+                given = (parse_qs(environ["QUERY_STRING"]).get("_profile") or [""])[0]
+            if given and hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+                return True
+        return bool(self.sample) and next(self._seq) % self.sample == 0
+
+    def __call__(self, environ, start_response):
+        if not (self.token or self.sample) or not self._wanted(environ):
+            return self.wsgi_app(environ, start_response)
+
+        t0 = time.perf_counter()
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            prof.disable()
+            self._dump(prof, environ, time.perf_counter() - t0)
+            raise
+        prof.disable()
+        return self._iterate(body, prof, environ, t0)
+
+    def _iterate(self, body, prof: cProfile.Profile, environ, t0: float) -> Iterator[bytes]:
+        end = object()
+        it = iter(body)
+        try:
+            while True:
+                prof.enable()
+                try:
+                    chunk = next(it, end)
+                finally:
+                    prof.disable()
+                if chunk is end:
+                    break
+                yield chunk
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+            self._dump(prof, environ, time.perf_counter() - t0)
+
+    def _dump(self, prof: cProfile.Profile, environ, seconds: float) -> None:
+        path = re.sub(r"[^A-Za-z0-9._-]+", "_", (environ.get("PATH_INFO") or "/").strip("/")) or "index"
+        name = "%s-%s-%dms-%d.prof" % (time.strftime("%Y%m%dT%H%M%S"), path[:60], seconds * 1000, os.getpid())
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            prof.dump_stats(os.path.join(self.profile_dir, name))
+            files = sorted(fn for fn in os.listdir(self.profile_dir) if fn.endswith(".prof"))
+            for fn in files[:-self.keep]:
+                os.remove(os.path.join(self.profile_dir, fn))
+        except OSError as e:
+            print(f"profile dump failed: {e!r}", file=sys.stderr)
+
+
+app.wsgi_app = _ProfilingMiddleware(
+    app.wsgi_app,
+    profile_dir=os.environ.get("WORDBOOK_PROFILE_DIR") or os.path.join(_DATA_DIR, "profiles"),
+    token=os.environ.get("WORDBOOK_PROFILE_TOKEN", ""),
+    sample=_env_int("WORDBOOK_PROFILE_SAMPLE", 0),
+    keep=_env_int("WORDBOOK_PROFILE_KEEP", 200),
+)
+
+
+# ---- asyncio 版の検索経路（ASGI） ----
+# 同期版と同じ上流・変種・転送・抽出を httpx.AsyncClient で行う。待っている間はスレッドを使わないので、
+# 大量の同時検索を少ないスレッドで捌ける。  uvicorn app:asgi_app  のように ASGI サーバーから起動する。
+
+_ASYNC_HTTP: Dict[str, object] = {"client": None, "loop": None}
+
+
+def _async_http_client():
+    """イベントループごとに1つの httpx.AsyncClient を使い回す（接続を保持する）。"""
+    loop = asyncio.get_running_loop()
+    if _ASYNC_HTTP["client"] is None or _ASYNC_HTTP["loop"] is not loop:
+        import httpx
+
+        _ASYNC_HTTP["client"] = httpx.AsyncClient(
+            timeout=_WIKTIONARY_TIMEOUT,
+            headers=_WIKTIONARY_HEADERS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=_env_int("WORDBOOK_ASYNC_UPSTREAM_CONNECTIONS", 20)),
+        )
+        _ASYNC_HTTP["loop"] = loop
+    return _ASYNC_HTTP["client"]
+
+
+def _async_http_errors() -> tuple:
+    """上流の失敗として扱う例外の型（httpx の通信エラーを含む）。"""
+    import httpx
+
+    return (requests.RequestException, httpx.HTTPError)
+
+
+async def _close_async_http_client() -> None:
+    client = _ASYNC_HTTP["client"]
+    _ASYNC_HTTP["client"] = _ASYNC_HTTP["loop"] = None
+    if client is not None:
+        await client.aclose()
+
+
+async def _wiktionary_get_async(title: str, client: str = ""):
+    with _span("rate_limit"):
+        await _UPSTREAM_LIMITER.acquire_async(client)
+    t0 = time.perf_counter()
+    status = "error"
+    with _span("upstream", title=title) as sp:
+        try:
+            r = await _async_http_client().get(_wiktionary_url(title))
+            status = str(r.status_code)
+            return r
+        finally:
+            sp.set(status=status)
+            _record_upstream(status, time.perf_counter() - t0)
+
+
+async def _fetch_wiktionary_raw_async(title: str, client: str = "") -> str:
+    t = title.strip()
+    if not t:
+        return ""
+    r = await _wiktionary_get_async(t, client)
+    if not _check_wiktionary_status(r.status_code, r.headers):
+        return ""
+    txt = r.text or ""
+    target = _wiktionary_redirect_target(t, txt)
+    if target:
+        with _span("redirect", target=target):
+            r2 = await _wiktionary_get_async(target, client)
+        if _check_wiktionary_status(r2.status_code, r2.headers):
+            return r2.text or ""
+    return txt
+
+
+async def _lookup_case_insensitive_with_pos_async(word: str, client: str = "") -> str:
+    w = word.strip()
+    if not w:
+        return ""
+
+    meaning = ""
+    tried = 0
+    for v in _word_variants(w):
+        tried += 1
+        with _span("variant", title=v):
+            raw = await _fetch_wiktionary_raw_async(v, client)
+            with _span("extract", chars=len(raw)):
+                meaning = _format_meaning(raw)
+        if meaning:
+            break
+
+    _METRICS.observe("wordbook_lookup_variants_tried", tried)
+    return meaning
+
+
+async def _asgi_read_body(receive, max_bytes: int) -> bytes:
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_bytes:
+            raise _PayloadTooLarge("too_large")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _asgi_send_json(send, payload: Dict[str, object], status: int = 200,
+                          headers: Dict[str, str] | None = None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    raw_headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _asgi_lookup(scope, receive, send) -> None:
+    try:
+        data = await _asgi_read_body(receive, _LOOKUP_MAX_JSON_BYTES)
+    except _PayloadTooLarge as e:
+        await _asgi_send_json(send, {"meaning": "", "error": str(e)}, 413)
+        return
+    try:
+        payload = json.loads(data.decode("utf-8", errors="replace") or "{}")
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+
+    word = str(payload.get("word", "")).strip()
+    remote = (scope.get("client") or ("",))[0] or ""
+    try:
+        meaning = await _LOOKUP_CHAIN.lookup_async(word, remote)
+    except _UpstreamBusy as e:
+        await _asgi_send_json(send, {"meaning": "", "error": "busy", "reason": str(e)}, 429,
+                              {"Retry-After": str(max(2, int(e.retry_after)))})
+        return
+    except _async_http_errors() as e:
+        await _asgi_send_json(send, {"meaning": "", "error": "upstream_error", "reason": type(e).__name__}, 502)
+        return
+    await _asgi_send_json(send, {"meaning": meaning})
+
+
+def _asgi_wsgi_environ(scope, body) -> Dict[str, object]:
+    host, port = (scope.get("server") or ("localhost", 80))[:2]
+    environ: Dict[str, object] = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(host),
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": (scope.get("client") or ("",))[0] or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # 本文は読み切って渡すので、Content-Length のない（chunked の）本文も終わりまで読ませる
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+        else:
+            key = "HTTP_" + key
+            environ[key] = (environ[key] + "," + value) if key in environ else value
+    return environ
+
+
+async def _asgi_wsgi_fallback(scope, receive, send) -> None:
+    """
+    /lookup 以外は Flask アプリをスレッドで動かして返す（本文は一時ファイル経由、応答は少しずつ送る）。
+    本文は _MAX_JSON_BYTES までで、超えたら読むのをやめて 413 を返す。
+    """
+    loop = asyncio.get_running_loop()
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"content-length" and value.isdigit() and int(value) > _MAX_JSON_BYTES:
+            await _asgi_send_json(send, {"ok": False, "error": "too_large"}, 413)
+            return
+    body = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > _MAX_JSON_BYTES:
+                await _asgi_send_json(send, {"ok": False, "error": "too_large"}, 413)
+                return
+            body.write(chunk)
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        started: Dict[str, object] = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+            return lambda _data: None
+
+        # アプリの呼び出し・本文の取り出し・close を同じコンテキストで動かす。
+        # run_in_executor はコンテキストを引き継がないので、そのままだと計測の span が実行器のスレッドに残る
+        ctx = contextvars.copy_context()
+        result = await loop.run_in_executor(None, ctx.run, app.wsgi_app, _asgi_wsgi_environ(scope, body), start_response)
+        try:
+            chunks = iter(result)
+            first = await loop.run_in_executor(None, ctx.run, next, chunks, b"")
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            chunk = first
+            while True:
+                nxt = await loop.run_in_executor(None, ctx.run, next, chunks, None)
+                await send({"type": "http.response.body", "body": chunk, "more_body": nxt is not None})
+                if nxt is None:
+                    break
+                chunk = nxt
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                await loop.run_in_executor(None, ctx.run, close)
+    finally:
+        body.close()
+
+
+async def asgi_app(scope, receive, send) -> None:
+    """ASGI の入口。POST /lookup は asyncio で処理し、それ以外は Flask に渡す。"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await _close_async_http_client()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["method"] == "POST" and scope["path"] == "/lookup":
+        t0 = time.perf_counter()
+        sent = {"status": 500, "bytes": 0}
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                sent["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sent["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        trace = _trace_start("POST /lookup", path="/lookup")
+        try:
+            await _asgi_lookup(scope, receive, send_counted)
+        finally:
+            _record_http("/lookup", "POST", sent["status"], sent["bytes"], time.perf_counter() - t0)
+            _trace_finish(trace, status=sent["status"], bytes=sent["bytes"])
+    else:
+        await _asgi_wsgi_fallback(scope, receive, send)
+
+
+_JMDICT_POS_CODES = {
+    "n": "Noun",
+    "pn": "Pronoun",
+    "adv": "Adverb",
+    "conj": "Conjunction",
+    "int": "Interjection",
+    "aux-v": "Auxiliary verb",
+    "prep": "Preposition",
+}
+
+
+def _jmdict_pos(tags: List[str]) -> str:
+    """JMdict の品詞（展開済みの説明文、または EDICT の略号）を POS_MAP のキーに寄せる。"""
+    for tag in tags:
+        t = tag.strip().lower()
+        if t in _JMDICT_POS_CODES:
+            return _JMDICT_POS_CODES[t]
+        if t.startswith("adj"):
+            return "Adjective"
+        if t.startswith("adverb"):
+            return "Adverb"
+        if t.startswith("noun"):
+            return "Noun"
+        if "auxiliary verb" in t:
+            return "Auxiliary verb"
+        if "verb" in t or t.startswith(("v1", "v5", "vs", "vk", "vz", "vt", "vi")):
+            return "Verb"
+        if "adjectival" in t:
+            return "Adjective"
+        for label in ("pronoun", "conjunction", "interjection"):
+            if t.startswith(label):
+                return label.capitalize()
+    return ""
+
+
+_GLOSS_PAREN_RE = re.compile(r"\s*\([^)]*\)")
+
+
+def _normalize_gloss(gloss: str) -> str:
+    g = _GLOSS_PAREN_RE.sub("", gloss or "").strip().lower()
+    if g.startswith("to "):
+        g = g[3:]
+    g = " ".join(g.split())
+    if not g or len(g) > 80 or g.count(" ") > 2:
+        return ""
+    return g
+
+
+def _open_index_source(source: str, work_dir: str) -> str:
+    """URL ならダウンロードしてローカルパスを返す。"""
+    if not re.match(r"(?i)^https?://", source):
+        return source
+    os.makedirs(work_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix="download-", dir=work_dir)
+    with os.fdopen(fd, "wb") as fh:
+        with requests.get(source, stream=True, timeout=60, headers={"User-Agent": "wordbook-app/1.0"}) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                fh.write(chunk)
+    return tmp
+
+
+def _open_maybe_compressed(path: str):
+    with open(path, "rb") as fh:
+        magic = fh.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(path, "rb")
+    if magic == b"BZh":
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_jmdict_xml(fh) -> "Iterator[Tuple[str, bool, List[Tuple[List[str], List[str]]]]]":
+    """JMdict XML の entry ごとに（見出し語, 常用語か, [(品詞, 英語訳)]）を返す。"""
+    for _ev, el in ET.iterparse(fh, events=("end",)):
+        if el.tag != "entry":
+            continue
+        heads = [k.text for k in el.iter("keb") if k.text] or [r.text for r in el.iter("reb") if r.text]
+        common = any(p.text in ("news1", "ichi1", "spec1", "gai1") for p in el.iter("ke_pri")) or any(
+            p.text in ("news1", "ichi1", "spec1", "gai1") for p in el.iter("re_pri")
+        )
+        senses: List[Tuple[List[str], List[str]]] = []
+        pos: List[str] = []
+        for sense in el.iter("sense"):
+            # pos は省略時に直前の sense のものを引き継ぐ
+            pos = [p.text for p in sense.iter("pos") if p.text] or pos
+            glosses = [g.text for g in sense.iter("gloss") if g.text and not g.attrib]
+            senses.append((pos, glosses))
+        el.clear()
+        if heads:
+            yield heads[0], common, senses
+
+
+_EDICT_LINE_RE = re.compile(r"^(\S+)(?:\s+\[([^\]]+)\])?\s+/(.+)/\s*$")
+_EDICT_TAG_RE = re.compile(r"^\s*((?:\([^)]*\)\s*)*)")
+
+
+def _iter_edict_lines(fh) -> "Iterator[Tuple[str, bool, List[Tuple[List[str], List[str]]]]]":
+    """EDICT / EDICT2 形式（EUC-JP または UTF-8）の各行を _iter_jmdict_xml と同じ形で返す。"""
+    raw = fh.read()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("euc_jp", errors="replace")
+    for line in text.splitlines():
+        m = _EDICT_LINE_RE.match(line)
+        if not m or line.startswith("\u3000"):
+            continue
+        head = m.group(1).split(";")[0].split("(")[0]
+        fields = [f for f in m.group(3).split("/") if f and not f.startswith("EntL")]
+        common = "(P)" in fields
+        senses: List[Tuple[List[str], List[str]]] = []
+        pos: List[str] = []
+        for f in fields:
+            if f == "(P)":
+                continue
+            m_tags = _EDICT_TAG_RE.match(f)
+            tags = [t for grp in re.findall(r"\(([^)]*)\)", m_tags.group(1)) for t in grp.split(",")]
+            new_pos = [t for t in tags if _jmdict_pos([t])]
+            if new_pos:
+                pos = new_pos
+            gloss = f[m_tags.end():].strip()
+            if gloss:
+                senses.append((pos, [gloss]))
+        yield head, common, senses
+
+
+def _write_meaning_index(out_path: str, pairs: "Iterable[Tuple[str, str]]", meta: Dict[str, str]) -> int:
+    """entries(word, meaning) を一時ファイルに書き出し、完成後に置き換える。件数を返す。"""
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".index-", suffix=".sqlite3", dir=out_dir)
+    os.close(fd)
+    n = 0
+    try:
+        conn = sqlite3.connect(tmp)
+        conn.execute("CREATE TABLE entries (word TEXT PRIMARY KEY, meaning TEXT NOT NULL)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        batch: List[Tuple[str, str]] = []
+        for pair in pairs:
+            batch.append(pair)
+            if len(batch) >= 5000:
+                conn.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?)", batch)
+                n += len(batch)
+                batch = []
+        if batch:
+            conn.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?)", batch)
+            n += len(batch)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", sorted(meta.items()))
+        conn.commit()
+        conn.close()
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return n
+
+
+def _build_jmdict_index(source: str, out_path: str, limit: int = 6) -> int:
+    """JMdict（XML, .gz 可）または EDICT から 英語→日本語 の逆引き索引を作る。"""
+    path = _open_index_source(source, os.path.dirname(os.path.abspath(out_path)))
+    # 英語キー -> [(並び順キー, 見出し語, 品詞)]
+    cands: Dict[str, List[Tuple[Tuple[int, int, int], str, str]]] = {}
+    try:
+        with _open_maybe_compressed(path) as fh:
+            head = fh.peek(512)[:512] if hasattr(fh, "peek") else b""
+            is_xml = b"<?xml" in head or b"<!DOCTYPE" in head or b"<JMdict" in head
+            entries = _iter_jmdict_xml(fh) if is_xml else _iter_edict_lines(fh)
+            for order, (jp, common, senses) in enumerate(entries):
+                for si, (pos, glosses) in enumerate(senses):
+                    for g in glosses:
+                        key = _normalize_gloss(g)
+                        if key:
+                            cands.setdefault(key, []).append(((0 if common else 1, si, order), jp, _jmdict_pos(pos)))
+    finally:
+        if path != source:
+            os.remove(path)
+
+    def pairs():
+        for key, lst in cands.items():
+            lst.sort(key=lambda c: c[0])
+            words: List[str] = []
+            for _k, jp, _pos in lst:
+                if jp not in words:
+                    words.append(jp)
+                if len(words) >= limit:
+                    break
+            prefix = POS_MAP.get(lst[0][2], "")
+            while len(words) > 1 and len(prefix + "、".join(words)) > 200:
+                words.pop()
+            yield key, prefix + "、".join(words)
+
+    return _write_meaning_index(out_path, pairs(), {"source": source, "kind": "jmdict", "built_at": str(int(time.time()))})
+
+
+def _build_wiktionary_index(source: str, out_path: str) -> int:
+    """enwiktionary の pages-articles ダンプ（.xml / .bz2 / .gz）から、見出し語ごとの日本語訳を事前抽出する。"""
+    path = _open_index_source(source, os.path.dirname(os.path.abspath(out_path)))
+    found: Dict[str, str] = {}
+    redirects: Dict[str, str] = {}
+    try:
+        with _open_maybe_compressed(path) as fh:
+            title, ns, redirect = "", "", ""
+            for _ev, el in ET.iterparse(fh, events=("end",)):
+                tag = el.tag.rsplit("}", 1)[-1]
+                if tag == "title":
+                    title = el.text or ""
+                elif tag == "ns":
+                    ns = el.text or ""
+                elif tag == "redirect":
+                    redirect = el.attrib.get("title", "")
+                elif tag == "text" and ns == "0" and title:
+                    if redirect:
+                        redirects[title] = redirect
+                    else:
+                        prefix, ja_list = _extract_ja_and_pos_nearby(el.text or "", limit=6)
+                        if ja_list:
+                            found[title] = prefix + "、".join(ja_list)
+                elif tag == "page":
+                    title, ns, redirect = "", "", ""
+                    el.clear()
+    finally:
+        if path != source:
+            os.remove(path)
+
+    def pairs():
+        yield from found.items()
+        for src, dst in redirects.items():
+            if src not in found and dst in found:
+                yield src, found[dst]
+
+    return _write_meaning_index(out_path, pairs(), {"source": source, "kind": "wiktionary", "built_at": str(int(time.time()))})
+
+
+class _FillAborted(Exception):
+    """辞書検索が通信エラーや混雑で続けられない。その行から先は書かず、次回はそこから再開する。"""
+
+
+def _lookup_with_retry(word: str, client: str, attempts: int = 5) -> str:
+    """
+    見つからなければ ""。通信エラー・上流の 429 / 5xx・混雑は待って引き直し、attempts 回続いたら _FillAborted。
+    上流が Retry-After を付けていればその秒数（最大 60 秒）まで待つ。
+    """
+    for i in range(attempts):
+        try:
+            return _LOOKUP_CHAIN.lookup(word, client)
+        except (_UpstreamBusy, requests.RequestException) as e:
+            last = e
+            if i + 1 < attempts:
+                retry_after = getattr(e, "retry_after", 0.0)
+                time.sleep(max(min(8.0, 0.5 * (2 ** i)), min(60.0, retry_after)))
+    raise _FillAborted(f"lookup of {word!r} failed after {attempts} attempts: {last!r}")
+
+
+def _fill_meanings(in_path: str, out_path: str, workers: int = 4, batch_size: int = 64,
+                   progress_path: str | None = None) -> Dict[str, int]:
+    """
+    1列目が英単語・2列目が意味の CSV を先頭から読み、意味が空の行を辞書検索で埋めて書き出す。
+    バッチごとに出力バイト数と処理済み行数を進捗ファイルに記録し、中断後はその続きから再開する。
+    出力は _parse_preset_csv_text で読める形式（BOM 付き UTF-8、英単語,意味,...）。空行はそのまま写す。
+    検索が通信エラーで続けられないときは、そのバッチを書かずに _FillAborted を送出する（再実行でそこから再開）。
+    """
+    progress_path = progress_path or out_path + ".progress"
+    st = os.stat(in_path)
+    source_id = {"input": os.path.abspath(in_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    rows_done = 0
+    counts = {"rows": 0, "looked_up": 0, "filled": 0, "missing": 0}
+    if os.path.isfile(progress_path) and os.path.isfile(out_path):
+        try:
+            with open(progress_path, encoding="utf-8") as fh:
+                saved = json.load(fh)
+        except (OSError, ValueError):
+            saved = {}
+        if {k: saved.get(k) for k in source_id} == source_id:
+            rows_done = int(saved.get("rows_done", 0))
+            counts.update(saved.get("counts") or {})
+            # 進捗記録より後に書かれた中途半端な行を捨てる
+            os.truncate(out_path, int(saved.get("out_bytes", 0)))
+    if not rows_done and os.path.exists(out_path):
+        os.truncate(out_path, 0)
+
+    def save_progress(out_fh) -> None:
+        out_fh.flush()
+        os.fsync(out_fh.fileno())
+        state = dict(source_id, rows_done=rows_done, out_bytes=os.path.getsize(out_path), counts=counts)
+        tmp = progress_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp, progress_path)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with open(in_path, encoding="utf-8-sig", newline="") as in_fh, \
+            open(out_path, "a", encoding="utf-8-sig", newline="") as out_fh, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        reader = csv.reader(in_fh)
+        writer = csv.writer(out_fh, lineterminator="\r\n")
+        for _ in range(rows_done):
+            if next(reader, None) is None:
+                break
+
+        while True:
+            batch: List[List[str]] = []
+            for row in reader:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    break
+            if not batch:
+                break
+
+            todo: List[int] = []
+            for i, row in enumerate(batch):
+                if not row:
+                    continue
+                while len(row) < 2:
+                    row.append("")
+                row[0] = row[0].strip().lstrip("\ufeff")
+                if rows_done + i == 0 and _is_preset_csv_header(row[0], row[1]):
+                    continue
+                if row[0] and not row[1].strip():
+                    todo.append(i)
+            # 例外はここで出るので、失敗したバッチは書き出しも進捗の記録もされない
+            results = list(pool.map(lambda i: _lookup_with_retry(batch[i][0], "fill-meanings"), todo))
+            for i, meaning in zip(todo, results):
+                counts["looked_up"] += 1
+                if meaning:
+                    batch[i][1] = meaning[:200]
+                    counts["filled"] += 1
+                else:
+                    counts["missing"] += 1
+
+            writer.writerows(batch)
+            rows_done += len(batch)
+            counts["rows"] = rows_done
+            save_progress(out_fh)
+
+    os.remove(progress_path)
+    return counts
+
+
+def _preload_app_state() -> Dict[str, int]:
+    """
+    fork 前に読み込んでおくもの（プリセットの一覧と解析結果、PDF フォントと文字幅表）。
+    子プロセスはこれを copy-on-write で共有するので、ワーカーごとに読み直さない。
+    """
+    base = os.path.realpath(_pick_wordbook_preset_base())
+    rels = _iter_preset_csv_rel_paths(base)
+    rows = 0
+    _ensure_pdf_fonts()
+    word_table, meaning_table = _pdf_width_table(_PDF_WORD_FONT), _pdf_width_table(_PDF_JP_FONT)
+    for rel in rels:
+        items, _error = _load_preset_items(rel)
+        rows += len(items)
+        for it in items:
+            word_table.units(it.get("word", ""))
+            meaning_table.units(it.get("meaning", ""))
+    _pdf_sheet_geometry()
+    return {"preset_files": len(rels), "preset_rows": rows}
+
+
+class _TimeoutRequestHandler(WSGIRequestHandler):
+    # 読み書きがこの秒数止まった接続は切る（遅いクライアントがスレッドを握ったままにしないように）
+    timeout = _env_float("WORDBOOK_REQUEST_TIMEOUT", 30.0)
+    # 1リクエストごとに接続を閉じる。HTTP/1.1 の keep-alive だと、次のリクエストを待つ間も
+    # 接続がスレッドの枠を timeout 秒まで握ったままになる（Werkzeug は複数スレッドのサーバーで 1.1 にする）
+    protocol_version = "HTTP/1.0"
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug の WSGI サーバーを、リクエストごとにスレッドを作る代わりに固定数のスレッドで捌くようにしたもの。
+    空きスレッドがあるときだけ accept するので、埋まったワーカーの接続は listen のキューに残って他のワーカーが拾う。
+    drain() は受け付けを止めたあと、処理中のリクエストが終わるまで待つ。
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, app_, fd: int, threads: int):
+        super().__init__(host, 0, app_, handler=_TimeoutRequestHandler, fd=fd)
+        from concurrent.futures import ThreadPoolExecutor
+
+        threads = max(1, threads)
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+
+    def get_request(self):
+        # 空きがなければ accept せずに serve_forever のループへ戻る（OSError はそこで無視される）。
+        # 待ちを短く区切るのは shutdown() に気づけるようにするため
+        if not self._slots.acquire(timeout=0.5):
+            raise BlockingIOError("no free request thread")
+        try:
+            return super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def shutdown_request(self, request):
+        # accept した接続は、どの経路でも最後にここを1回通る
+        try:
+            super().shutdown_request(request)
+        finally:
+            self._slots.release()
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def _prefork_worker(sock: socket.socket, host: str, index: int, threads: int) -> int:
+    server = _PooledWSGIServer(host, app, sock.fileno(), threads)
+
+    def stop(_signum, _frame):
+        # serve_forever と同じスレッドから shutdown() を呼ぶと止まったままになる
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if index == 0:
+        # 事前生成の見張りは1つのワーカーだけが受け持つ
+        _start_preset_pdf_prebuilder(_env_float("WORDBOOK_PREBUILD_INTERVAL", 300.0))
+    if _METRICS.state_dir:
+        # /metrics がどのワーカーに届いても全体の値を返せるよう、定期的に自分の値を書き出す
+        interval = max(0.5, _env_float("WORDBOOK_METRICS_FLUSH", 5.0))
+        # 入れ替わりのワーカーは 0 から数え、自分のファイルもすぐ書き直す
+        _METRICS.reset()
+        _METRICS.flush()
+
+        def flush_loop():
+            while True:
+                time.sleep(interval)
+                _METRICS.flush()
+
+        threading.Thread(target=flush_loop, name="metrics-flush", daemon=True).start()
+    server.serve_forever()
+    server.drain()
+    _METRICS.flush()
+    return 0
+
+
+def _serve_prefork(host: str, port: int, workers: int, threads: int,
+                   preload: bool = True, graceful_timeout: float = 30.0) -> int:
+    """
+    本番用の pre-fork サーバー。親がソケットを開き（preload なら状態も読み込んで）から workers 個に fork し、
+    各ワーカーは threads 本のスレッドでリクエストを捌く。
+      SIGHUP          … 新しいワーカーを立ち上げてから古いワーカーを順に止める（処理中のリクエストは最後まで返す）
+      SIGTERM/SIGINT  … 全ワーカーを止めて終了（graceful_timeout 秒待っても残っていれば SIGKILL）
+    死んだワーカーは同じ番号で立ち上げ直す。コードの更新はプロセスの再起動で反映する。
+    """
+    global _PDF_PROCESSES
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    if not os.environ.get("WORDBOOK_PDF_PROCESSES"):
+        # 各ワーカーが CPU 数ぶんの子を持つと workers × CPU 個になるので、ホスト全体で CPU 数に収める
+        _PDF_PROCESSES = max(1, (os.cpu_count() or 1) // max(1, workers))
+    if _METRICS.state_dir and os.path.isdir(_METRICS.state_dir):
+        # 前回の起動で残ったワーカーの値は捨てる（カウンタはこの起動から数え直す）
+        for fn in os.listdir(_METRICS.state_dir):
+            if fn.endswith(".json"):
+                try:
+                    os.remove(os.path.join(_METRICS.state_dir, fn))
+                except OSError:
+                    pass
+    if preload:
+        print(json.dumps({"preload": _preload_app_state()}, ensure_ascii=False), file=sys.stderr)
+        # fork 後に GC が古いオブジェクトに触れてページをコピーさせないよう、ここまでの分は対象外にする
+        gc.freeze()
+
+    children: Dict[int, int] = {}
+    retiring: Dict[int, float] = {}
+    flags = {"stop": False, "reload": False}
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _prefork_worker(sock, host, index, threads)
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def on_stop(_signum, _frame):
+        flags["stop"] = True
+
+    def on_reload(_signum, _frame):
+        flags["reload"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_reload)
+    print(f"serving on http://{host}:{port} with {workers} workers x {threads} threads (pid {os.getpid()})",
+          file=sys.stderr)
+    for i in range(workers):
+        spawn(i)
+
+    while not flags["stop"]:
+        if flags["reload"]:
+            flags["reload"] = False
+            if preload:
+                gc.unfreeze()
+                _preload_app_state()
+                gc.freeze()
+            old = dict(children)
+            children.clear()
+            for i in sorted(old.values()):
+                spawn(i)
+            for pid in old:
+                retiring[pid] = time.time()
+                os.kill(pid, signal.SIGTERM)
+        try:
+            pid, _status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid:
+            _METRICS.forget(pid)
+            if pid in children:
+                index = children.pop(pid)
+                if not flags["stop"]:
+                    print(f"worker {pid} exited; restarting", file=sys.stderr)
+                    spawn(index)
+            retiring.pop(pid, None)
+            continue
+        for pid, since in list(retiring.items()):
+            if time.time() - since > graceful_timeout:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    retiring.pop(pid, None)
+        time.sleep(0.2)
+
+    for pid in list(children) + list(retiring):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+    deadline = time.time() + graceful_timeout
+    pending = set(children) | set(retiring)
+    while pending and time.time() < deadline:
+        try:
+            pid, _status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            _METRICS.forget(pid)
+            pending.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in pending:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+        _METRICS.forget(pid)
+    sock.close()
+    return 0
+
+
+def _main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="app.py")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("build-jmdict", help="JMdict/EDICT から英和の逆引き索引を作る")
+    p.add_argument("source", nargs="?", default=JMDICT_URL, help="JMdict_e(.gz) / EDICT のパスまたは URL")
+    p.add_argument("--out", default=JMDICT_INDEX_PATH)
+    p = sub.add_parser("build-wiktionary-index", help="Wiktionary ダンプからオフライン索引を作る")
+    p.add_argument("source", help="enwiktionary-*-pages-articles.xml(.bz2) のパスまたは URL")
+    p.add_argument("--out", default=WIKTIONARY_INDEX_PATH)
+    p = sub.add_parser("fill-meanings", help="CSV の空欄の意味を辞書検索で埋める（中断しても再開可能）")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--batch-size", type=int, default=64)
+    p = sub.add_parser("prebuild-pdfs", help="すべてのプリセット CSV の PDF を事前生成する")
+    p.add_argument("--out", default=PRESET_PDF_DIR)
+    p.add_argument("--processes", type=int, default=None)
+    p.add_argument("--force", action="store_true")
+    p = sub.add_parser("serve", help="本番用の pre-fork マルチプロセスサーバーで起動する")
+    p.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    p.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    p.add_argument("--workers", type=int, default=_env_int("WORDBOOK_WORKERS", os.cpu_count() or 1))
+    p.add_argument("--threads", type=int, default=_env_int("WORDBOOK_THREADS", 8))
+    p.add_argument("--graceful-timeout", type=float, default=_env_float("WORDBOOK_GRACEFUL_TIMEOUT", 30.0))
+    p.add_argument("--no-preload", action="store_true", help="fork 前に状態を読み込まない")
+    args = parser.parse_args(argv)
+
+    if args.command == "build-jmdict":
+        n = _build_jmdict_index(args.source, args.out)
+        print(f"{n} entries -> {args.out}")
+        return 0
+    if args.command == "build-wiktionary-index":
+        n = _build_wiktionary_index(args.source, args.out)
+        print(f"{n} entries -> {args.out}")
+        return 0
+    if args.command == "fill-meanings":
+        try:
+            counts = _fill_meanings(args.input, args.output, workers=args.workers, batch_size=args.batch_size)
+        except _FillAborted as e:
+            print(f"fill-meanings stopped: {e}; run the same command again to resume", file=sys.stderr)
+            return 1
+        print(json.dumps(counts, ensure_ascii=False))
+        return 0
+    if args.command == "prebuild-pdfs":
+        summary = _prebuild_preset_pdfs(out_dir=args.out, processes=args.processes, force=args.force)
+        print(json.dumps(summary, ensure_ascii=False))
+        return 0
+    if args.command == "serve":
+        if not hasattr(os, "fork"):
+            print("serve needs os.fork(); falling back to the threaded development server", file=sys.stderr)
+            _start_preset_pdf_prebuilder(_env_float("WORDBOOK_PREBUILD_INTERVAL", 300.0))
+            app.run(host=args.host, port=args.port, debug=False, threaded=True)
+            return 0
+        # 出力ジョブはどのワーカーに届いても見えるよう、状態をファイルで共有する
+        if not _EXPORT_JOBS.state_dir:
+            _EXPORT_JOBS.state_dir = os.path.join(_DATA_DIR, "export-jobs")
+        _METRICS.state_dir = os.environ.get("WORDBOOK_METRICS_DIR") or os.path.join(_DATA_DIR, "metrics")
+        return _serve_prefork(args.host, args.port, max(1, args.workers), max(1, args.threads),
+                              preload=not args.no_preload, graceful_timeout=args.graceful_timeout)
+
+    if os.environ.get("WORDBOOK_PREBUILD", "") == "1":
+        # 開発用の起動では明示したときだけ事前生成の見張りを動かす（serve では常に動かす）
+        _start_preset_pdf_prebuilder(_env_float("WORDBOOK_PREBUILD_INTERVAL", 300.0))
     port = int(os.environ.get("PORT", "5000"))
     app.run(host="0.0.0.0", port=port, debug=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,84 @@
+# benchmarks/_common.py
+"""
+ベンチマークスクリプトで共有する部品（合成データ用の文字、結果 JSON の書き出し、--compare の表）。
+
+各スクリプトはリポジトリ直下を sys.path に足してから app を import する。このモジュールは app を import しない
+（環境変数で app の設定を変えてから import するスクリプトがあるため）。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+from typing import Callable, Dict, Iterable, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ASCII = "abcdefghijklmnopqrstuvwxyz"
+CJK = "あいうえおかきくけこさしすせそたちつてとなにぬねの漢字熟語意味名詞動詞形容詞（）、"
+
+
+def git_rev() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT, capture_output=True, text=True, timeout=10,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def add_report_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--out", default="", help="結果 JSON の書き出し先（省略時は標準出力）")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+
+
+def write_report(bench: str, results: list, out: str = "", **settings: object) -> None:
+    """bench 名・コミット・実行環境・設定 settings と結果を1つの JSON にして out（空なら標準出力）に書く。"""
+    report = {
+        "bench": bench,
+        "git": git_rev(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        **settings,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if out:
+        with open(out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+
+def _load_results(path: str) -> Dict[str, dict]:
+    with open(path, encoding="utf-8") as fh:
+        return {r["case"]: r for r in json.load(fh)["results"]}
+
+
+def compare(old_path: str, new_path: str, columns: Iterable[Tuple[str, str, float, str]],
+            sort_key: Callable[[dict], tuple], case_width: int = 24) -> int:
+    """
+    2つの結果 JSON で共通する case を並べる。columns は (見出し, キー, 倍率, 書式) の並びで、
+    最初の列には新旧の比も付ける。sort_key は新しい方の結果から並び順を決める。
+    """
+    old, new = _load_results(old_path), _load_results(new_path)
+    columns = list(columns)
+    head = f"{'case':<{case_width}}"
+    for i, (label, _key, _scale, _fmt) in enumerate(columns):
+        head += f"{label + ' old':>14}{'new':>10}" + (f"{'ratio':>8}" if i == 0 else "")
+    print(head)
+    for case in sorted(set(old) & set(new), key=lambda c: sort_key(new[c]) + (c,)):
+        o, n = old[case], new[case]
+        line = f"{case:<{case_width}}"
+        for i, (_label, key, scale, fmt) in enumerate(columns):
+            ov, nv = o.get(key, float("nan")) * scale, n.get(key, float("nan")) * scale
+            line += f"{ov:>14{fmt}}{nv:>10{fmt}}"
+            if i == 0:
+                ratio = nv / ov if ov else float("nan")
+                line += f"{ratio:>8.2f}"
+        print(line)
+    return 0
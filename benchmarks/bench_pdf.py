@@ -0,0 +1,193 @@
+# benchmarks/bench_pdf.py
+"""
+PDF 書き出し（_draw_pdf_word_sheet）全体を合成コーパスで計測する。
+
+行数（50 / 500 / 5000）× 意味の長さ × 文字種（ASCII / CJK / 混在）× はみ出しの有無の組み合わせごとに
+1ページあたりの ms、ピークメモリ（tracemalloc）、1ページあたりの出力バイト数を測り、
+コミット間で比べられるよう JSON に書き出す。
+WORDBOOK_PDF_PARALLEL_MIN_ROWS 以上の行はプロセスプールで割り付けるため、子プロセスのメモリはピークに含まれない。
+
+--export-rows の行数では /export.pdf を通し、bytes で返す経路と一時ファイルから送る経路（WORDBOOK_PDF_STREAM_MIN_ROWS）の
+最初の1バイトまでの ms、全体の ms、ピークメモリも測る（キャッシュは使わない）。
+
+    python benchmarks/bench_pdf.py [--sizes 50,500,5000] [--export-rows 5000] [--repeat 3] [--out results.json]
+    python benchmarks/bench_pdf.py --compare old.json new.json
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from _common import ASCII, CJK, ROOT, add_report_args, compare, write_report
+
+sys.path.insert(0, ROOT)
+# 回をまたいだ意味セルのメモ化（プロセスプールの子も含む）を効かせず、毎回ゼロから描いた時間を測る
+os.environ.setdefault("WORDBOOK_PDF_LAYOUT_MEMO", "0")
+
+import app  # noqa: E402
+
+# 意味の長さ: short は1行に収まる、long は折り返し、overflow は最小サイズでも収まらず … で切られる
+_LENGTHS = {"short": 12, "long": 60, "overflow": 200}
+
+
+def _ascii_text(rng: random.Random, length: int) -> str:
+    words: List[str] = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append("".join(rng.choice(ASCII) for _ in range(rng.randint(2, 10))))
+    return " ".join(words)[:length]
+
+
+def _cjk_text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(CJK) for _ in range(length))
+
+
+def synthetic_items(rows: int, script: str, length: str, seed: int = 0) -> List[Dict[str, str]]:
+    """決まった seed から {word, meaning} の列を作る。overflow では単語側も幅を超える長さにする。"""
+    rng = random.Random(seed)
+    n = _LENGTHS[length]
+    items: List[Dict[str, str]] = []
+    for i in range(rows):
+        if script == "ascii":
+            meaning = _ascii_text(rng, n)
+        elif script == "cjk":
+            meaning = _cjk_text(rng, n)
+        else:
+            meaning = _cjk_text(rng, n // 2) + " " + _ascii_text(rng, n - n // 2)
+        wlen = rng.randint(30, 80) if length == "overflow" else rng.randint(3, 12)
+        word = "".join(rng.choice(ASCII) for _ in range(wlen))
+        items.append({"word": word, "meaning": meaning})
+    return items
+
+
+def _bench_case(rows: int, script: str, length: str, repeat: int) -> Dict[str, object]:
+    items = app._clean_pdf_items(synthetic_items(rows, script, length))
+    pages = app._pdf_page_count(len(items))
+
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        pdf = app._draw_pdf_word_sheet(items)
+        best = min(best, time.perf_counter() - t0)
+        size = len(pdf)
+
+    gc.collect()
+    tracemalloc.start()
+    app._draw_pdf_word_sheet(items)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "case": f"{rows}-{script}-{length}",
+        "rows": rows,
+        "script": script,
+        "length": length,
+        "pages": pages,
+        "ms_total": round(best * 1000, 3),
+        "ms_per_page": round(best * 1000 / pages, 3),
+        "peak_mem_bytes": peak,
+        "bytes": size,
+        "bytes_per_page": round(size / pages, 1),
+    }
+
+
+def _bench_export(rows: int, spooled: bool, repeat: int) -> Dict[str, object]:
+    """/export.pdf を行数 rows で呼び、最初の1バイトまでと送り終わりまでの時間、その間のピークメモリを測る。"""
+    items = synthetic_items(rows, "mixed", "long")
+    saved = (app._PDF_CACHE, app._PDF_STREAM_MIN_ROWS)
+    app._PDF_CACHE = app._PdfCache(0, "", 0)
+    app._PDF_STREAM_MIN_ROWS = 0 if spooled else rows + 1
+    client = app.app.test_client()
+
+    def once() -> tuple:
+        t0 = time.perf_counter()
+        resp = client.post("/export.pdf", json={"items": items}, buffered=False)
+        chunks = iter(resp.response)
+        size = len(next(chunks))
+        first = time.perf_counter() - t0
+        for chunk in chunks:
+            size += len(chunk)
+        resp.close()
+        return (first, time.perf_counter() - t0, size)
+
+    try:
+        best_first = best_total = float("inf")
+        size = 0
+        for _ in range(repeat):
+            gc.collect()
+            first, total, size = once()
+            best_first = min(best_first, first)
+            best_total = min(best_total, total)
+        gc.collect()
+        tracemalloc.start()
+        once()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        app._PDF_CACHE, app._PDF_STREAM_MIN_ROWS = saved
+
+    pages = app._pdf_page_count(rows)
+    return {
+        "case": f"export-{rows}-{'spooled' if spooled else 'memory'}",
+        "rows": rows,
+        "script": "mixed",
+        "length": "long",
+        "pages": pages,
+        "ms_first_byte": round(best_first * 1000, 3),
+        "ms_total": round(best_total * 1000, 3),
+        "ms_per_page": round(best_total * 1000 / pages, 3),
+        "peak_mem_bytes": peak,
+        "bytes": size,
+        "bytes_per_page": round(size / pages, 1),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="50,500,5000")
+    ap.add_argument("--scripts", default="ascii,cjk,mixed")
+    ap.add_argument("--lengths", default=",".join(_LENGTHS))
+    ap.add_argument("--export-rows", default="5000", help="/export.pdf を通して測る行数（空なら測らない）")
+    ap.add_argument("--repeat", type=int, default=3)
+    add_report_args(ap)
+    args = ap.parse_args()
+
+    if args.compare:
+        return compare(*args.compare, columns=[("ms/page", "ms_per_page", 1, ".2f"),
+                                               ("peak MB", "peak_mem_bytes", 1e-6, ".1f")],
+                       sort_key=lambda r: (r["rows"],))
+
+    app._ensure_pdf_fonts()
+    results: List[Dict[str, object]] = []
+    for rows in [int(x) for x in args.sizes.split(",") if x]:
+        for script in [x for x in args.scripts.split(",") if x]:
+            for length in [x for x in args.lengths.split(",") if x]:
+                r = _bench_case(rows, script, length, args.repeat)
+                results.append(r)
+                print(f"{r['case']:<24}{r['ms_per_page']:>9.2f} ms/page"
+                      f"{r['peak_mem_bytes'] / 1e6:>9.1f} MB peak{r['bytes_per_page']:>10.0f} B/page",
+                      file=sys.stderr)
+    for rows in [int(x) for x in args.export_rows.split(",") if x]:
+        for spooled in (False, True):
+            r = _bench_export(rows, spooled, args.repeat)
+            results.append(r)
+            print(f"{r['case']:<24}{r['ms_first_byte']:>9.0f} ms first byte{r['ms_total']:>9.0f} ms total"
+                  f"{r['peak_mem_bytes'] / 1e6:>9.1f} MB peak", file=sys.stderr)
+
+    write_report("pdf", results, args.out,
+                 layout=app._PDF_LAYOUT_VERSION,
+                 parallel_min_rows=app._PDF_PARALLEL_MIN_ROWS,
+                 layout_memo=app._PDF_LAYOUT_MEMO.max_items,
+                 repeat=args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
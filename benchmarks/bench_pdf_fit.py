@@ -0,0 +1,164 @@
+# benchmarks/bench_pdf_fit.py
+"""
+PDF の意味セルの詰め込み（折り返し・フォントサイズ探索・… 切り詰め）を1行あたりで計測する。
+
+旧実装（1文字ずつ削って全体を測り直す / 0.5pt ずつ下げて全体を折り返し直す）と現在の
+app._pdf_fit_wrapped / app._pdf_truncate_to_fit を同じ行で比べ、結果が一致することも確認する。
+
+    python benchmarks/bench_pdf_fit.py [--rows 300] [--length 200]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from reportlab.lib.units import mm  # noqa: E402
+from reportlab.pdfbase import pdfmetrics  # noqa: E402
+
+# _draw_pdf_word_sheet と同じセル寸法
+MEANING_MAX_W = (((210 * mm - 2 * 12 * mm - 8 * mm) / 2 - 10 * mm) / 2) - 2 * 2 * mm
+MEANING_MAX_H = ((297 * mm - 24 * mm) / 25) - 2 * 1.5 * mm
+WORD_MAX_W = MEANING_MAX_W
+
+
+def _old_truncate_to_fit(font_name: str, size: float, s: str, max_w: float) -> str:
+    s = app._clean_pdf_text(s)
+    if not s:
+        return ""
+    if pdfmetrics.stringWidth(s, font_name, size) <= max_w:
+        return s
+    ell = "…"
+    if pdfmetrics.stringWidth(ell, font_name, size) > max_w:
+        return ""
+    t = s
+    while t and pdfmetrics.stringWidth(t + ell, font_name, size) > max_w:
+        t = t[:-1]
+    return (t + ell) if t else ell
+
+
+def _old_wrap_text(font_name: str, size: float, s: str, max_w: float) -> List[str]:
+    s = app._clean_pdf_text(s)
+    if not s:
+        return []
+    has_space = (" " in s)
+    tokens = s.split(" ") if has_space else list(s)
+    lines: List[str] = []
+    cur = ""
+    for t in tokens:
+        piece = (t if not has_space else (t if cur == "" else " " + t))
+        trial = cur + piece
+        if pdfmetrics.stringWidth(trial, font_name, size) <= max_w:
+            cur = trial
+            continue
+        if cur == "":
+            if has_space:
+                buf = ""
+                for ch in t:
+                    if pdfmetrics.stringWidth(buf + ch, font_name, size) <= max_w:
+                        buf += ch
+                    else:
+                        if buf:
+                            lines.append(buf)
+                        buf = ch
+                if buf:
+                    lines.append(buf)
+            elif pdfmetrics.stringWidth(t, font_name, size) <= max_w:
+                lines.append(t)
+            cur = ""
+        else:
+            lines.append(cur)
+            cur = t
+    if cur:
+        lines.append(cur)
+    return lines
+
+
+def _old_fit_wrapped(font_name: str, base_size: float, min_size: float,
+                     s: str, max_w: float, max_h: float) -> Tuple[float, List[str]]:
+    s = app._clean_pdf_text(s)
+    if not s:
+        return (base_size, [])
+    size = base_size
+    while True:
+        lines = _old_wrap_text(font_name, size, s, max_w)
+        if not lines:
+            return (size, [])
+        max_lines = max(1, int(max_h // (size * 1.15)))
+        if len(lines) <= max_lines:
+            return (size, lines)
+        if size <= min_size:
+            kept = lines[:max_lines]
+            last = kept[-1]
+            ell = "…"
+            while last and pdfmetrics.stringWidth(last + ell, font_name, size) > max_w:
+                last = last[:-1]
+            kept[-1] = (last + ell) if last else ell
+            return (size, kept)
+        size = max(min_size, size - 0.5)
+
+
+def _synthetic_rows(n: int, length: int, seed: int = 0) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    kana = "あいうえおかきくけこさしすせそたちつてとなにぬねの漢字熟語意味（名）（動）、"
+    rows: List[Tuple[str, str]] = []
+    for i in range(n):
+        if i % 2:
+            meaning = "".join(rng.choice(kana) for _ in range(length))
+        else:
+            words: List[str] = []
+            while sum(len(w) + 1 for w in words) < length:
+                words.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 11))))
+            meaning = " ".join(words)[:length]
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(20, 80)))
+        rows.append((word, meaning))
+    return rows
+
+
+def _time_per_row(fn, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for word, meaning in rows:
+            fn(word, meaning)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(rows)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=300)
+    ap.add_argument("--length", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    app._ensure_pdf_fonts()
+    jp = app._PDF_JP_FONT
+    rows = _synthetic_rows(args.rows, args.length)
+
+    def old(word: str, meaning: str):
+        return (_old_truncate_to_fit("Helvetica", 6, word, WORD_MAX_W),
+                _old_fit_wrapped(jp, 8, 6, meaning, MEANING_MAX_W, MEANING_MAX_H))
+
+    def new(word: str, meaning: str):
+        return (app._pdf_truncate_to_fit("Helvetica", 6, word, WORD_MAX_W),
+                app._pdf_fit_wrapped(jp, 8, 6, meaning, MEANING_MAX_W, MEANING_MAX_H))
+
+    mismatches = sum(1 for w, m in rows if old(w, m) != new(w, m))
+    old_s = _time_per_row(old, rows, args.repeat)
+    new_s = _time_per_row(new, rows, args.repeat)
+    print(f"rows={len(rows)} meaning_length={args.length} mismatches={mismatches}")
+    print(f"old: {old_s * 1e6:9.1f} us/row")
+    print(f"new: {new_s * 1e6:9.1f} us/row")
+    print(f"speedup: {old_s / new_s:.1f}x")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# benchmarks/bench_preset.py
+"""
+プリセットまわり（どのリクエストでも通る一覧の走査・ルートの選択・パスの検証・CSV の解析）を合成データで計測する。
+
+10〜10,000 ファイルの入れ子になったプリセットツリー（CSV 以外のファイルと大きな CSV も混ぜる）を一時ディレクトリに作り、
+  scan       _iter_preset_csv_rel_paths(ツリー)
+  pick-env   _pick_wordbook_preset_base()（WORDBOOK_PRESET_DIR 指定あり）
+  pick-scan  _pick_wordbook_preset_base()（指定なし。空の候補を2つ見てからツリーを走査して採用する）
+  safe       _safe_preset_csv_path(ツリー, rel)（正しいパスと、.. / 拡張子違い / 存在しないパスを混ぜる）
+を、行数を変えた CSV 本文で
+  parse      _parse_preset_csv_text(本文)
+を測り、コミット間で比べられるよう JSON に書き出す。
+
+    python benchmarks/bench_preset.py [--sizes 10,100,1000,10000] [--rows 100,10000,100000] [--out results.json]
+    python benchmarks/bench_preset.py --compare old.json new.json
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from _common import ASCII, CJK, ROOT, add_report_args, compare, write_report
+
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+
+def synthetic_csv(rows: int, seed: int = 0) -> str:
+    """ヘッダ付きの「英単語,意味」CSV。引用符・カンマ入りの意味、空行、長すぎて捨てられる行も混ぜる。"""
+    rng = random.Random(seed)
+    lines = ["英単語,意味"]
+    for i in range(rows):
+        word = "".join(rng.choice(ASCII) for _ in range(rng.randint(3, 12)))
+        meaning = "".join(rng.choice(CJK) for _ in range(rng.randint(4, 30)))
+        if i % 17 == 0:
+            meaning = f'"{meaning}、{meaning[:5]}"'
+        elif i % 97 == 0:
+            meaning = "長" * 250
+        elif i % 131 == 0:
+            lines.append("")
+            continue
+        lines.append(f"{word},{meaning}")
+    return "\n".join(lines) + "\n"
+
+
+def build_tree(root: str, files: int, large_files: int, large_rows: int, seed: int = 0) -> List[str]:
+    """
+    root の下に files 個の CSV を置く。フォルダは 3 段まで入れ子にし、1フォルダあたり最大 50 ファイル。
+    CSV 10 個につき1つ CSV 以外のファイルも置き、先頭から large_files 個は large_rows 行の大きな CSV にする。
+    """
+    rng = random.Random(seed)
+    small = synthetic_csv(30, seed)
+    large = synthetic_csv(large_rows, seed) if large_files else ""
+    rels: List[str] = []
+    for i in range(files):
+        folder = i // 50
+        parts = [f"級{folder % 7}", f"set{folder // 7 % 10}", f"part{folder // 70}"][: 1 + folder % 3]
+        rel = "/".join(parts + [f"単語{i:05d}.csv"])
+        full = os.path.join(root, *rel.split("/"))
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "w", encoding="utf-8") as fh:
+            fh.write(large if i < large_files else small)
+        if i % 10 == 0:
+            with open(os.path.join(os.path.dirname(full), f"memo{i}.txt"), "w", encoding="utf-8") as fh:
+                fh.write("not a preset\n")
+        rels.append(rel)
+    rng.shuffle(rels)
+    return rels
+
+
+def _best(fn: Callable[[], object], repeat: int, min_time: float = 0.05) -> float:
+    """fn 1回あたりの秒数（repeat 回の最良値）。速い関数は min_time に届くまで回して平均する。"""
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - t0 >= min_time or loops >= 1 << 20:
+            break
+        loops *= 4
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / loops)
+    return best
+
+
+def _result(case: str, func: str, n: int, seconds: float, per: int, **extra) -> Dict[str, object]:
+    return {
+        "case": case,
+        "func": func,
+        "n": n,
+        "ms_per_call": round(seconds * 1000, 4),
+        "us_per_item": round(seconds * 1e6 / max(1, per), 4),
+        **extra,
+    }
+
+
+def _bench_tree(files: int, args) -> List[Dict[str, object]]:
+    tmp = tempfile.mkdtemp(prefix="wordbook-bench-preset-")
+    try:
+        tree = os.path.join(tmp, "既存のwordbook")
+        empty = os.path.join(tmp, "empty")
+        os.makedirs(empty)
+        rels = build_tree(tree, files, min(args.large_files, files), args.large_rows)
+        out: List[Dict[str, object]] = []
+
+        found = app._iter_preset_csv_rel_paths(tree)
+        assert len(found) == files, (len(found), files)
+        s = _best(lambda: app._iter_preset_csv_rel_paths(tree), args.repeat)
+        out.append(_result(f"scan-{files}", "_iter_preset_csv_rel_paths", files, s, files))
+
+        saved_env = os.environ.get("WORDBOOK_PRESET_DIR")
+        saved_candidates = app._candidate_preset_base_dirs
+        try:
+            os.environ["WORDBOOK_PRESET_DIR"] = tree
+            s = _best(app._pick_wordbook_preset_base, args.repeat)
+            out.append(_result(f"pick-env-{files}", "_pick_wordbook_preset_base", files, s, 1))
+
+            os.environ.pop("WORDBOOK_PRESET_DIR", None)
+            app._candidate_preset_base_dirs = lambda: [os.path.join(tmp, "missing"), empty, tree]
+            assert app._pick_wordbook_preset_base() == app._abs_norm(tree)
+            s = _best(app._pick_wordbook_preset_base, args.repeat)
+            out.append(_result(f"pick-scan-{files}", "_pick_wordbook_preset_base", files, s, files))
+        finally:
+            app._candidate_preset_base_dirs = saved_candidates
+            if saved_env is None:
+                os.environ.pop("WORDBOOK_PRESET_DIR", None)
+            else:
+                os.environ["WORDBOOK_PRESET_DIR"] = saved_env
+
+        rng = random.Random(1)
+        sample = [rng.choice(rels) for _ in range(200)]
+        bad = ["../etc/passwd.csv", "級0/../../x.csv", "級0/memo0.txt", "級0/無い.csv", "/", ""]
+        probes = sample + bad * 5
+        assert all(app._safe_preset_csv_path(tree, r) for r in sample)
+        assert not any(app._safe_preset_csv_path(tree, r) for r in bad)
+
+        def safe_all():
+            for r in probes:
+                app._safe_preset_csv_path(tree, r)
+
+        s = _best(safe_all, args.repeat)
+        out.append(_result(f"safe-{files}", "_safe_preset_csv_path", files, s / len(probes), 1))
+        return out
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _bench_parse(rows: int, args) -> Dict[str, object]:
+    text = synthetic_csv(rows)
+    parsed = len(app._parse_preset_csv_text(text))
+    s = _best(lambda: app._parse_preset_csv_text(text), args.repeat)
+    size = len(text.encode("utf-8"))
+    return _result(f"parse-{rows}", "_parse_preset_csv_text", rows, s, rows,
+                   bytes=size, rows_kept=parsed, mb_per_s=round(size / s / 1e6, 2))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="ツリーの CSV ファイル数")
+    ap.add_argument("--rows", default="100,10000,100000", help="parse で測る CSV の行数")
+    ap.add_argument("--large-files", type=int, default=3, help="ツリーに混ぜる大きな CSV の数")
+    ap.add_argument("--large-rows", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    add_report_args(ap)
+    args = ap.parse_args()
+
+    if args.compare:
+        return compare(*args.compare, columns=[("ms/call", "ms_per_call", 1, ".4f")],
+                       sort_key=lambda r: (r["func"], r["n"]), case_width=20)
+
+    results: List[Dict[str, object]] = []
+    for files in [int(x) for x in args.sizes.split(",") if x]:
+        results.extend(_bench_tree(files, args))
+    for rows in [int(x) for x in args.rows.split(",") if x]:
+        results.append(_bench_parse(rows, args))
+    for r in results:
+        print(f"{r['case']:<20}{r['ms_per_call']:>11.4f} ms/call{r['us_per_item']:>11.3f} us/item", file=sys.stderr)
+
+    write_report("preset", results, args.out,
+                 large_files=args.large_files,
+                 large_rows=args.large_rows,
+                 repeat=args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+# benchmarks/loadtest.py
+"""
+アプリ全体の負荷試験。手元に Wiktionary の代わりのスタブ（?action=raw に決まった本文を返す）を立て、
+アプリをそれに向けて起動し、/・プリセット一覧/ファイル・/lookup・/export.pdf を混ぜたリクエストを
+指定した同時接続数で投げ続けて、ルートごとのスループットと p50/p95/p99 を出す。
+
+    python benchmarks/loadtest.py [--server serve|dev] [--concurrency 32] [--duration 30]
+        [--mix index=1,list=2,file=4,lookup=10,export=1] [--stub-latency-ms 80] [--stub-error-rate 0.02]
+        [--out results.json]
+    python benchmarks/loadtest.py --app-url http://127.0.0.1:5000   # 起動済みのアプリに投げる（スタブは使わない）
+"""
+from __future__ import annotations
+
+import argparse
+import http.server
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import quote, unquote
+
+import requests
+
+_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+_ROUTES = ("index", "list", "file", "lookup", "export")
+
+
+# ---- Wiktionary スタブ ----
+
+def _canned_pages(n: int, seed: int = 0) -> Dict[str, str]:
+    """word0..word{n-1} の記事。1割は別の語への #REDIRECT、残りは品詞と {{t|ja|...}} の訳を持つ。"""
+    rng = random.Random(seed)
+    pos = ("Noun", "Verb", "Adjective", "Adverb")
+    pages: Dict[str, str] = {}
+    for i in range(n):
+        title = f"word{i}"
+        if i % 10 == 9:
+            pages[title] = f"#REDIRECT [[word{i - 1}]]"
+            continue
+        ja = "".join(f"{{{{t+|ja|訳{i}_{k}}}}} " for k in range(rng.randint(1, 4)))
+        pages[title] = f"==English==\n==={rng.choice(pos)}===\n# sense\n====Translations====\n{ja}\n"
+    return pages
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    pages: Dict[str, str] = {}
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        title = unquote(path.rpartition("/")[2])
+        if self.latency:
+            time.sleep(random.expovariate(1.0 / self.latency))
+        if "action=raw" not in query:
+            status, body = 400, b""
+        elif random.random() < self.error_rate:
+            status, body = 503, b"upstream error"
+        elif title in self.pages:
+            status, body = 200, self.pages[title].encode("utf-8")
+        else:
+            status, body = 404, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/x-wiki; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stub(pages: Dict[str, str], latency_ms: float, error_rate: float) -> http.server.ThreadingHTTPServer:
+    handler = type("Handler", (_StubHandler,), {
+        "pages": pages, "latency": latency_ms / 1000.0, "error_rate": error_rate,
+    })
+    http.server.ThreadingHTTPServer.request_queue_size = 1024
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="wiktionary-stub", daemon=True).start()
+    return srv
+
+
+# ---- アプリの起動 ----
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_app(args, stub_url: str, data_dir: str) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "WORDBOOK_WIKTIONARY_URL": stub_url,
+        "WORDBOOK_LOOKUP_CHAIN": args.lookup_chain,
+        "WORDBOOK_UPSTREAM_RATE": str(args.upstream_rate),
+        "WORDBOOK_UPSTREAM_BURST": str(args.upstream_rate),
+        "WORDBOOK_PDF_CACHE_DIR": os.path.join(data_dir, "pdf-cache"),
+        "WORDBOOK_PRESET_PDF_DIR": os.path.join(data_dir, "preset-pdf"),
+        "WORDBOOK_EXPORT_JOB_DIR": os.path.join(data_dir, "export-jobs"),
+        "WORDBOOK_METRICS_DIR": os.path.join(data_dir, "metrics"),
+        "WORDBOOK_PREBUILD_INTERVAL": "0",
+    })
+    cmd = [sys.executable, _APP]
+    if args.server == "serve":
+        cmd += ["serve", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(args.workers), "--threads", str(args.threads)]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"app exited with status {proc.returncode}")
+        try:
+            if requests.get(url + "/", timeout=2).status_code == 200:
+                return (proc, url)
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("app did not become ready within 60s")
+
+
+# ---- 負荷 ----
+
+def _parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix: List[Tuple[str, float]] = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in _ROUTES:
+            raise SystemExit(f"unknown route in --mix: {name!r} (choose from {', '.join(_ROUTES)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class _Driver:
+    def __init__(self, url: str, args, words: List[str], preset_paths: List[str]):
+        self.url = url
+        self.args = args
+        self.words = words
+        self.preset_paths = preset_paths
+        self.mix = _parse_mix(args.mix)
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {name: [] for name, _ in self.mix}
+        self.statuses: Dict[str, Dict[str, int]] = {name: {} for name, _ in self.mix}
+
+    def _request(self, session: requests.Session, route: str, rng: random.Random) -> requests.Response:
+        u, timeout = self.url, self.args.timeout
+        if route == "index":
+            return session.get(u + "/", timeout=timeout)
+        if route == "list":
+            return session.get(u + "/api/preset-csv/list", timeout=timeout)
+        if route == "file":
+            path = rng.choice(self.preset_paths) if self.preset_paths else "missing.csv"
+            return session.get(u + "/api/preset-csv/file?path=" + quote(path), timeout=timeout)
+        if route == "lookup":
+            if rng.random() < self.args.miss_rate:
+                word = f"unknown{rng.randrange(10 ** 6)}"
+            else:
+                # 大文字小文字の変種の解決も通るよう、ときどき大文字で引く
+                word = rng.choice(self.words)
+                word = word.upper() if rng.random() < 0.2 else word
+            return session.post(u + "/lookup", data=json.dumps({"word": word}), timeout=timeout)
+        rows = self.args.export_rows
+        start = rng.randrange(len(self.words))
+        items = [{"word": self.words[(start + i) % len(self.words)], "meaning": f"訳{(start + i) % 997}"}
+                 for i in range(rows)]
+        return session.post(u + "/export.pdf", data=json.dumps({"items": items}), timeout=timeout)
+
+    def worker(self, index: int, stop_at: float) -> None:
+        rng = random.Random(index)
+        names = [n for n, _ in self.mix]
+        weights = [w for _, w in self.mix]
+        with requests.Session() as session:
+            while time.time() < stop_at:
+                route = rng.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    r = self._request(session, route, rng)
+                    _ = r.content
+                    status = str(r.status_code)
+                except requests.RequestException as e:
+                    status = type(e).__name__
+                dt = time.perf_counter() - t0
+                with self.lock:
+                    self.latencies[route].append(dt)
+                    self.statuses[route][status] = self.statuses[route].get(status, 0) + 1
+
+    def run(self) -> Dict[str, object]:
+        stop_at = time.time() + self.args.duration
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for f in [pool.submit(self.worker, i, stop_at) for i in range(self.args.concurrency)]:
+                f.result()
+        elapsed = time.perf_counter() - t0
+
+        routes: Dict[str, object] = {}
+        total = 0
+        for name, values in self.latencies.items():
+            values.sort()
+            total += len(values)
+            routes[name] = {
+                "requests": len(values),
+                "rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+                "statuses": self.statuses[name],
+            }
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 2), "routes": routes}
+
+
+def _preset_paths(url: str) -> List[str]:
+    try:
+        data = requests.get(url + "/api/preset-csv/list", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        return []
+    files = data.get("files") or []
+    return [f["rel"] if isinstance(f, dict) else f for f in files if f]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--app-url", default="", help="起動済みのアプリ（省略時はスタブとアプリをここで起動する）")
+    ap.add_argument("--server", choices=("serve", "dev"), default="serve")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--mix", default="index=1,list=2,file=4,lookup=10,export=1")
+    ap.add_argument("--words", type=int, default=500, help="スタブに用意する語の数")
+    ap.add_argument("--miss-rate", type=float, default=0.1, help="スタブにない語を引く割合")
+    ap.add_argument("--export-rows", type=int, default=200)
+    ap.add_argument("--stub-latency-ms", type=float, default=80.0)
+    ap.add_argument("--stub-error-rate", type=float, default=0.02)
+    ap.add_argument("--upstream-rate", type=float, default=1000.0, help="アプリ側の WORDBOOK_UPSTREAM_RATE")
+    ap.add_argument("--lookup-chain", default="cache,wiktionary")
+    ap.add_argument("--out", default="", help="結果 JSON の書き出し先")
+    args = ap.parse_args()
+
+    pages = _canned_pages(args.words)
+    words = sorted(pages)
+    proc = None
+    stub = None
+    with tempfile.TemporaryDirectory(prefix="wordbook-load-") as data_dir:
+        try:
+            if args.app_url:
+                url = args.app_url.rstrip("/")
+            else:
+                stub = _start_stub(pages, args.stub_latency_ms, args.stub_error_rate)
+                stub_url = f"http://127.0.0.1:{stub.server_address[1]}/wiki/"
+                proc, url = _start_app(args, stub_url, data_dir)
+            driver = _Driver(url, args, words, _preset_paths(url))
+            result = driver.run()
+        finally:
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            if stub is not None:
+                stub.shutdown()
+
+    print(f"{'route':<8}{'reqs':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses", file=sys.stderr)
+    for name, r in result["routes"].items():
+        print(f"{name:<8}{r['requests']:>8}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"  {r['statuses']}", file=sys.stderr)
+    print(f"total   {result['requests']:>8}{result['rps']:>9.1f}", file=sys.stderr)
+
+    report = {
+        "bench": "load",
+        "server": "external" if args.app_url else args.server,
+        "workers": args.workers,
+        "threads": args.threads,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "stub_latency_ms": args.stub_latency_ms,
+        "stub_error_rate": args.stub_error_rate,
+        "export_rows": args.export_rows,
+        **result,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())